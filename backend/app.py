@@ -5,8 +5,17 @@ import logging
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import uuid
-from ocr_service import OCRService
+from ocr_service import QUALITY_MODES, OCRService
+from phash_index import PerceptualHashIndex
+from intermediate_cache import IntermediateCache
+from response_shaping import api_response, compressed_response
+from watcher import FolderWatcher
+from shadow import ShadowRunner, build_shadow_service
+from single_flight import SingleFlight, array_digest, file_digest
+import time
 import json
+import math
+import copy
 from flask import Response
 import cv2
 import pytesseract
@@ -40,6 +49,44 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # Inicializar servicio OCR
 ocr_service = OCRService(logger)
 
+# Índice de capturas ya procesadas (hash perceptual) para reutilizar OCR de reenvíos
+result_index = PerceptualHashIndex(
+    os.path.join(ocr_service.cache_dir, 'phash_index.jsonl'),
+    threshold=int(os.environ.get('OCR_PHASH_THRESHOLD', 20)),
+    # Misma decodificación que el OCR: cabecera comprobada y presupuesto de píxeles
+    loader=ocr_service.load_gray,
+    max_entries=int(os.environ.get('OCR_PHASH_MAX_ENTRIES', 5000)),
+    max_age_days=float(os.environ.get('OCR_PHASH_MAX_AGE_DAYS', 30)),
+    logger=logger,
+)
+
+# Intermedios de preprocesado por trabajo, para reprocesar sin repetir todo el pipeline
+intermediate_cache = IntermediateCache(
+    os.path.join(ocr_service.cache_dir, 'intermediates'),
+    ttl_seconds=int(os.environ.get('OCR_INTERMEDIATES_TTL', 3600)),
+    logger=logger,
+)
+
+# OCR en curso por contenido: las peticiones simultáneas de la misma imagen esperan al mismo cálculo
+inflight = SingleFlight(logger)
+
+# Evaluación en sombra: una fracción de las subidas se reprocesa con otra configuración
+shadow_runner = None
+if float(os.environ.get('OCR_SHADOW_SAMPLE', 0)) > 0:
+    try:
+        shadow_config = json.loads(os.environ.get('OCR_SHADOW_CONFIG', '{}'))
+        shadow_runner = ShadowRunner(
+            build_shadow_service(shadow_config, logger, thread_budget=ocr_service.thread_budget,
+                                 cache_dir=os.path.join(ocr_service.cache_dir, 'shadow')),
+            os.path.join(ocr_service.cache_dir, 'shadow_results.jsonl'),
+            sample_rate=float(os.environ['OCR_SHADOW_SAMPLE']),
+            config=shadow_config,
+            logger=logger,
+        )
+        logger.info(f"Shadow OCR enabled: sample={shadow_runner.sample_rate} config={shadow_config}")
+    except ValueError as e:
+        logger.error(f"Invalid shadow OCR configuration: {e}")
+
 def allowed_file(filename):
     """Verifica si el archivo tiene una extensión permitida"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -48,13 +95,165 @@ def generate_job_id():
     """Genera un ID único para el trabajo"""
     return f"JOB-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8].upper()}"
 
+def ocr_options(values):
+    """
+    Modo de calidad y deadline de una petición OCR
+
+    Args:
+        values: Parámetros de la petición (form/query o JSON)
+
+    Returns:
+        Tuple (mode o None, deadline_ms o None)
+
+    Raises:
+        ValueError: Si el modo o el deadline no son válidos
+    """
+    mode = values.get('mode') or None
+    if mode is not None and mode not in QUALITY_MODES:
+        raise ValueError(f"mode debe ser uno de: {', '.join(QUALITY_MODES)}")
+    deadline_ms = values.get('deadline_ms')
+    if deadline_ms in (None, ''):
+        return mode, None
+    try:
+        deadline_ms = float(deadline_ms)
+    except (TypeError, ValueError):
+        raise ValueError("deadline_ms debe ser un número de milisegundos") from None
+    # float() acepta 'nan' e 'inf'
+    if not math.isfinite(deadline_ms) or deadline_ms <= 0:
+        raise ValueError("deadline_ms debe ser un número positivo y finito")
+    return mode, deadline_ms
+
+def run_ocr(filepath, intermediates=None, mode=None, deadline_ms=None):
+    """
+    OCR de una captura, compartiendo el cálculo con las peticiones simultáneas de la misma imagen
+
+    Si otra petición ya está procesando una imagen con los mismos bytes (y el mismo
+    modo, deadline y prioridad) se espera a su resultado en lugar de repetir el OCR.
+    El resultado se copia, así que cada petición puede darle su propio job_id.
+
+    La prioridad forma parte de la clave: una subida interactiva nunca espera a un
+    cálculo del watcher, que cede el paso antes de cada llamada a Tesseract y corre
+    con menos hilos (inversión de prioridad).
+
+    Args:
+        filepath: Ruta de la captura
+        intermediates: Dict que recibe los intermedios de preprocesado (si se hace OCR)
+        mode: Modo de calidad (fast/balanced/thorough), por defecto el del servicio
+        deadline_ms: Tiempo máximo de OCR en ms
+
+    Returns:
+        Tuple (ocr_results dict, jobs parseados, info de reutilización o None,
+        True si el resultado viene de otra petición en curso)
+    """
+    try:
+        priority = 'background' if ocr_service.thread_budget.in_background() else 'interactive'
+        key = f"ocr:{file_digest(filepath)}:{mode or ''}:{deadline_ms or ''}:{priority}"
+    except OSError as e:
+        logger.warning(f"Could not hash {filepath} for in-flight dedup: {e}")
+        return _run_ocr(filepath, intermediates, mode, deadline_ms) + (False,)
+
+    (ocr_results, parsed_jobs, reused, leader_intermediates), coalesced = inflight.do(
+        key, lambda: _run_ocr(filepath, intermediates, mode, deadline_ms) + (intermediates,)
+    )
+    if not coalesced:
+        return ocr_results, parsed_jobs, reused, False
+
+    # Los intermedios (arrays de solo lectura) se comparten; los dicts se copian por petición
+    if intermediates is not None and leader_intermediates:
+        intermediates.update(leader_intermediates)
+    return copy.deepcopy(ocr_results), copy.deepcopy(parsed_jobs), copy.deepcopy(reused), True
+
+def _run_ocr(filepath, intermediates=None, mode=None, deadline_ms=None):
+    """
+    OCR de una captura reutilizando el resultado de una casi idéntica ya procesada
+
+    Returns:
+        Tuple (ocr_results dict, jobs parseados, info de reutilización o None)
+    """
+    signature = None
+    # Solo se reutilizan resultados del mismo modo de calidad
+    quality_mode = mode or ocr_service.quality_mode
+    try:
+        signature = result_index.compute(filepath)
+        match = result_index.lookup(signature, quality_mode)
+    except Exception as e:
+        logger.warning(f"Perceptual hash lookup failed: {e}")
+        match = None
+
+    if match:
+        record, distance = match
+        logger.info(f"Reusing OCR from {record.get('filename')} (distance={distance})")
+        reused = {
+            'filename': record.get('filename'),
+            'distance': distance,
+            'indexed_at': record.get('indexed_at'),
+        }
+        return record['ocr_results'], ocr_service.resolve_clients(record['jobs']), reused
+
+    if signature is not None:
+        # La imagen ya está decodificada (con el presupuesto de píxeles): el pipeline no la vuelve a leer
+        with ocr_service.preloaded_gray(filepath, signature.gray):
+            job_details = ocr_service.extract_job_details(filepath, intermediates, mode=mode,
+                                                          deadline_ms=deadline_ms)
+    else:
+        job_details = ocr_service.extract_job_details(filepath, intermediates, mode=mode, deadline_ms=deadline_ms)
+    # Intentar parsear múltiples jobs a partir del texto detectado
+    parsed_jobs = []
+    try:
+        parsed_jobs = ocr_service.parse_jobs_from_text(job_details.detected_text)
+    except Exception as _:
+        parsed_jobs = []
+
+    ocr_results = job_details.to_dict()
+    # Los resultados parciales (cortados por deadline) no se guardan para reutilizar
+    if signature is not None and ocr_results.get('detected_text') and not job_details.partial and \
+            not ocr_results['detected_text'].startswith('Error processing image'):
+        try:
+            result_index.add(signature, {
+                'filename': os.path.basename(filepath),
+                'ocr_results': ocr_results,
+                'jobs': parsed_jobs,
+            }, quality_mode)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not index OCR result of {filepath}: {e}")
+    # El índice guarda los trabajos sin resolver: el cliente se resuelve con la lista vigente
+    return ocr_results, ocr_service.resolve_clients(parsed_jobs), None
+
+def start_folder_watcher():
+    """
+    Arranca el OCR en segundo plano de las carpetas de OCR_WATCH_DIRS (separadas por os.pathsep)
+
+    Returns:
+        El FolderWatcher arrancado, o None si no hay carpetas configuradas
+    """
+    directories = [d.strip() for d in os.environ.get('OCR_WATCH_DIRS', '').split(os.pathsep) if d.strip()]
+    if not directories:
+        return None
+    watcher = FolderWatcher(
+        directories,
+        process=run_ocr,
+        thread_budget=ocr_service.thread_budget,
+        poll_interval=float(os.environ.get('OCR_WATCH_INTERVAL', 2.0)),
+        max_queue=int(os.environ.get('OCR_WATCH_QUEUE', 100)),
+        logger=logger,
+    )
+    watcher.start()
+    return watcher
+
+# Con el reloader de Flask solo se arranca en el proceso hijo que sirve las peticiones
+folder_watcher = None
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    folder_watcher = start_folder_watcher()
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Endpoint de health check"""
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'service': 'OCR Service'
+        'service': 'OCR Service',
+        'ocr_timeouts': ocr_service.timeout_stats(),
+        'ocr_coalesced': inflight.stats()
     })
 
 @app.route('/test', methods=['GET'])
@@ -422,6 +621,9 @@ def test_page():
 def upload_preview():
     """
     Endpoint para subir y procesar captura de pantalla
+
+    Parámetros opcionales (form o query): mode (fast/balanced/thorough) y deadline_ms.
+    Query params opcionales: fields / exclude (ver response_shaping)
     """
     logger.info("Received upload request")
     try:
@@ -440,6 +642,11 @@ def upload_preview():
             return jsonify({
                 'error': f'Tipo de archivo no permitido. Use: {", ".join(ALLOWED_EXTENSIONS)}'
             }), 400
+
+        try:
+            mode, deadline_ms = ocr_options(request.values)
+        except ValueError as e:
+            return jsonify({'error': 'Parámetros OCR inválidos', 'message': str(e)}), 400
         
         # Generar nombre seguro para el archivo
         original_filename = secure_filename(file.filename)
@@ -451,15 +658,12 @@ def upload_preview():
         file.save(filepath)
         logger.info(f"Archivo guardado: {filepath}")
         
-        # Procesar con OCR
-        job_details = ocr_service.extract_job_details(filepath)
-        # Intentar parsear múltiples jobs a partir del texto detectado
-        parsed_jobs = []
-        try:
-            parsed_jobs = ocr_service.parse_jobs_from_text(job_details.detected_text)
-        except Exception as _:
-            parsed_jobs = []
-        
+        # Procesar con OCR (o reutilizar el de una captura casi idéntica)
+        intermediates = {}
+        ocr_start = time.perf_counter()
+        ocr_results, parsed_jobs, reused, coalesced = run_ocr(filepath, intermediates, mode, deadline_ms)
+        ocr_latency_ms = (time.perf_counter() - ocr_start) * 1000
+
         # Generar ID único para el trabajo
         job_id = generate_job_id()
         
@@ -470,12 +674,30 @@ def upload_preview():
             'filename': filename,
             'filepath': filepath,
             'processed_at': datetime.now().isoformat(),
-            'ocr_results': job_details.to_dict(),
-            'jobs': parsed_jobs
+            'ocr_results': ocr_results,
+            'jobs': parsed_jobs,
+            'reused_ocr': reused is not None,
+            'coalesced_ocr': coalesced
         }
+        if reused:
+            response_data['reused_from'] = reused
         
         logger.info(f"Procesamiento completado para: {filename}")
-        return jsonify(response_data), 200
+        response = api_response(response_data)
+        if intermediates:
+            # Los .npy se escriben una vez enviada la respuesta, fuera de la latencia de la subida
+            def _store_intermediates():
+                try:
+                    intermediate_cache.put(job_id, intermediates)
+                except Exception as e:
+                    logger.warning(f"No se pudieron guardar intermedios de {job_id}: {e}")
+            response.call_on_close(_store_intermediates)
+        # Sombra solo sobre OCR real (no reutilizado ni compartido), una vez enviada la respuesta
+        if shadow_runner and not reused and not coalesced and shadow_runner.should_sample():
+            response.call_on_close(
+                lambda: shadow_runner.submit(filepath, job_id, ocr_latency_ms, parsed_jobs)
+            )
+        return response
         
     except Exception as e:
         logger.error(f"Error procesando archivo: {e}")
@@ -488,26 +710,69 @@ def upload_preview():
 def reprocess_job(job_id):
     """
     Endpoint para reprocesar un trabajo existente con diferentes parámetros
+
+    Body JSON:
+        filepath: Ruta del archivo subido
+        psm: (opcional) PSM de Tesseract a probar
+        variant: (opcional) intermedio a reconocer: 'gray', 'enhanced' o 'final'
+        mode, deadline_ms: (opcionales) modo de calidad y deadline del pipeline completo
+
+    Si los intermedios del trabajo siguen en caché se ejecuta solo una pasada de
+    reconocimiento (por defecto sobre 'final' con --psm 6), que es lo que pide el
+    botón "reprocesar" del frontend (solo envía filepath). El pipeline completo se
+    repite si se piden mode o deadline_ms, o si no hay intermedios (caducados, o
+    la subida reutilizó un OCR anterior).
     """
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         filepath = data.get('filepath')
-        
-        if not filepath or not os.path.exists(filepath):
-            return jsonify({'error': 'Archivo no encontrado'}), 404
-        
-        # Reprocesar
-        job_details = ocr_service.extract_job_details(filepath)
-        
+        psm = data.get('psm')
+        variant = data.get('variant')
+
+        # Los reprocesos simultáneos de la misma imagen con los mismos parámetros comparten el cálculo
+        full_pipeline = data.get('mode') is not None or data.get('deadline_ms') is not None
+        cached = None if full_pipeline else intermediate_cache.get(job_id)
+        if cached:
+            try:
+                variant = variant or 'final'
+                psm = int(psm if psm is not None else 6)
+                # Clave por los píxeles que se van a reconocer (el intermedio o el gris del que se recalcula)
+                source = cached.get(variant) if variant != 'gray' else None
+                if source is None:
+                    source = cached.get('gray')
+                content = array_digest(source) if source is not None else job_id
+                job_details, coalesced = inflight.do(
+                    f"reprocess:{content}:{variant}:{psm}",
+                    lambda: ocr_service.reprocess_intermediates(cached, variant=variant, psm=psm)
+                )
+            except (TypeError, ValueError) as e:
+                return jsonify({'error': 'Parámetros de reproceso inválidos', 'message': str(e)}), 400
+        else:
+            if not filepath or not os.path.exists(filepath):
+                return jsonify({'error': 'Archivo no encontrado'}), 404
+
+            try:
+                mode, deadline_ms = ocr_options(data)
+            except ValueError as e:
+                return jsonify({'error': 'Parámetros OCR inválidos', 'message': str(e)}), 400
+
+            # Reprocesar desde cero
+            job_details, coalesced = inflight.do(
+                f"reprocess:{file_digest(filepath)}:{mode or ''}:{deadline_ms or ''}",
+                lambda: ocr_service.extract_job_details(filepath, mode=mode, deadline_ms=deadline_ms)
+            )
+
         response_data = {
             'success': True,
             'job_id': job_id,
             'reprocessed_at': datetime.now().isoformat(),
+            'from_cache': bool(cached),
+            'coalesced_ocr': coalesced,
             'ocr_results': job_details.to_dict()
         }
-        
-        return jsonify(response_data), 200
-        
+
+        return api_response(response_data)
+
     except Exception as e:
         logger.error(f"Error reprocesando trabajo {job_id}: {e}")
         return jsonify({
@@ -515,6 +780,13 @@ def reprocess_job(job_id):
             'message': str(e)
         }), 500
 
+@app.route('/api/shadow/report', methods=['GET'])
+def shadow_report():
+    """Resumen de la evaluación en sombra (latencias y coincidencia de trabajos)"""
+    if shadow_runner is None:
+        return jsonify({'enabled': False})
+    return jsonify(shadow_runner.report())
+
 @app.route('/api/validate-job', methods=['POST'])
 def validate_job():
     """
@@ -583,6 +855,11 @@ def ocr_text_plain():
         if not allowed_file(file.filename):
             return Response("Unsupported file type", status=400, mimetype='text/plain; charset=utf-8')
 
+        try:
+            mode, deadline_ms = ocr_options(request.values)
+        except ValueError as e:
+            return Response(str(e), status=400, mimetype='text/plain; charset=utf-8')
+
         # Guardar temporalmente en uploads
         original_filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -590,10 +867,15 @@ def ocr_text_plain():
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
 
-        # OCR
-        details = ocr_service.extract_job_details(filepath)
-        text = details.detected_text or ""
-        return Response(text, status=200, mimetype='text/plain; charset=utf-8')
+        # OCR (o reutilizar el de una captura casi idéntica)
+        ocr_results, _, reused, coalesced = run_ocr(filepath, mode=mode, deadline_ms=deadline_ms)
+        text = ocr_results.get('detected_text') or ""
+        response = compressed_response(text.encode('utf-8'), 'text/plain; charset=utf-8')
+        response.headers['X-OCR-Reused'] = 'true' if reused else 'false'
+        response.headers['X-OCR-Coalesced'] = 'true' if coalesced else 'false'
+        response.headers['X-OCR-Partial'] = 'true' if ocr_results.get('partial') else 'false'
+        response.headers['X-OCR-Status'] = ocr_results.get('status', 'ok')
+        return response
 
     except Exception as e:
         logger.error(f"/api/ocr-text error: {e}")
@@ -0,0 +1,264 @@
+"""
+OCR por lotes de un archivo de capturas, con reanudación.
+
+Cada imagen terminada se anota en un archivo de checkpoint junto con la
+versión del pipeline; al relanzar el mismo comando se saltan las ya hechas
+con esa versión (y sin cambios en el archivo), así que un proceso
+interrumpido continúa donde se quedó y un cambio de PIPELINE_VERSION vuelve a
+procesarlo todo.
+
+Con --processes el OCR corre en procesos separados (sin compartir el GIL);
+el proceso principal decodifica cada imagen y se la pasa al worker por
+memoria compartida (shm_transport) en lugar de serializarla con pickle.
+
+Uso:
+    python batch_ocr.py uploads --workers 4 --output resultados.jsonl
+    python batch_ocr.py "archivo/2025-*/*.png" --format csv --output resultados.csv
+    python batch_ocr.py uploads --processes 4 --output resultados.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from common import collect_images, quiet_logger
+from ocr_service import PIPELINE_VERSION, OCRService, ThreadBudget
+from shm_transport import SharedImage, ShmTransport, attach
+
+CSV_COLUMNS = [
+    'path', 'pipeline_version', 'processed_at', 'elapsed_s', 'confidence',
+    'jobs_count', 'job_codes', 'error', 'detected_text',
+]
+
+
+def _checkpoint_key(path: str) -> str:
+    """Clave de checkpoint: versión + ruta + tamaño/mtime (un archivo modificado se repite)"""
+    st = os.stat(path)
+    return f"{PIPELINE_VERSION}\t{os.path.abspath(path)}\t{st.st_size}\t{int(st.st_mtime)}"
+
+
+def _load_checkpoint(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def _process(service: OCRService, path: str, gray=None) -> Dict:
+    """OCR de una imagen como registro de salida (gray: imagen ya decodificada, opcional)"""
+    start = time.perf_counter()
+    record = {
+        'path': path,
+        'pipeline_version': PIPELINE_VERSION,
+        'processed_at': datetime.now().isoformat(),
+        'error': None,
+    }
+    try:
+        if gray is not None:
+            with service.preloaded_gray(path, gray):
+                details = service.extract_job_details(path)
+        else:
+            details = service.extract_job_details(path)
+        record['ocr_results'] = details.to_dict()
+        record['jobs'] = service.resolve_clients(service.parse_jobs_from_text(details.detected_text or ''))
+        if (details.detected_text or '').startswith('Error processing image'):
+            record['error'] = details.detected_text
+    except Exception as e:
+        record['ocr_results'] = None
+        record['jobs'] = []
+        record['error'] = str(e)
+    record['elapsed_s'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+# Servicio de cada proceso worker (modo --processes)
+_worker_service: Optional[OCRService] = None
+
+
+def _init_worker(threads: int):
+    global _worker_service
+    _worker_service = OCRService(quiet_logger('batch_ocr'), thread_budget=ThreadBudget(total_threads=threads))
+
+
+def _process_shared(path: str, handle: Dict) -> Dict:
+    """Worker de proceso: OCR sobre la imagen que el proceso principal dejó en memoria compartida"""
+    with attach(SharedImage.from_dict(handle)) as gray:
+        return _process(_worker_service, path, gray)
+
+
+def _process_path(path: str) -> Dict:
+    """Worker de proceso: OCR leyendo el archivo (si el proceso principal no pudo decodificarlo)"""
+    return _process(_worker_service, path)
+
+
+def _csv_row(record: Dict) -> Dict:
+    ocr = record.get('ocr_results') or {}
+    return {
+        'path': record['path'],
+        'pipeline_version': record['pipeline_version'],
+        'processed_at': record['processed_at'],
+        'elapsed_s': record['elapsed_s'],
+        'confidence': ocr.get('confidence', ''),
+        'jobs_count': len(record['jobs']),
+        'job_codes': '; '.join(job.get('job_code', '') for job in record['jobs']),
+        'error': record['error'] or '',
+        'detected_text': ocr.get('detected_text', ''),
+    }
+
+
+def _format_eta(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{secs:02d}"
+
+
+def run(args) -> int:
+    images = collect_images(args.source, args.limit)
+    if not images:
+        print(f"❌ No hay imágenes en {args.source}")
+        return 1
+
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint"
+    done = _load_checkpoint(checkpoint_path)
+    pending = []
+    for path in images:
+        try:
+            key = _checkpoint_key(path)
+        except OSError:
+            continue
+        if key not in done:
+            pending.append((path, key))
+
+    skipped = len(images) - len(pending)
+    print(f"=== OCR POR LOTES (pipeline {PIPELINE_VERSION}) ===")
+    workers = f"{args.processes} procesos" if args.processes else f"{args.workers} workers"
+    print(f"{len(images)} imágenes, {skipped} ya procesadas, {len(pending)} pendientes, {workers}")
+    if not pending:
+        return 0
+
+    service = OCRService(quiet_logger('batch_ocr'), thread_budget=ThreadBudget())
+    concurrency = args.processes or args.workers
+    transport = None
+    if args.processes:
+        transport = ShmTransport(logger=service.logger)
+        transport.cleanup_leaked()
+        cpus = os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=args.processes, initializer=_init_worker,
+                                   initargs=(max(1, cpus // args.processes),))
+    else:
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+    # future -> (clave de checkpoint, handle de memoria compartida o None)
+    in_flight = {}
+
+    def _submit(path: str, key: str):
+        if transport is None:
+            in_flight[pool.submit(_process, service, path)] = (key, None)
+            return
+        try:
+            handle = transport.put(service.load_gray(path))
+        except Exception as e:
+            # Error de decodificación: el worker lo reintenta y lo reporta como cualquier otro
+            service.logger.warning(f"Could not decode {path} for worker: {e}")
+            in_flight[pool.submit(_process_path, path)] = (key, None)
+            return
+        in_flight[pool.submit(_process_shared, path, handle.to_dict())] = (key, handle)
+
+    is_csv = args.format == 'csv'
+    write_header = is_csv and (not os.path.exists(args.output) or os.path.getsize(args.output) == 0)
+    out = open(args.output, 'a', encoding='utf-8', newline='')
+    checkpoint = open(checkpoint_path, 'a', encoding='utf-8')
+    writer = csv.DictWriter(out, fieldnames=CSV_COLUMNS) if is_csv else None
+    if write_header:
+        writer.writeheader()
+
+    completed = errors = 0
+    start = time.perf_counter()
+    queue = iter(pending)
+    try:
+        # Ventana acotada de trabajos en vuelo (y de memoria compartida) para poder
+        # cortar sin perder mucho
+        for path, key in queue:
+            _submit(path, key)
+            if len(in_flight) >= concurrency * 2:
+                break
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key, handle = in_flight.pop(future)
+                if handle is not None:
+                    transport.release(handle)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # Pool roto (p. ej. un worker murió): lo que no está en el checkpoint
+                    # se repite al relanzar; la memoria compartida se libera en el finally
+                    sys.stderr.write('\n')
+                    print(f"❌ Falló un worker OCR ({e}); relanza el mismo comando para continuar")
+                    return 1
+                if is_csv:
+                    writer.writerow(_csv_row(record))
+                else:
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                # El resultado se escribe antes que el checkpoint: al reanudar
+                # como mucho se repite una imagen, nunca se pierde
+                out.flush()
+                checkpoint.write(key + '\n')
+                checkpoint.flush()
+
+                completed += 1
+                errors += record['error'] is not None
+                elapsed = time.perf_counter() - start
+                rate = completed / elapsed if elapsed > 0 else 0.0
+                eta = (len(pending) - completed) / rate if rate > 0 else 0.0
+                sys.stderr.write(
+                    f"\r[{completed}/{len(pending)}] {rate:.2f} img/s  ETA {_format_eta(eta)}  errores {errors}  "
+                )
+                sys.stderr.flush()
+
+                next_item = next(queue, None)
+                if next_item:
+                    _submit(*next_item)
+    except KeyboardInterrupt:
+        sys.stderr.write('\n')
+        print(f"⏸️  Interrumpido tras {completed} imágenes; relanza el mismo comando para continuar")
+        return 130
+    finally:
+        # Sin esperar a lo encolado: lo no escrito queda pendiente en el checkpoint
+        pool.shutdown(wait=False, cancel_futures=True)
+        if transport is not None:
+            transport.close_all()
+        out.close()
+        checkpoint.close()
+
+    elapsed = time.perf_counter() - start
+    sys.stderr.write('\n')
+    print(f"✅ {completed} imágenes en {elapsed:.1f}s ({completed / elapsed if elapsed > 0 else 0:.2f} img/s), "
+          f"{errors} con error → {args.output}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OCR por lotes con reanudación')
+    parser.add_argument('source', help='Directorio o patrón glob de imágenes')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='Imágenes procesadas en paralelo')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Usar N procesos worker (imágenes por memoria compartida) en lugar de hilos')
+    parser.add_argument('--output', default='batch_results.jsonl', help='Archivo de salida (se añade al final)')
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default=None,
+                        help='Formato de salida (por defecto según la extensión de --output)')
+    parser.add_argument('--checkpoint', default='', help='Archivo de checkpoint (por defecto <output>.checkpoint)')
+    parser.add_argument('--limit', type=int, default=0, help='Máximo de imágenes (0 = todas)')
+    args = parser.parse_args()
+    if args.format is None:
+        args.format = 'csv' if args.output.lower().endswith('.csv') else 'jsonl'
+    sys.exit(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmarks del servicio OCR.
+
+Uso:
+    python bench_ocr.py threads [--images uploads] [--concurrency 1,2,4]
+    python bench_ocr.py memory [--images uploads] [--concurrency 1,2,4]
+    python bench_ocr.py batch [--images uploads] [--batch-size 16]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List
+
+# Sin caché por línea: desde la segunda configuración o ronda todas las líneas serían
+# aciertos y se mediría la caché, no el OCR (se hereda en los procesos del pool)
+os.environ['OCR_LINE_CACHE'] = '0'
+
+from common import collect_images, quiet_logger
+from ocr_service import OCRService, ThreadBudget, peak_rss_mb
+
+def bench_threads(args):
+    """Mide imágenes/s para cada combinación concurrencia x hilos por llamada"""
+    images = collect_images(args.images, args.limit)
+    if not images:
+        print(f"❌ No hay imágenes en {args.images}")
+        return
+
+    cpus = os.cpu_count() or 1
+    concurrency_levels = [int(c) for c in args.concurrency.split(',')] if args.concurrency else \
+        sorted({1, 2, max(1, cpus // 2), cpus})
+    splits = [t for t in (1, 2, 4, 8, 16, 32) if t <= cpus]
+
+    logger = quiet_logger('bench_ocr')
+    print(f"=== BENCHMARK HILOS ({cpus} núcleos, {len(images)} imágenes) ===")
+    print(f"{'concurrencia':>12} {'hilos/llamada':>14} {'img/s':>8} {'seg':>8}")
+
+    for concurrency in concurrency_levels:
+        best = None
+        for threads in splits:
+            if concurrency * threads > cpus * 2:
+                continue
+            service = OCRService(logger, thread_budget=ThreadBudget(total_threads=concurrency * threads))
+            work = images * args.rounds
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(service.extract_job_details, work))
+            elapsed = time.perf_counter() - start
+            rate = len(work) / elapsed if elapsed > 0 else 0.0
+            print(f"{concurrency:>12} {threads:>14} {rate:>8.2f} {elapsed:>8.2f}")
+            if best is None or rate > best[1]:
+                best = (threads, rate)
+        if best:
+            print(f"→ Mejor reparto con {concurrency} llamadas: {best[0]} hilos/llamada ({best[1]:.2f} img/s)")
+
+
+def _memory_run(images: List[str], concurrency: int) -> tuple:
+    """Ejecuta en un proceso limpio y devuelve (RSS base, RSS pico) en MB"""
+    service = OCRService(quiet_logger('bench_ocr'))
+    baseline = peak_rss_mb()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(service.extract_job_details, images * concurrency))
+    return baseline, peak_rss_mb()
+
+
+def bench_memory(args):
+    """Mide el pico de RSS por petición concurrente"""
+    images = collect_images(args.images, args.limit)
+    if not images:
+        print(f"❌ No hay imágenes en {args.images}")
+        return
+
+    cpus = os.cpu_count() or 1
+    concurrency_levels = [int(c) for c in args.concurrency.split(',')] if args.concurrency else \
+        sorted({1, 2, max(1, cpus // 2), cpus})
+
+    print(f"=== BENCHMARK MEMORIA ({len(images)} imágenes) ===")
+    print(f"{'concurrencia':>12} {'RSS base MB':>12} {'RSS pico MB':>12} {'MB/petición':>12}")
+    for concurrency in concurrency_levels:
+        # Proceso nuevo por nivel: ru_maxrss es un máximo acumulado del proceso
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            baseline, peak = pool.submit(_memory_run, images, concurrency).result()
+        per_request = (peak - baseline) / concurrency
+        print(f"{concurrency:>12} {baseline:>12.1f} {peak:>12.1f} {per_request:>12.1f}")
+
+
+def bench_batch(args):
+    """Compara process_batch imagen a imagen contra la invocación agrupada de Tesseract"""
+    images = collect_images(args.images, args.limit)
+    if not images:
+        print(f"❌ No hay imágenes en {args.images}")
+        return
+
+    service = OCRService(quiet_logger('bench_ocr'))
+    service.batch_size = args.batch_size
+    print(f"=== BENCHMARK LOTES ({len(images)} imágenes, lotes de {args.batch_size}) ===")
+    print(f"{'modo':>12} {'img/s':>8} {'seg':>8} {'trabajos':>9}")
+    rates = {}
+    for label, batched in (('individual', False), ('agrupado', True)):
+        start = time.perf_counter()
+        results = service.process_batch(images, batched=batched)
+        elapsed = time.perf_counter() - start
+        jobs = sum(len(service.parse_jobs_from_text(r.detected_text or '')) for r in results)
+        rates[label] = len(images) / elapsed if elapsed > 0 else 0.0
+        print(f"{label:>12} {rates[label]:>8.2f} {elapsed:>8.2f} {jobs:>9}")
+    if rates['individual'] > 0:
+        print(f"→ Aceleración del modo agrupado: {rates['agrupado'] / rates['individual']:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks del servicio OCR')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_threads = sub.add_parser('threads', help='Reparto de hilos Tesseract/OpenCV bajo concurrencia')
+    p_threads.add_argument('--images', default='uploads', help='Directorio o patrón glob de imágenes')
+    p_threads.add_argument('--limit', type=int, default=8, help='Máximo de imágenes (0 = todas)')
+    p_threads.add_argument('--rounds', type=int, default=1, help='Veces que se procesa cada imagen')
+    p_threads.add_argument('--concurrency', default='', help='Niveles de concurrencia, ej. 1,2,4')
+    p_threads.set_defaults(func=bench_threads)
+
+    p_memory = sub.add_parser('memory', help='Pico de RSS por petición concurrente')
+    p_memory.add_argument('--images', default='uploads', help='Directorio o patrón glob de imágenes')
+    p_memory.add_argument('--limit', type=int, default=8, help='Máximo de imágenes (0 = todas)')
+    p_memory.add_argument('--concurrency', default='', help='Niveles de concurrencia, ej. 1,2,4')
+    p_memory.set_defaults(func=bench_memory)
+
+    p_batch = sub.add_parser('batch', help='process_batch individual vs. Tesseract agrupado')
+    p_batch.add_argument('--images', default='uploads', help='Directorio o patrón glob de imágenes')
+    p_batch.add_argument('--limit', type=int, default=32, help='Máximo de imágenes (0 = todas)')
+    p_batch.add_argument('--batch-size', type=int, default=16, help='Imágenes por invocación de Tesseract')
+    p_batch.set_defaults(func=bench_batch)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Lista de clientes del negocio para el OCR.
+
+El archivo puede ser un CSV exportado de la tabla de clientes (columnas
+id/nombre, con o sin encabezado) o un texto plano con un nombre por línea.
+"""
+import csv
+import logging
+import os
+import threading
+import unicodedata
+from typing import List, Optional, Tuple
+
+ID_COLUMNS = ('id', 'client_id', 'customer_id', 'cliente_id')
+NAME_COLUMNS = ('name', 'nombre', 'client_name', 'customer_name', 'cliente')
+
+
+def read_client_list(path: str) -> List[Tuple[str, str]]:
+    """
+    Lee la lista de clientes
+
+    Args:
+        path: Ruta al archivo CSV/TXT
+
+    Returns:
+        Lista de tuplas (client_id, nombre); client_id es '' si el archivo no lo trae
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        content = f.read()
+
+    lines = [line for line in content.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    try:
+        dialect = csv.Sniffer().sniff(lines[0], delimiters=',;\t')
+    except csv.Error:
+        # Una sola columna: un nombre por línea
+        return [('', line.strip()) for line in lines]
+
+    rows = list(csv.reader(lines, dialect))
+    header = [col.strip().lower() for col in rows[0]]
+    id_idx, name_idx = 0, 1
+    if any(col in NAME_COLUMNS for col in header):
+        name_idx = next(i for i, col in enumerate(header) if col in NAME_COLUMNS)
+        id_idx = next((i for i, col in enumerate(header) if col in ID_COLUMNS), None)
+        rows = rows[1:]
+
+    clients = []
+    for row in rows:
+        if name_idx >= len(row) or not row[name_idx].strip():
+            continue
+        client_id = row[id_idx].strip() if id_idx is not None and id_idx < len(row) else ''
+        clients.append((client_id, row[name_idx].strip()))
+    return clients
+
+
+def to_job_code_name(name: str) -> str:
+    """Nombre tal como aparece en los códigos de trabajo: CARLOS_LEON"""
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    words = [w for w in ''.join(c if c.isalnum() else ' ' for c in ascii_name.upper()).split() if w]
+    return '_'.join(words)
+
+
+class ClientUserWords:
+    """Archivo user-words de Tesseract generado desde la lista de clientes
+
+    Se reconstruye solo cuando cambia el archivo de origen (mtime/tamaño).
+    """
+
+    def __init__(self, client_list_path: str, cache_dir: str, logger: Optional[logging.Logger] = None):
+        self.client_list_path = client_list_path
+        self.words_path = os.path.join(cache_dir, 'client_names.user-words')
+        self.logger = logger or logging.getLogger(__name__)
+        self._signature: Optional[Tuple[float, int]] = None
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _build(self):
+        words = set()
+        for _, name in read_client_list(self.client_list_path):
+            code_name = to_job_code_name(name)
+            if not code_name:
+                continue
+            words.add(code_name)
+            words.update(code_name.split('_'))
+
+        tmp_path = f"{self.words_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(sorted(words)) + '\n')
+        os.replace(tmp_path, self.words_path)
+        self.logger.info(f"Client user-words rebuilt: {len(words)} words from {self.client_list_path}")
+
+    def get_path(self) -> Optional[str]:
+        """
+        Ruta al archivo user-words actualizado
+
+        Returns:
+            Ruta del archivo, o None si la lista de clientes no está disponible
+        """
+        try:
+            st = os.stat(self.client_list_path)
+        except OSError:
+            return None
+
+        signature = (st.st_mtime, st.st_size)
+        with self._lock:
+            if signature != self._signature or not os.path.exists(self.words_path):
+                try:
+                    self._build()
+                except Exception as e:
+                    self.logger.error(f"Could not build client user-words: {e}")
+                    return None
+                self._signature = signature
+        return self.words_path
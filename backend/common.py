@@ -0,0 +1,92 @@
+"""
+Utilidades compartidas por el servidor y las herramientas de línea de comandos
+(bench_ocr, batch_ocr, load_test).
+
+Solo usa la biblioteca estándar: load_test se ejecuta desde máquinas cliente
+sin las dependencias del OCR.
+"""
+import glob
+import logging
+import os
+from contextlib import contextmanager
+from typing import List
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:  # POSIX
+    msvcrt = None
+
+IMAGE_PATTERNS = ('*.png', '*.jpg', '*.jpeg')
+
+
+def collect_images(source: str, limit: int = 0) -> List[str]:
+    """
+    Lista de imágenes a procesar: un directorio o un patrón glob
+
+    Args:
+        source: Directorio (se toman *.png, *.jpg, *.jpeg) o patrón glob
+        limit: Máximo de imágenes (0 = todas)
+
+    Returns:
+        Rutas ordenadas, sin las copias invertidas (_inverted) que deja el OCR
+    """
+    if os.path.isdir(source):
+        paths = []
+        for pattern in IMAGE_PATTERNS:
+            paths.extend(glob.glob(os.path.join(source, pattern)))
+    else:
+        paths = glob.glob(source)
+    paths = sorted(p for p in paths if '_inverted' not in p)
+    return paths[:limit] if limit else paths
+
+
+def quiet_logger(name: str) -> logging.Logger:
+    """Logger que solo muestra avisos y errores (el servicio OCR registra cada etapa)"""
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.WARNING)
+    return logger
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil pct (0-100) por el método del rango más cercano; 0.0 si no hay valores"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Lock exclusivo entre procesos sobre `path`.lock mientras dure el bloque
+
+    Para archivos compartidos por el servidor y los procesos de batch_ocr (cachés
+    JSONL que se añaden y se compactan). Bloquea hasta obtenerlo.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f"{path}.lock", 'a+b') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            handle.seek(0)
+            while True:
+                try:
+                    # LK_LOCK reintenta durante ~10 s y luego falla: seguir esperando
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
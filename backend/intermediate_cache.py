@@ -0,0 +1,90 @@
+"""
+Caché en disco de los intermedios de preprocesado por trabajo.
+
+Cada trabajo guarda sus arrays (gris, realzado, binaria final) como .npy en su
+propio directorio; al reprocesar se abren con memoria mapeada, sin decodificar
+ni repetir denoise/CLAHE/umbrales. Las entradas caducan tras un TTL.
+"""
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class IntermediateCache:
+    """Intermedios por job_id en archivos .npy memory-mapped con caducidad"""
+
+    def __init__(self, root_dir: str, ttl_seconds: int = 3600, logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            root_dir: Directorio raíz de la caché
+            ttl_seconds: Segundos que se conservan los intermedios de un trabajo
+            logger: Logger, crea uno si no se da
+        """
+        self.root_dir = root_dir
+        self.ttl_seconds = ttl_seconds
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _job_dir(self, job_id: str) -> str:
+        safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', job_id)
+        return os.path.join(self.root_dir, safe_id)
+
+    def _expired(self, path: str, now: float) -> bool:
+        try:
+            return now - os.path.getmtime(path) > self.ttl_seconds
+        except OSError:
+            return True
+
+    def evict_expired(self) -> int:
+        """Borra los trabajos caducados; devuelve cuántos se borraron"""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for name in os.listdir(self.root_dir):
+                path = os.path.join(self.root_dir, name)
+                if os.path.isdir(path) and self._expired(path, now):
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+        if removed:
+            self.logger.info(f"Evicted {removed} expired intermediate sets")
+        return removed
+
+    def put(self, job_id: str, arrays: Dict[str, np.ndarray]):
+        """Guarda los intermedios de un trabajo (reemplaza los anteriores)"""
+        self.evict_expired()
+        job_dir = self._job_dir(job_id)
+        tmp_dir = f"{job_dir}.tmp"
+        with self._lock:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+            shutil.rmtree(job_dir, ignore_errors=True)
+            os.replace(tmp_dir, job_dir)
+
+    def get(self, job_id: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Intermedios de un trabajo, abiertos en modo memoria mapeada (solo lectura)
+
+        Returns:
+            Dict nombre -> array, o None si no hay o caducaron
+        """
+        job_dir = self._job_dir(job_id)
+        with self._lock:
+            if not os.path.isdir(job_dir):
+                return None
+            if self._expired(job_dir, time.time()):
+                shutil.rmtree(job_dir, ignore_errors=True)
+                return None
+            arrays = {}
+            for filename in os.listdir(job_dir):
+                if filename.endswith('.npy'):
+                    arrays[filename[:-4]] = np.load(os.path.join(job_dir, filename), mmap_mode='r')
+        return arrays or None
@@ -0,0 +1,203 @@
+"""
+Registro de layouts conocidos (ventanas del RIP / cola de impresión).
+
+La mayoría de capturas vienen de las mismas ventanas, con la lista de trabajos
+siempre en la misma posición respecto al marco de la ventana. Cada plantilla
+guarda una huella de la estructura (líneas largas horizontales/verticales a
+baja resolución) y la región de la lista de trabajos en coordenadas relativas.
+
+Uso:
+    python layout_registry.py register NOMBRE muestra.png --roi x,y,ancho,alto
+    python layout_registry.py match captura.png
+    python layout_registry.py list
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+FINGERPRINT_WIDTH = 320
+FINGERPRINT_GRID = (24, 24)
+DEFAULT_LAYOUTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts', 'templates.json')
+
+
+def layout_fingerprint(gray: np.ndarray) -> np.ndarray:
+    """
+    Huella de la estructura de la ventana
+
+    Se quedan solo los bordes que forman líneas largas (marco, barras, cabeceras
+    de tabla), que no cambian con el contenido de la lista, y se resumen como
+    densidad en una rejilla fija. El vector sale normalizado (norma 1).
+    """
+    height, width = gray.shape[:2]
+    scale = FINGERPRINT_WIDTH / float(width)
+    small = cv2.resize(gray, (FINGERPRINT_WIDTH, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    edges = cv2.Canny(small, 50, 150)
+
+    horizontal = cv2.morphologyEx(edges, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 1)))
+    vertical = cv2.morphologyEx(edges, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 25)))
+    structure = cv2.bitwise_or(horizontal, vertical)
+
+    grid = cv2.resize(structure.astype(np.float32), FINGERPRINT_GRID, interpolation=cv2.INTER_AREA)
+    vector = grid.flatten()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class LayoutRegistry:
+    """Plantillas de layout con su región de lista de trabajos"""
+
+    def __init__(self, path: str = DEFAULT_LAYOUTS_FILE, min_similarity: float = 0.85,
+                 logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            path: Archivo JSON con las plantillas registradas
+            min_similarity: Similitud coseno mínima para aceptar una plantilla
+            logger: Logger, crea uno si no se da
+        """
+        self.path = path
+        self.min_similarity = min_similarity
+        self.logger = logger or logging.getLogger(__name__)
+        self._templates: List[Dict] = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            templates = json.load(f)
+        for template in templates:
+            template['_vector'] = np.asarray(template['fingerprint'], dtype=np.float32)
+        self._templates = templates
+        self.logger.info(f"Layout registry loaded: {len(templates)} templates")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        data = [{k: v for k, v in t.items() if not k.startswith('_')} for t in self._templates]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def register(self, name: str, gray: np.ndarray, roi: Tuple[int, int, int, int], sample: str = '') -> Dict:
+        """
+        Registra (o reemplaza) una plantilla a partir de una imagen de muestra
+
+        Args:
+            name: Nombre de la plantilla
+            gray: Muestra en escala de grises
+            roi: Región de la lista de trabajos en píxeles de la muestra (x, y, ancho, alto)
+            sample: Ruta de la muestra (solo informativo)
+        """
+        height, width = gray.shape[:2]
+        x, y, w, h = roi
+        if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > width or y + h > height:
+            raise ValueError(f"ROI {roi} is outside the {width}x{height} sample")
+
+        vector = layout_fingerprint(gray)
+        if not vector.any():
+            raise ValueError("Sample has no window structure (long lines) to fingerprint")
+        template = {
+            'name': name,
+            'aspect': width / height,
+            'roi': [x / width, y / height, w / width, h / height],
+            'fingerprint': [round(float(v), 5) for v in vector],
+            'sample': sample,
+            'registered_at': datetime.now().isoformat(),
+            '_vector': vector,
+        }
+        with self._lock:
+            self._templates = [t for t in self._templates if t['name'] != name] + [template]
+            self._save()
+        self.logger.info(f"Layout template registered: {name}")
+        return template
+
+    def match(self, gray: np.ndarray) -> Optional[Tuple[Dict, float]]:
+        """
+        Busca la plantilla que corresponde a la captura
+
+        Returns:
+            Tuple (plantilla, similitud), o None si el layout es desconocido
+        """
+        if not self._templates:
+            return None
+        height, width = gray.shape[:2]
+        aspect = width / height
+        vector = layout_fingerprint(gray)
+        if not vector.any():
+            return None
+
+        best = None
+        for template in self._templates:
+            if abs(template['aspect'] - aspect) > 0.05 * aspect:
+                continue
+            similarity = float(np.dot(vector, template['_vector']))
+            if best is None or similarity > best[1]:
+                best = (template, similarity)
+        if best and best[1] >= self.min_similarity:
+            return best
+        return None
+
+    @staticmethod
+    def crop(gray: np.ndarray, template: Dict) -> np.ndarray:
+        """Recorta la región de la lista de trabajos de la plantilla"""
+        height, width = gray.shape[:2]
+        rx, ry, rw, rh = template['roi']
+        x0, y0 = int(rx * width), int(ry * height)
+        x1, y1 = min(width, int((rx + rw) * width)), min(height, int((ry + rh) * height))
+        return gray[y0:y1, x0:x1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Registro de layouts de captura')
+    parser.add_argument('--file', default=os.environ.get('OCR_LAYOUTS_FILE', DEFAULT_LAYOUTS_FILE))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_register = sub.add_parser('register', help='Registrar una plantilla desde una muestra')
+    p_register.add_argument('name')
+    p_register.add_argument('sample')
+    p_register.add_argument('--roi', required=True, help='Región de la lista de trabajos: x,y,ancho,alto (px)')
+
+    p_match = sub.add_parser('match', help='Probar una captura contra las plantillas')
+    p_match.add_argument('image')
+
+    sub.add_parser('list', help='Listar plantillas')
+
+    args = parser.parse_args()
+    registry = LayoutRegistry(args.file)
+
+    if args.command == 'list':
+        for template in registry._templates:
+            print(f"{template['name']}: roi={template['roi']} aspect={template['aspect']:.3f} ({template['sample']})")
+        return
+
+    path = args.sample if args.command == 'register' else args.image
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        print(f"❌ No se pudo cargar la imagen: {path}")
+        return
+
+    if args.command == 'register':
+        roi = tuple(int(v) for v in args.roi.split(','))
+        registry.register(args.name, gray, roi, sample=os.path.basename(path))
+        print(f"✅ Plantilla '{args.name}' registrada en {args.file}")
+    else:
+        match = registry.match(gray)
+        if match:
+            print(f"✅ {match[0]['name']} (similitud {match[1]:.3f})")
+        else:
+            print("❌ Layout desconocido")
+
+
+if __name__ == '__main__':
+    main()
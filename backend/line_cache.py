@@ -0,0 +1,200 @@
+"""
+Caché de OCR por línea para capturas repetidas de la cola del RIP.
+
+Los operadores capturan la misma ventana de la cola muchas veces al día y cada
+captura suele añadir solo una o dos filas. La captura se segmenta en líneas
+(proyección horizontal de la tinta), cada recorte se normaliza (recortado a su
+tinta, altura fija, binarizado) y se identifica por el hash de esos píxeles.
+El texto reconocido y el trabajo parseado se guardan por hash, así que solo
+las líneas nuevas o cambiadas vuelven a pasar por Tesseract.
+
+Los registros llevan la versión del pipeline: al cambiarla se ignoran los
+anteriores. El archivo se reescribe solo con las entradas vigentes al cargarlo
+si tiene registros obsoletos y cuando crece al doble de max_entries.
+
+El archivo lo comparten el servidor y los procesos de batch_ocr, cada uno con
+su OCRService: las escrituras y la compactación van bajo un lock de archivo
+(common.file_lock) y la compactación vuelve a leer el archivo bajo el lock, así
+que conserva lo que añadieron los demás procesos.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from common import file_lock
+
+# Altura (px) del recorte normalizado que se hashea
+KEY_HEIGHT = 16
+
+
+def segment_lines(ink: np.ndarray, min_height: int = 6, max_gap: int = 2) -> List[Tuple[int, int]]:
+    """
+    Filas de texto por proyección horizontal
+
+    Args:
+        ink: Imagen binaria (tinta > 0)
+        min_height: Altura mínima de una línea (descarta ruido y separadores)
+        max_gap: Filas vacías que se toleran dentro de una misma línea
+
+    Returns:
+        Lista de (y0, y1) de arriba a abajo
+    """
+    rows = (ink > 0).sum(axis=1)
+    has_ink = rows > max(1, int(0.002 * ink.shape[1]))
+    lines = []
+    start = None
+    gap = 0
+    for y, filled in enumerate(has_ink):
+        if filled:
+            if start is None:
+                start = y
+            gap = 0
+        elif start is not None:
+            gap += 1
+            if gap > max_gap:
+                lines.append((start, y - gap + 1))
+                start, gap = None, 0
+    if start is not None:
+        lines.append((start, len(has_ink) - gap))
+    return [(y0, y1) for y0, y1 in lines if y1 - y0 >= min_height]
+
+
+def crop_key(ink_line: np.ndarray) -> Optional[str]:
+    """
+    Hash del recorte normalizado de una línea (None si no tiene tinta)
+
+    Se recorta a la caja de la tinta y se reduce a KEY_HEIGHT px de alto: la
+    misma fila en otra posición vertical o con otro margen da la misma clave.
+    """
+    points = cv2.findNonZero(ink_line)
+    if points is None:
+        return None
+    x, y, w, h = cv2.boundingRect(points)
+    tight = ink_line[y:y + h, x:x + w]
+    width = max(1, round(w * KEY_HEIGHT / h))
+    small = cv2.resize(tight, (width, KEY_HEIGHT), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small > 127)
+    digest = hashlib.blake2b(bits.tobytes(), digest_size=16)
+    digest.update(f"{width}x{KEY_HEIGHT}".encode('ascii'))
+    return digest.hexdigest()
+
+
+class LineCropCache:
+    """Texto y trabajo parseado por hash de recorte de línea, persistidos en JSONL"""
+
+    def __init__(self, path: str, version: str, max_entries: int = 50000,
+                 logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            path: Archivo JSONL donde se guardan las líneas reconocidas
+            version: Versión del pipeline; los registros de otra versión se ignoran
+            max_entries: Máximo de líneas en memoria (se descartan las menos usadas)
+            logger: Logger, crea uno si no se da
+        """
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.logger = logger or logging.getLogger(__name__)
+        self._entries: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Registros escritos en el archivo (incluye duplicados, descartados y de otras versiones)
+        self._file_records = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        """True si la línea está en la caché (sin contar acierto ni fallo)"""
+        with self._lock:
+            return key in self._entries
+
+    def _read_file(self) -> 'OrderedDict[str, Dict]':
+        """Registros vigentes del archivo, el último de cada clave, en orden de escritura"""
+        records: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._file_records = 0
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                self._file_records += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('version') == self.version:
+                    records[record['key']] = record
+                    records.move_to_end(record['key'])
+        return records
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with file_lock(self.path):
+            for key, record in self._read_file().items():
+                self._remember(key, record)
+            self.logger.info(f"Line crop cache loaded: {len(self._entries)} lines ({self._file_records} records)")
+            if self._file_records > len(self._entries):
+                with self._lock:
+                    self._compact()
+
+    def _compact(self):
+        """
+        Reescribe el archivo con los registros vigentes (llamar con el lock de archivo y el de la caché)
+
+        Se relee el archivo: las líneas que añadieron otros procesos desde que se
+        cargó se conservan (y pasan también a memoria).
+        """
+        records = self._read_file()
+        while len(records) > self.max_entries:
+            records.popitem(last=False)
+        for key, record in records.items():
+            if key not in self._entries:
+                self._remember(key, record)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in records.values():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(temp_path, self.path)
+        self._file_records = len(records)
+
+    def _remember(self, key: str, record: Dict):
+        self._entries[key] = record
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            record = self._entries.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return record
+
+    def put_many(self, records: List[Dict]):
+        """Guarda líneas reconocidas (dicts con key, text, conf y job)"""
+        if not records:
+            return
+        now = datetime.now().isoformat()
+        with file_lock(self.path), self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    record = dict(record, version=self.version, cached_at=now)
+                    self._remember(record['key'], record)
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file_records += len(records)
+            if self._file_records > 2 * self.max_entries:
+                self._compact()
@@ -0,0 +1,336 @@
+"""
+Prueba de carga del backend reproduciendo las capturas de uploads/.
+
+Envía las imágenes a /api/upload-preview y /api/ocr-text de un servidor local
+y mide throughput, latencia (p50/p95/p99) y tasa de errores para cada nivel:
+
+- Lazo abierto (--rates): llegadas de Poisson a N peticiones/s, sin esperar a
+  que terminen las anteriores. La latencia se mide desde el instante previsto
+  de llegada, así que la cola que se forma cuando el servidor no da abasto
+  cuenta en la latencia (sin "omisión coordinada"). Las llegadas que el cliente
+  no puede enviar porque ya tiene --max-in-flight peticiones en curso cuentan
+  como errores (dropped_by_client) y entran en los percentiles censuradas al
+  timeout, igual que las peticiones que agotan el timeout.
+- Lazo cerrado (--concurrency): N clientes que envían una petición, esperan la
+  respuesta y envían la siguiente.
+
+Solo usa la biblioteca estándar (urllib). Las subidas se guardan en uploads/
+como cualquier otra, y las capturas repetidas pueden resolverse con el índice
+de resultados (se informa como reused).
+
+Uso:
+    python app.py  # en otra terminal
+    python load_test.py --rates 0.5,1,2 --duration 30
+    python load_test.py --concurrency 1,2,4 --endpoints ocr-text --output carga.json
+"""
+import argparse
+import itertools
+import json
+import mimetypes
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from common import collect_images, percentile
+
+# Campo del formulario multipart que espera cada endpoint
+ENDPOINT_FIELDS = {
+    'upload-preview': 'preview',
+    'ocr-text': 'file',
+}
+
+
+def _multipart(field: str, filename: str, content: bytes, fields: Dict[str, str]) -> Tuple[bytes, str]:
+    """Cuerpo multipart/form-data con un archivo y campos de texto"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + content + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Replayer:
+    """Construye y envía las peticiones; acumula un registro por petición"""
+
+    def __init__(self, base_url: str, images: List[str], endpoints: List[str],
+                 fields: Dict[str, str], timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.endpoints = endpoints
+        self.fields = fields
+        self.timeout = timeout
+        # Las imágenes se leen una vez: el disco del cliente no debe medir en la prueba
+        self.payloads = []
+        for path in images:
+            with open(path, 'rb') as f:
+                self.payloads.append((os.path.basename(path), f.read()))
+        self._cycle = itertools.cycle(
+            [(endpoint, payload) for payload in self.payloads for endpoint in endpoints]
+        )
+        self._lock = threading.Lock()
+        self.records: List[Dict] = []
+
+    def next_request(self) -> Tuple[str, Tuple[str, bytes]]:
+        with self._lock:
+            return next(self._cycle)
+
+    def send(self, endpoint: str, payload: Tuple[str, bytes], scheduled_at: Optional[float] = None):
+        """Envía una petición y anota latencia, estado y si el servidor reutilizó un OCR previo"""
+        filename, content = payload
+        body, content_type = _multipart(ENDPOINT_FIELDS[endpoint], filename, content, self.fields)
+        request = urllib.request.Request(
+            f"{self.base_url}/api/{endpoint}", data=body, method='POST',
+            headers={'Content-Type': content_type, 'Accept-Encoding': 'identity'},
+        )
+        start = scheduled_at if scheduled_at is not None else time.perf_counter()
+        record = {'endpoint': endpoint, 'status': None, 'error': None, 'reused': False, 'partial': False,
+                  'censored': False}
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+                record['status'] = response.status
+                record['reused'] = response.headers.get('X-OCR-Reused') == 'true'
+                record['partial'] = response.headers.get('X-OCR-Partial') == 'true'
+                if endpoint == 'upload-preview':
+                    try:
+                        parsed = json.loads(data)
+                        record['reused'] = bool(parsed.get('reused_ocr'))
+                        record['partial'] = bool((parsed.get('ocr_results') or {}).get('partial'))
+                    except ValueError:
+                        pass
+        except urllib.error.HTTPError as e:
+            record['status'] = e.code
+            record['error'] = f"HTTP {e.code}"
+        except Exception as e:
+            record['error'] = type(e).__name__
+            # Timeout: la latencia real es al menos la medida
+            record['censored'] = isinstance(e, TimeoutError) or isinstance(getattr(e, 'reason', None), TimeoutError)
+        record['latency_ms'] = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.records.append(record)
+
+    def drop(self, endpoint: str):
+        """
+        Anota una llegada que el cliente no pudo enviar (sin hilos libres)
+
+        Cuenta como error y su latencia se censura al timeout: habría esperado al
+        menos hasta que quedara un hueco, y omitirla escondería justo la cola que
+        mide el lazo abierto.
+        """
+        record = {'endpoint': endpoint, 'status': None, 'error': 'dropped_by_client', 'reused': False,
+                  'partial': False, 'censored': True, 'latency_ms': self.timeout * 1000}
+        with self._lock:
+            self.records.append(record)
+
+    def take_records(self) -> List[Dict]:
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+def _summarize(records: List[Dict], elapsed: float, **level) -> Dict:
+    """
+    Throughput, percentiles de latencia y errores de un nivel
+
+    Los percentiles incluyen las peticiones correctas y las censuradas (timeout o
+    descartadas por el cliente, con su latencia mínima conocida).
+    """
+    ok = [r for r in records if r['error'] is None]
+    latencies = [r['latency_ms'] for r in records if r['error'] is None or r['censored']]
+    errors: Dict[str, int] = {}
+    for r in records:
+        if r['error'] is not None:
+            errors[r['error']] = errors.get(r['error'], 0) + 1
+    summary = dict(level)
+    summary.update({
+        'elapsed_s': round(elapsed, 2),
+        'requests': len(records),
+        'ok': len(ok),
+        'throughput_rps': round(len(ok) / elapsed, 3) if elapsed > 0 else 0.0,
+        'error_rate': round(1 - len(ok) / len(records), 4) if records else 0.0,
+        'errors': errors,
+        'censored': sum(r['censored'] for r in records),
+        'reused': sum(r['reused'] for r in ok),
+        'partial': sum(r['partial'] for r in ok),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 1),
+            'p95': round(percentile(latencies, 95), 1),
+            'p99': round(percentile(latencies, 99), 1),
+            'max': round(max(latencies), 1) if latencies else 0.0,
+            'mean': round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        },
+        'by_endpoint': {},
+    })
+    for endpoint in sorted({r['endpoint'] for r in records}):
+        subset = [r for r in records if r['endpoint'] == endpoint]
+        subset_ok = sum(r['error'] is None for r in subset)
+        subset_latencies = [r['latency_ms'] for r in subset if r['error'] is None or r['censored']]
+        summary['by_endpoint'][endpoint] = {
+            'requests': len(subset),
+            'error_rate': round(1 - subset_ok / len(subset), 4),
+            'p50': round(percentile(subset_latencies, 50), 1),
+            'p95': round(percentile(subset_latencies, 95), 1),
+            'p99': round(percentile(subset_latencies, 99), 1),
+        }
+    return summary
+
+
+def run_open_loop(replayer: Replayer, rate: float, duration: float, max_in_flight: int) -> Dict:
+    """
+    Llegadas de Poisson a `rate` peticiones/s durante `duration` segundos
+
+    Las llegadas sin hueco en `max_in_flight` se anotan como error censurado al
+    timeout (Replayer.drop), no se descartan del reporte.
+    """
+    in_flight = threading.Semaphore(max_in_flight)
+    dropped = 0
+
+    def _send(endpoint, payload, scheduled_at):
+        try:
+            replayer.send(endpoint, payload, scheduled_at)
+        finally:
+            in_flight.release()
+
+    start = time.perf_counter()
+    next_arrival = start
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        while True:
+            next_arrival += random.expovariate(rate)
+            if next_arrival - start >= duration:
+                break
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint, payload = replayer.next_request()
+            if not in_flight.acquire(blocking=False):
+                # El generador se quedó sin hilos: el servidor está muy por detrás
+                replayer.drop(endpoint)
+                dropped += 1
+                continue
+            pool.submit(_send, endpoint, payload, next_arrival)
+    elapsed = time.perf_counter() - start
+    summary = _summarize(replayer.take_records(), elapsed, loop='open', target_rps=rate)
+    summary['dropped_by_client'] = dropped
+    return summary
+
+
+def run_closed_loop(replayer: Replayer, concurrency: int, duration: float) -> Dict:
+    """`concurrency` clientes enviando peticiones una tras otra durante `duration` segundos"""
+    stop_at = time.perf_counter() + duration
+
+    def _client():
+        while time.perf_counter() < stop_at:
+            replayer.send(*replayer.next_request())
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return _summarize(replayer.take_records(), elapsed, loop='closed', concurrency=concurrency)
+
+
+def _print_level(summary: Dict):
+    level = f"{summary['target_rps']} req/s" if summary['loop'] == 'open' else f"{summary['concurrency']} clientes"
+    latency = summary['latency_ms']
+    sys.stderr.write(
+        f"{summary['loop']:>6} {level:>12}  {summary['throughput_rps']:>7.2f} ok/s  "
+        f"p50 {latency['p50']:>8.1f}  p95 {latency['p95']:>8.1f}  p99 {latency['p99']:>8.1f} ms  "
+        f"errores {summary['error_rate'] * 100:.1f}%\n"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de los endpoints OCR')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='URL base del backend')
+    parser.add_argument('--images', default='uploads', help='Directorio o patrón glob de imágenes')
+    parser.add_argument('--limit', type=int, default=0, help='Máximo de imágenes (0 = todas)')
+    parser.add_argument('--endpoints', default='upload-preview,ocr-text',
+                        help=f"Endpoints a alternar ({', '.join(ENDPOINT_FIELDS)})")
+    parser.add_argument('--rates', default='', help='Lazo abierto: peticiones/s por nivel, ej. 0.5,1,2')
+    parser.add_argument('--concurrency', default='', help='Lazo cerrado: clientes por nivel, ej. 1,2,4')
+    parser.add_argument('--duration', type=float, default=30.0, help='Segundos por nivel')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='Peticiones simultáneas máximas en lazo abierto')
+    parser.add_argument('--mode', default='', help='Modo de calidad a pedir (fast/balanced/thorough)')
+    parser.add_argument('--deadline-ms', type=int, default=0, help='deadline_ms a pedir (0 = sin límite)')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Timeout por petición (s)')
+    parser.add_argument('--output', default='', help='Archivo JSON del reporte (por defecto, stdout)')
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = [e for e in endpoints if e not in ENDPOINT_FIELDS]
+    if unknown or not endpoints:
+        parser.error(f"Endpoints no soportados: {', '.join(unknown) or '(ninguno)'}")
+    rates = [float(r) for r in args.rates.split(',') if r.strip()]
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    if not rates and not levels:
+        levels = [1]
+    if any(r <= 0 for r in rates) or any(c <= 0 for c in levels):
+        parser.error('Los niveles deben ser positivos')
+
+    images = collect_images(args.images, args.limit)
+    if not images:
+        print(f"❌ No hay imágenes en {args.images}")
+        sys.exit(1)
+
+    fields = {}
+    if args.mode:
+        fields['mode'] = args.mode
+    if args.deadline_ms:
+        fields['deadline_ms'] = str(args.deadline_ms)
+    replayer = Replayer(args.url, images, endpoints, fields, args.timeout)
+
+    try:
+        with urllib.request.urlopen(f"{replayer.base_url}/health", timeout=10) as response:
+            response.read()
+    except Exception as e:
+        print(f"❌ El backend no responde en {args.url}: {e}")
+        sys.exit(1)
+
+    sys.stderr.write(f"=== PRUEBA DE CARGA ({len(images)} imágenes, {', '.join(endpoints)}, "
+                     f"{args.duration:.0f}s por nivel) ===\n")
+    results = []
+    for rate in rates:
+        results.append(run_open_loop(replayer, rate, args.duration, args.max_in_flight))
+        _print_level(results[-1])
+    for concurrency in levels:
+        results.append(run_closed_loop(replayer, concurrency, args.duration))
+        _print_level(results[-1])
+
+    report = {
+        'url': args.url,
+        'started_at': datetime.now().isoformat(),
+        'images': len(images),
+        'endpoints': endpoints,
+        'fields': fields,
+        'duration_s': args.duration,
+        'levels': results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        sys.stderr.write(f"Reporte → {args.output}\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,27 @@ import pytesseract
 import numpy as np
 from PIL import Image
 import re
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import logging
 import os
-from datetime import datetime
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta
+
+from client_list import ClientUserWords
+from layout_registry import DEFAULT_LAYOUTS_FILE, LayoutRegistry
+from line_cache import LineCropCache, crop_key, segment_lines
+from name_index import ClientNameIndex
+from stage_graph import Stage, StageGraph, StageRun
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 # Ensure pytesseract uses the installed Tesseract on Windows
 try:
@@ -16,6 +33,56 @@ except Exception:
     # Fallback safely; runtime will surface errors if not found
     pass
 
+# Recursos de Tesseract que se distribuyen con el backend (patrones de códigos de trabajo)
+TESSERACT_ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tesseract')
+JOB_CODE_PATTERNS_FILE = os.path.join(TESSERACT_ASSETS_DIR, 'job_code.user-patterns')
+JOB_CODE_WHITELIST = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.'
+
+# Líneas que "parecen" un código de trabajo (ddmmaa seguido de guión), parseen o no
+JOB_LIKE_LINE_RE = re.compile(r'\d{2}\s*\d{2}\s*\d{2}\s*-')
+
+# Versión del pipeline (preprocesado + OCR + parser). Subirla cuando cambie el
+# resultado esperado para que los reprocesos por lotes no den por hechas las
+# imágenes ya procesadas con la versión anterior.
+PIPELINE_VERSION = '2026.10.1'
+
+# Modos de calidad: fast (ruta rápida + OCR simple), balanced (pipeline completo
+# sin pasadas de diagnóstico) y thorough (ambas orientaciones y diagnóstico)
+QUALITY_MODES = ('fast', 'balanced', 'thorough')
+
+
+# Modos de decodificación en gris de OpenCV por factor de reducción
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso en MB (0 si la plataforma no lo expone)"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _tesseract_path(path: str) -> str:
+    """Ruta utilizable dentro del config de Tesseract
+
+    pytesseract separa el config por espacios, así que si la ruta absoluta
+    tiene espacios (p. ej. el perfil de usuario en Windows) se usa la relativa.
+    """
+    if ' ' not in path:
+        return path
+    try:
+        relative = os.path.relpath(path)
+    except ValueError:
+        return path
+    return relative if ' ' not in relative else path
+
 class JobDetails:
     """Estructura de datos para información del trabajo de impresión"""
     
@@ -29,6 +96,13 @@ class JobDetails:
         self.special_instructions: str = ""
         self.detected_text: str = ""
         self.confidence: float = 0.0
+        # Orientación corregida en el preprocesado: {'rotation': 0/90/180/270, 'skew': grados}
+        self.orientation: Optional[Dict] = None
+        # True si se cortó el pipeline por el deadline (mejor resultado hasta ese momento)
+        self.partial: bool = False
+        # 'ok', 'partial' (el deadline dejó etapas sin hacer), 'timeout' (se mató alguna
+        # llamada a Tesseract por su límite de tiempo; también partial) o 'error'
+        self.status: str = 'ok'
     
     def to_dict(self) -> Dict:
         """Convierte la instancia a diccionario"""
@@ -41,25 +115,353 @@ class JobDetails:
             'deadline': self.deadline,
             'special_instructions': self.special_instructions,
             'detected_text': self.detected_text,
-            'confidence': self.confidence
+            'confidence': self.confidence,
+            'partial': self.partial,
+            'status': self.status,
+            'orientation': self.orientation
         }
 
+class ThreadBudget:
+    """Reparte los núcleos disponibles entre las llamadas OCR concurrentes
+
+    Tesseract (OpenMP) y OpenCV arrancan por defecto tantos hilos como núcleos
+    haya; con varias peticiones en paralelo la máquina queda sobresuscrita.
+    Cada llamada OCR activa ocupa un "slot" y recibe total // activos hilos.
+
+    OMP_THREAD_LIMIT (lo heredan los procesos de tesseract) y cv2.setNumThreads
+    son globales del proceso, así que el reparto se aplica una sola vez por
+    cambio de concurrencia, bajo el lock: todas las llamadas en curso usan el
+    mismo valor. Un slot anidado en el mismo hilo (p. ej. extract_job_details
+    dentro de process_batch) no cuenta otra vez.
+
+    El OCR en segundo plano (watcher, sombra) usa slots de fondo: no cuentan
+    como activos, solo reciben background_threads hilos cuando no hay nada
+    interactivo, y cuando lo hay se reparte como si no existieran. Un slot de
+    fondo con full_share (la evaluación en sombra, que mide latencias) recibe
+    cuando no hay nada interactivo los mismos hilos que una petición sola.
+    """
+
+    def __init__(self, total_threads: Optional[int] = None, min_threads: int = 1,
+                 background_threads: Optional[int] = None):
+        """
+        Args:
+            total_threads: Hilos a repartir (por defecto OCR_THREADS o núcleos del equipo)
+            min_threads: Mínimo de hilos por llamada
+            background_threads: Hilos para el OCR en segundo plano (por defecto
+                OCR_BACKGROUND_THREADS o un cuarto del total)
+        """
+        env_threads = os.environ.get('OCR_THREADS')
+        self.total_threads = total_threads or (int(env_threads) if env_threads else None) or os.cpu_count() or 1
+        self.min_threads = max(1, min_threads)
+        env_background = os.environ.get('OCR_BACKGROUND_THREADS')
+        self.background_threads = (background_threads or (int(env_background) if env_background else None)
+                                   or max(1, self.total_threads // 4))
+        self._active = 0
+        self._background = 0
+        self._full_share = 0
+        self._applied: Optional[int] = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # Slots que tiene abiertos cada hilo (para no contar los anidados) y si son de fondo
+        self._held = threading.local()
+
+    @property
+    def active(self) -> int:
+        """Número de llamadas OCR interactivas en curso"""
+        return self._active
+
+    @property
+    def background_active(self) -> int:
+        """Número de llamadas OCR en segundo plano en curso"""
+        return self._background
+
+    def threads_per_call(self) -> int:
+        """Hilos que corresponden a cada llamada con la concurrencia actual"""
+        with self._lock:
+            return self._threads()
+
+    def _threads(self) -> int:
+        if self._active:
+            threads = self.total_threads // self._active
+        elif self._background:
+            share = self.total_threads if self._full_share else min(self.background_threads, self.total_threads)
+            threads = share // self._background
+        else:
+            threads = self.total_threads
+        return max(self.min_threads, threads)
+
+    def _rebalance(self) -> int:
+        """Aplica el reparto de la concurrencia actual si cambió (llamar con el lock tomado)"""
+        threads = self._threads()
+        if threads != self._applied:
+            os.environ['OMP_THREAD_LIMIT'] = str(threads)
+            cv2.setNumThreads(threads)
+            self._applied = threads
+        return threads
+
+    def apply(self) -> int:
+        """Asegura que el reparto actual está aplicado a OpenCV y Tesseract; devuelve los hilos por llamada"""
+        with self._lock:
+            return self._rebalance()
+
+    def _add(self, count: int, background: bool = False, full_share: int = 0):
+        with self._lock:
+            self._full_share += full_share
+            if background:
+                self._background += count
+            else:
+                self._active += count
+            self._rebalance()
+            if self._active == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera a que no haya llamadas OCR interactivas activas
+
+        Returns:
+            True si quedó libre, False si venció el timeout
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._active == 0, timeout)
+
+    def in_background(self) -> bool:
+        """True si el hilo actual trabaja dentro de un slot de fondo"""
+        return getattr(self._held, 'background', False)
+
+    @contextmanager
+    def slot(self, background: bool = False, full_share: bool = False):
+        """
+        Registra una llamada OCR activa mientras dure el bloque (una vez por hilo)
+
+        Args:
+            background: Slot de baja prioridad (OCR que nadie está esperando); los
+                slots anidados heredan la prioridad del exterior
+            full_share: Con background, recibir todos los hilos mientras no haya
+                OCR interactivo (en lugar de background_threads)
+        """
+        depth = getattr(self._held, 'depth', 0)
+        if depth == 0:
+            self._held.background = background
+        background = self.in_background()
+        full_share = int(background and full_share)
+        self._held.depth = depth + 1
+        if depth == 0:
+            self._add(1, background, full_share)
+        try:
+            yield self
+        finally:
+            self._held.depth = depth
+            if depth == 0:
+                self._add(-1, background, -full_share)
+                self._held.background = False
+
+    @contextmanager
+    def inherit(self, background: bool):
+        """Marca el hilo actual (un worker de un pool) con la prioridad de quien le encargó el trabajo"""
+        previous = self.in_background()
+        self._held.background = background
+        try:
+            yield self
+        finally:
+            self._held.background = previous
+
+    @contextmanager
+    def widen(self, extra: int):
+        """
+        Cuenta `extra` llamadas más mientras dure el bloque
+
+        Para una petición que lanza varios procesos de Tesseract a la vez (franjas
+        de una captura alta): los hilos de las franjas no abren slot propio.
+        """
+        extra = max(0, extra)
+        background = self.in_background()
+        self._add(extra, background)
+        try:
+            yield self
+        finally:
+            self._add(-extra, background)
+
+class PreprocessBuffers:
+    """Buffers reutilizables del preprocesado para una ejecución a la vez
+
+    Cada etapa escribe con dst= sobre un área preasignada con nombre; solo se
+    reasigna cuando llega una imagen con más píxeles que la mayor vista hasta ahora.
+    El objeto CLAHE no es thread-safe, por eso también vive aquí.
+    """
+
+    def __init__(self):
+        self._pool: Dict[str, np.ndarray] = {}
+        self.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+
+    def get(self, name: str, shape: tuple) -> np.ndarray:
+        """Vista uint8 con la forma pedida sobre el buffer `name`"""
+        size = int(np.prod(shape))
+        flat = self._pool.get(name)
+        if flat is None or flat.size < size:
+            flat = np.empty(size, dtype=np.uint8)
+            self._pool[name] = flat
+        return flat[:size].reshape(shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria total reservada por los buffers"""
+        return sum(buf.nbytes for buf in self._pool.values())
+
+
+class BufferPool:
+    """PreprocessBuffers libres que se prestan a cada petición y se devuelven al terminar
+
+    El servidor crea un hilo por petición, así que unos buffers por hilo
+    (threading.local) no se reutilizarían nunca. Se guardan como mucho max_idle
+    juegos libres: la memoria retenida queda acotada a max_idle veces la mayor imagen.
+    """
+
+    def __init__(self, max_idle: Optional[int] = None):
+        """
+        Args:
+            max_idle: Juegos de buffers libres a conservar (por defecto OCR_BUFFER_POOL o 4)
+        """
+        self.max_idle = max_idle if max_idle is not None else int(os.environ.get('OCR_BUFFER_POOL', 4))
+        self._idle: List[PreprocessBuffers] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def borrow(self):
+        """Buffers para usar en exclusiva mientras dure el bloque"""
+        with self._lock:
+            buffers = self._idle.pop() if self._idle else None
+        if buffers is None:
+            buffers = PreprocessBuffers()
+        try:
+            yield buffers
+        finally:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(buffers)
+
+class StageCosts:
+    """Coste medio (EWMA, en ms) de cada etapa del pipeline, medido en este proceso
+
+    Sirve para planificar qué etapas caben en el deadline de una petición. Hasta
+    tener mediciones se usan estimaciones conservadoras.
+    """
+
+    DEFAULTS_MS = {
+        'lines': 400.0,
+        'fast_path': 800.0,
+        'simple': 1200.0,
+        'preprocess': 300.0,
+        'pp_pass': 1500.0,
+        'debug': 2000.0,
+    }
+
+    def __init__(self, alpha: float = 0.2):
+        """
+        Args:
+            alpha: Peso de la medición más reciente en la media
+        """
+        self.alpha = alpha
+        self._costs: Dict[str, float] = dict(self.DEFAULTS_MS)
+        self._lock = threading.Lock()
+
+    def estimate(self, stage: str) -> float:
+        return self._costs.get(stage, 1000.0)
+
+    def record(self, stage: str, elapsed_ms: float):
+        with self._lock:
+            previous = self._costs.get(stage)
+            self._costs[stage] = elapsed_ms if previous is None else \
+                (1 - self.alpha) * previous + self.alpha * elapsed_ms
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Mide el bloque y actualiza la media de la etapa"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(ms, 1) for stage, ms in self._costs.items()}
+
+class OCRTimeoutError(RuntimeError):
+    """Una llamada a Tesseract superó su límite (el proceso se mató) o la petición ya no tenía tiempo"""
+
+
+class Deadline:
+    """Límite de tiempo de una petición; recuerda si alguna etapa se saltó por él
+
+    El deadline (deadline_ms) es blando: solo decide qué etapas empezar. El límite
+    duro (hard_limit_s) acota cada llamada a Tesseract; al vencer se mata el proceso.
+    """
+
+    def __init__(self, deadline_ms: Optional[float] = None, hard_limit_s: Optional[float] = None):
+        now = time.monotonic()
+        self.expires_at = now + deadline_ms / 1000.0 if deadline_ms else None
+        self.hard_expires_at = now + hard_limit_s if hard_limit_s else None
+        self.cut = False
+        self.timed_out = False
+
+    def hard_remaining_s(self) -> float:
+        if self.hard_expires_at is None:
+            return float('inf')
+        return max(0.0, self.hard_expires_at - time.monotonic())
+
+    def remaining_ms(self) -> float:
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, (self.expires_at - time.monotonic()) * 1000)
+
+    def extend(self, seconds: float):
+        """Aplaza los límites (tiempo que la petición pasó cediendo el paso, no trabajando)"""
+        if self.expires_at is not None:
+            self.expires_at += seconds
+        if self.hard_expires_at is not None:
+            self.hard_expires_at += seconds
+
+    def allows(self, cost_ms: float) -> bool:
+        """True si una etapa de coste estimado cost_ms cabe en lo que queda"""
+        if self.remaining_ms() >= cost_ms:
+            return True
+        self.cut = True
+        return False
+
 class OCRService:
     """Servicio para procesamiento OCR de capturas de trabajos de impresión"""
     
-    def __init__(self, logger: Optional[logging.Logger] = None):
+    def __init__(self, logger: Optional[logging.Logger] = None,
+                 thread_budget: Optional[ThreadBudget] = None,
+                 client_list_path: Optional[str] = None,
+                 cache_dir: Optional[str] = None):
         """
         Initialize OCR service
-        
+
         Args:
             logger: Logger instance, creates one if not provided
+            thread_budget: Reparto de hilos entre llamadas concurrentes, crea uno si no se da
+            client_list_path: Lista de clientes (CSV/TXT) para el diccionario de Tesseract;
+                por defecto la variable de entorno OCR_CLIENT_LIST
+            cache_dir: Directorio de archivos generados (cachés, diccionarios), por defecto ocr_cache
         """
         self.logger = logger or self._setup_logger()
-        
+        self.thread_budget = thread_budget or ThreadBudget()
+
         # Directorio para debug
         self.debug_dir = "debug_images"
         os.makedirs(self.debug_dir, exist_ok=True)
-        
+
+        # Directorio para archivos generados (diccionarios de Tesseract, etc.)
+        self.cache_dir = cache_dir or "ocr_cache"
+
+        # Diccionario de nombres de clientes para las pasadas de códigos de trabajo
+        client_list_path = client_list_path or os.environ.get('OCR_CLIENT_LIST')
+        self.client_words = ClientUserWords(client_list_path, self.cache_dir, self.logger) if client_list_path else None
+        # Índice difuso de la misma lista para resolver el cliente de cada trabajo parseado
+        self.client_index = ClientNameIndex(client_list_path, logger=self.logger) if client_list_path else None
+
         # Configurar ruta de Tesseract para Windows
         if os.name == 'nt':  # Windows
             pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
@@ -76,7 +478,79 @@ class OCRService:
 
         # Configuración 4: Simple
         self.tesseract_config_simple = '--psm 6'
-        
+
+        # Ruta rápida "job code": listas del RIP con líneas T101025-CARLOS_LEON-20M.
+        # Un solo modelo, whitelist de caracteres y patrones de la gramática del código.
+        self.job_code_fast_path = True
+
+        # Layouts conocidos (ventanas del RIP): se reconoce directamente la región de la lista
+        self.layout_registry = LayoutRegistry(
+            os.environ.get('OCR_LAYOUTS_FILE', DEFAULT_LAYOUTS_FILE), logger=self.logger
+        )
+
+        # Certeza mínima del clasificador de polaridad para OCR solo una orientación
+        self.polarity_min_certainty = 0.3
+
+        # Presupuesto de píxeles por petición: se reduce por encima de max_pixels y se
+        # rechaza por encima de max_input_pixels
+        self.max_pixels = int(os.environ.get('OCR_MAX_PIXELS', 12_000_000))
+        self.max_input_pixels = int(os.environ.get('OCR_MAX_INPUT_PIXELS', 100_000_000))
+
+        # Estado por hilo (límites, imagen precargada), buffers de preprocesado y kernel morfológico compartido
+        self._worker_state = threading.local()
+        self.buffer_pool = BufferPool()
+        self.morph_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
+
+        # Capturas largas (scroll): se parten en franjas horizontales que se procesan en paralelo
+        self.tile_min_height = 2400
+        self.tile_height = 1200
+        self.tile_overlap = 60
+        self.tile_workers = max(1, min(4, os.cpu_count() or 1))
+
+        # Enderezado en el preprocesado (rotaciones de 90° e inclinación hasta max_skew_angle),
+        # estimado sobre una copia reducida; sustituye a las pasadas con OSD de Tesseract
+        self.deskew_enabled = True
+        self.max_skew_angle = 15.0
+        self.orientation_max_side = 800
+
+        # Salida temprana: se detiene el OCR en cuanto un candidato alcanza este score (0-1)
+        self.early_exit_score = float(os.environ.get('OCR_EARLY_EXIT_SCORE', '0.8'))
+        # Antigüedad máxima de una fecha de trabajo para considerarla plausible
+        self.job_date_max_age_days = 730
+
+        # Caché de OCR por línea (capturas repetidas de la cola); OCR_LINE_CACHE=0 la desactiva
+        self.line_cache = LineCropCache(
+            os.path.join(self.cache_dir, 'line_cache.jsonl'), PIPELINE_VERSION, logger=self.logger
+        ) if os.environ.get('OCR_LINE_CACHE', '1') != '0' else None
+        # Mínimo de líneas para usar la caché (menos no compensa segmentar) y, si la captura
+        # no coincide con un layout de la cola, fracción de líneas ya cacheadas para usar Tesseract
+        self.line_cache_min_lines = 3
+        self.line_cache_min_hit_ratio = 0.5
+
+        # Límites duros de Tesseract en segundos (0 = sin límite): por llamada y por petición.
+        # Al vencer se mata el proceso y el resultado queda con status 'timeout'
+        self.ocr_call_timeout = float(os.environ.get('OCR_CALL_TIMEOUT', 30))
+        self.ocr_request_timeout = float(os.environ.get('OCR_REQUEST_TIMEOUT', 120))
+        # Prioridad (nice) de los procesos de tesseract del OCR en segundo plano (0 = la normal)
+        self.background_nice = int(os.environ.get('OCR_BACKGROUND_NICE', 10))
+        self._timeout_counts = {'calls_killed': 0, 'calls_skipped': 0, 'requests': 0}
+        self._timeout_lock = threading.Lock()
+
+        # process_batch: imágenes por proceso de Tesseract en la ruta por lotes
+        self.batch_size = 16
+
+        # Modo de calidad por defecto y costes medidos por etapa (para planificar con deadline)
+        self.quality_mode = os.environ.get('OCR_QUALITY_MODE', 'balanced')
+        self.stage_costs = StageCosts()
+        self.job_code_lang = 'eng'
+        self.tesseract_config_job_code = (
+            f"--oem 1 --psm 6 -c tessedit_char_whitelist={JOB_CODE_WHITELIST} "
+            f"--user-patterns {_tesseract_path(JOB_CODE_PATTERNS_FILE)}"
+        )
+
+        # Grafo de etapas del pipeline (ver stage_graph); cada etapa se puede sustituir
+        self.stage_graph = self._build_stage_graph()
+
         # Verificar instalación de Tesseract
         self._verify_tesseract()
     
@@ -101,238 +575,1096 @@ class OCRService:
         except Exception as e:
             self.logger.error(f"Tesseract not found: {e}")
             raise Exception("Tesseract OCR is not installed or not in PATH")
-    
-    def extract_job_details(self, image_path: str) -> JobDetails:
+
+    def _ocr_string(self, image: np.ndarray, lang: str = 'spa+eng', config: str = '') -> str:
+        """image_to_string respetando el presupuesto de hilos y los límites de tiempo"""
+        return self._run_tesseract(pytesseract.image_to_string, image, lang=lang, config=config)
+
+    def _ocr_data(self, image: Union[np.ndarray, str], lang: str = 'spa+eng', config: str = '',
+                  images: int = 1) -> Dict:
+        """
+        image_to_data (como dict) respetando el presupuesto de hilos y los límites de tiempo
+
+        images: imágenes que procesa la llamada (lista de _recognize_many); escala el
+        límite por llamada
+        """
+        return self._run_tesseract(pytesseract.image_to_data, image, lang=lang, config=config,
+                                   output_type=pytesseract.Output.DICT, images=images)
+
+    @contextmanager
+    def _limited(self, deadline: Optional[Deadline]):
+        """Aplica el límite duro de la petición a las llamadas a Tesseract de este hilo"""
+        previous = getattr(self._worker_state, 'deadline', None)
+        self._worker_state.deadline = deadline
+        try:
+            yield
+        finally:
+            self._worker_state.deadline = previous
+
+    def yielded_s(self) -> float:
+        """
+        Segundos que el hilo actual lleva cediendo el paso al OCR interactivo (slots de fondo)
+
+        Para medir solo el tiempo de trabajo: la diferencia antes/después de una
+        llamada es lo que esperó (de las franjas en paralelo cuenta la mayor espera).
+        """
+        return getattr(self._worker_state, 'yielded_s', 0.0)
+
+    def _count_timeout(self, kind: str):
+        with self._timeout_lock:
+            self._timeout_counts[kind] += 1
+
+    def timeout_stats(self) -> Dict[str, int]:
+        """Contadores de timeouts: llamadas matadas, no empezadas y peticiones afectadas"""
+        with self._timeout_lock:
+            return dict(self._timeout_counts)
+
+    def _run_tesseract(self, fn, *args, images: int = 1, **kwargs):
+        """
+        Llama a pytesseract con timeout: el menor entre ocr_call_timeout y lo que le
+        queda a la petición. Al vencer pytesseract mata el proceso.
+
+        En un slot de fondo, antes de cada llamada se espera a que no haya OCR
+        interactivo (el tiempo de espera no cuenta para los límites) y el proceso
+        se lanza con nice background_nice.
+
+        Raises:
+            OCRTimeoutError: Si la llamada venció o la petición ya agotó su límite
+        """
+        deadline = getattr(self._worker_state, 'deadline', None)
+        if self.thread_budget.in_background():
+            waited = time.monotonic()
+            self.thread_budget.wait_idle()
+            waited = time.monotonic() - waited
+            self._worker_state.yielded_s = self.yielded_s() + waited
+            if deadline is not None:
+                deadline.extend(waited)
+            if self.background_nice > 0:
+                kwargs['nice'] = self.background_nice
+        self.thread_budget.apply()
+        timeout = self.ocr_call_timeout * images if self.ocr_call_timeout > 0 else 0.0
+        if deadline is not None and deadline.hard_expires_at is not None:
+            remaining = deadline.hard_remaining_s()
+            if remaining <= 0:
+                deadline.timed_out = True
+                self._count_timeout('calls_skipped')
+                raise OCRTimeoutError("OCR request time limit exhausted")
+            timeout = min(timeout, remaining) if timeout else remaining
+        try:
+            return fn(*args, timeout=timeout, **kwargs)
+        except RuntimeError as e:
+            if 'timeout' not in str(e).lower():
+                raise
+            if deadline is not None:
+                deadline.timed_out = True
+            self._count_timeout('calls_killed')
+            self.logger.warning(f"Tesseract killed after {timeout:.1f}s")
+            raise OCRTimeoutError(f"Tesseract timed out after {timeout:.1f}s") from e
+
+    def _apply_status(self, job_details: JobDetails, deadline: Deadline) -> JobDetails:
+        """Fija status según lo que pasó con los límites de la petición (y cuenta los timeouts)"""
+        if deadline.timed_out:
+            job_details.partial = True
+            job_details.status = 'timeout'
+            self._count_timeout('requests')
+            self.logger.warning("OCR request hit a Tesseract time limit: returning partial result")
+        elif job_details.partial and job_details.status == 'ok':
+            job_details.status = 'partial'
+        return job_details
+
+    @staticmethod
+    def _text_from_data(data: Dict) -> str:
+        """Reconstruye el texto línea a línea a partir de la salida de image_to_data"""
+        lines: Dict[tuple, List[str]] = {}
+        for i, word in enumerate(data.get('text', [])):
+            word = str(word).strip()
+            if not word:
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(key, []).append(word)
+        return '\n'.join(' '.join(words) for _, words in sorted(lines.items()))
+
+    @staticmethod
+    def _mean_confidence(data: Dict) -> float:
+        """Confianza promedio de las palabras reconocidas (ignora conf = -1)"""
+        values = []
+        for c in data.get('conf', []):
+            try:
+                value = float(c)
+            except (TypeError, ValueError):
+                continue
+            if value >= 0:
+                values.append(value)
+        return sum(values) / len(values) if values else 0.0
+
+    def _detect_polarity(self, gray: np.ndarray) -> tuple[bool, float]:
+        """
+        Clasifica la polaridad del texto (oscuro sobre claro o claro sobre oscuro)
+
+        Combina el histograma (la clase mayoritaria tras Otsu suele ser el fondo) con
+        estadísticas de trazos: cuenta componentes conexas con tamaño y relleno de
+        carácter en cada clase; el texto es la clase con más componentes tipo letra.
+
+        Args:
+            gray: Imagen en escala de grises
+
+        Returns:
+            Tuple (invertir, certeza 0-1). invertir=True si el texto es claro sobre fondo oscuro
+        """
+        height, width = gray.shape[:2]
+        scale = min(1.0, 1000.0 / max(height, width))
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+        _, dark_mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        dark_fraction = float(np.count_nonzero(dark_mask)) / dark_mask.size
+        light_mask = cv2.bitwise_not(dark_mask)
+
+        def _text_like_components(mask: np.ndarray) -> int:
+            count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+            if count <= 1:
+                return 0
+            stats = stats[1:]
+            w = stats[:, cv2.CC_STAT_WIDTH]
+            h = stats[:, cv2.CC_STAT_HEIGHT]
+            area = stats[:, cv2.CC_STAT_AREA]
+            fill = area / np.maximum(w * h, 1)
+            max_h = max(6, small.shape[0] // 8)
+            text_like = (h >= 4) & (h <= max_h) & (w <= max_h * 3) & (fill > 0.1) & (fill < 0.9)
+            return int(np.count_nonzero(text_like))
+
+        dark_components = _text_like_components(dark_mask)
+        light_components = _text_like_components(light_mask)
+        total_components = dark_components + light_components
+
+        # Voto por trazos (1 = texto oscuro) y voto por histograma (fondo = clase mayoritaria)
+        stroke_vote = dark_components / total_components if total_components else 0.5
+        histogram_vote = 1.0 - dark_fraction
+        dark_text_score = 0.65 * stroke_vote + 0.35 * histogram_vote
+
+        invert = dark_text_score < 0.5
+        certainty = min(1.0, abs(dark_text_score - 0.5) * 2)
+        self.logger.info(
+            f"Polarity: invert={invert} certainty={certainty:.2f} "
+            f"(dark_fraction={dark_fraction:.2f}, components dark/light={dark_components}/{light_components})"
+        )
+        return invert, certainty
+
+    def _with_client_words(self, config: str) -> str:
+        """Añade el diccionario de nombres de clientes (si hay lista configurada) al config"""
+        words_path = self.client_words.get_path() if self.client_words else None
+        if not words_path:
+            return config
+        return f"{config} --user-words {_tesseract_path(os.path.abspath(words_path))}"
+
+    def _split_tall_image(self, image: np.ndarray) -> List[np.ndarray]:
+        """
+        Parte una captura muy alta en franjas horizontales solapadas
+
+        Los cortes se buscan en filas en blanco (desviación estándar baja) cerca de
+        cada múltiplo de tile_height; si no hay ninguna se corta en el objetivo y el
+        solapamiento evita perder la línea partida.
+
+        Returns:
+            Lista de franjas (vistas sobre la imagen), vacía si no hace falta partirla
+        """
+        height, width = image.shape[:2]
+        if height < self.tile_min_height or height < 2 * width:
+            return []
+
+        row_std = image.std(axis=1)
+        blank_rows = row_std < 8
+
+        cuts = [0]
+        window = self.tile_height // 4
+        while height - cuts[-1] > self.tile_height + window:
+            target = cuts[-1] + self.tile_height
+            lo, hi = target - window, min(height - 1, target + window)
+            candidates = np.flatnonzero(blank_rows[lo:hi]) + lo
+            cut = int(candidates[np.argmin(np.abs(candidates - target))]) if candidates.size else target
+            cuts.append(cut)
+        cuts.append(height)
+
+        return [
+            image[max(0, start - self.tile_overlap):min(height, end + self.tile_overlap)]
+            for start, end in zip(cuts[:-1], cuts[1:])
+        ]
+
+    @staticmethod
+    def _merge_strip_texts(texts: List[str], max_overlap_lines: int = 5) -> str:
+        """Une el texto de franjas consecutivas quitando las líneas repetidas en el solapamiento"""
+        def _norm(line: str) -> str:
+            return re.sub(r'\s+', ' ', line).strip()
+
+        merged: List[str] = []
+        for text in texts:
+            lines = [line for line in text.splitlines() if line.strip()]
+            overlap = 0
+            for k in range(min(max_overlap_lines, len(merged), len(lines)), 0, -1):
+                if [_norm(l) for l in merged[-k:]] == [_norm(l) for l in lines[:k]]:
+                    overlap = k
+                    break
+            merged.extend(lines[overlap:])
+        return '\n'.join(merged)
+
+    def _ocr_tiled(self, strips: List[np.ndarray], lang: str, config: str) -> tuple[str, float]:
+        """OCR en paralelo de las franjas de una captura alta; confianza ponderada por palabras"""
+        # Las franjas corren en otros hilos: heredan el límite de la petición
+        deadline = getattr(self._worker_state, 'deadline', None)
+
+        background = self.thread_budget.in_background()
+
+        def _ocr_strip(strip: np.ndarray) -> tuple[str, float, int, float]:
+            yielded = self.yielded_s()
+            with self.thread_budget.inherit(background), self._limited(deadline):
+                data = self._ocr_data(strip, lang=lang, config=config)
+            words = sum(1 for c in data.get('conf', []) if float(c) >= 0)
+            return self._text_from_data(data), self._mean_confidence(data), words, self.yielded_s() - yielded
+
+        # La petición ya tiene su slot; cada franja en paralelo además de la primera
+        # es un proceso de Tesseract más para el reparto de hilos
+        workers = min(len(strips), self.tile_workers)
+        with self.thread_budget.widen(workers - 1), ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_ocr_strip, strips))
+        # Las franjas esperan a la vez: para la petición cuenta la mayor espera
+        self._worker_state.yielded_s = self.yielded_s() + max(waited for _, _, _, waited in results)
+
+        total_words = sum(words for _, _, words, _ in results)
+        confidence = sum(conf * words for _, conf, words, _ in results) / total_words if total_words else 0.0
+        text = self._merge_strip_texts([text for text, _, _, _ in results])
+        self.logger.info(f"Tiled OCR: {len(strips)} strips, {total_words} words, conf={confidence:.2f}")
+        return text, confidence
+
+    def _recognize(self, image: np.ndarray, lang: str = 'spa+eng', config: str = '') -> tuple[str, float]:
+        """
+        Una pasada de reconocimiento: texto y confianza promedio
+
+        Las capturas muy altas se procesan por franjas en paralelo (_ocr_tiled).
+        """
+        strips = self._split_tall_image(image)
+        if strips:
+            return self._ocr_tiled(strips, lang, config)
+        text = self._ocr_string(image, lang=lang, config=config).strip()
+        confidence = self._mean_confidence(self._ocr_data(image, lang=lang, config=config))
+        return text, confidence
+
+    def _recognize_job_codes(self, gray: np.ndarray) -> tuple[str, float]:
+        """Reconocimiento especializado para líneas Tddmmaa-NOMBRE-qtyM (una sola pasada)"""
+        config = self._with_client_words(self.tesseract_config_job_code)
+        strips = self._split_tall_image(gray)
+        if strips:
+            return self._ocr_tiled(strips, self.job_code_lang, config)
+        data = self._ocr_data(gray, lang=self.job_code_lang, config=config)
+        return self._text_from_data(data), self._mean_confidence(data)
+
+    def _recognize_many(self, images: List[np.ndarray], lang: str, config: str) -> List[tuple[str, float]]:
+        """
+        Reconoce varias imágenes con la misma configuración en un solo proceso de Tesseract
+
+        Tesseract acepta como entrada un archivo de texto con una ruta de imagen por
+        línea; así el arranque del proceso y la carga de los modelos se pagan una
+        vez por lote. La salida TSV se reparte por page_num (una página por imagen).
+
+        Returns:
+            Lista de (texto, confianza) en el orden de images
+        """
+        if not images:
+            return []
+        with tempfile.TemporaryDirectory(prefix='ocr_batch_') as tmp_dir:
+            paths = []
+            for i, image in enumerate(images):
+                path = os.path.join(tmp_dir, f"{i:05d}.png")
+                cv2.imwrite(path, image)
+                paths.append(path)
+            list_path = os.path.join(tmp_dir, 'images.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(paths) + '\n')
+            data = self._ocr_data(list_path, lang=lang, config=config, images=len(images))
+
+        pages: List[Dict[str, list]] = [{key: [] for key in data} for _ in images]
+        for row, page_num in enumerate(data.get('page_num', [])):
+            page = int(page_num) - 1
+            if 0 <= page < len(pages):
+                for key, values in data.items():
+                    pages[page][key].append(values[row])
+        return [(self._text_from_data(page), self._mean_confidence(page)) for page in pages]
+
+    def _line_cached_ocr(self, run: StageRun) -> Optional[tuple[str, float, str]]:
+        """
+        OCR por líneas con caché (ver line_cache)
+
+        Segmenta la captura en líneas y solo reconoce (en una sola invocación de
+        Tesseract, PSM 7) las que no están en la caché; el coste es proporcional a
+        las filas nuevas. Solo se usa Tesseract si la captura es de la cola: coincide
+        con un layout registrado o al menos line_cache_min_hit_ratio de sus líneas ya
+        están en la caché. Si no, o si la segmentación no es fiable, devuelve None
+        (sin llamar a Tesseract) y sigue el pipeline normal.
+
+        Returns:
+            Tuple (texto, confianza, modo), o None
+        """
+        try:
+            lines = run.get('line_keys')
+            if lines is None:
+                return None
+
+            # [clave, registro] por línea, en orden; los registros None se reconocen
+            entries = [[key, self.line_cache.get(key)] for _, _, key in lines]
+            hits = sum(1 for _, record in entries if record is not None)
+            if run.get('layout') is None and hits < self.line_cache_min_hit_ratio * len(entries):
+                return None
+
+            oriented = run.get('oriented')
+            missing = [(index, oriented[max(0, y0 - 2):y1 + 2])
+                       for index, (y0, y1, _) in enumerate(lines) if entries[index][1] is None]
+            if missing:
+                config = self._with_client_words(self.tesseract_config_job_code).replace('--psm 6', '--psm 7')
+                recognized = self._recognize_many([crop for _, crop in missing], self.job_code_lang, config)
+                new_records = []
+                for (index, _), (text, conf) in zip(missing, recognized):
+                    record = self._line_record(entries[index][0], text, conf)
+                    entries[index][1] = record
+                    new_records.append(record)
+                self.line_cache.put_many(new_records)
+
+            records = [record for _, record in entries if record['text']]
+            if not records:
+                return None
+            text = '\n'.join(record['text'] for record in records)
+            confidence = sum(record['conf'] for record in records) / len(records)
+            self.logger.info(f"Line cache: {hits}/{len(entries)} lines reused")
+            return text, confidence, f"lines:{len(missing)}_new"
+        except Exception as e:
+            self.logger.error(f"Line-cached OCR failed: {e}")
+            return None
+
+    def _line_record(self, key: str, text: str, conf: float) -> Dict:
+        """Registro de la caché por líneas (el trabajo parseado va sin resolver el cliente)"""
+        jobs = self.parse_jobs_from_text(text)
+        return {'key': key, 'text': text, 'conf': conf, 'job': jobs[0] if jobs else None}
+
+    def _seed_line_cache(self, run: StageRun, text: str, conf: float):
+        """
+        Guarda en la caché por líneas el resultado de la ruta rápida sobre la captura completa
+
+        Solo si sus líneas de texto se corresponden una a una con las líneas
+        segmentadas; así las capturas de la cola sin layout registrado también
+        alimentan la caché sin otra pasada de Tesseract.
+        """
+        try:
+            lines = run.get('line_keys')
+            text_lines = [line.strip() for line in text.splitlines() if line.strip()]
+            if lines is None or len(lines) != len(text_lines):
+                return
+            self.line_cache.put_many([
+                self._line_record(key, line, conf)
+                for (_, _, key), line in zip(lines, text_lines) if key not in self.line_cache
+            ])
+        except Exception as e:
+            self.logger.error(f"Line cache seeding failed: {e}")
+
+    def _job_code_fast_path(self, run: StageRun) -> Optional[tuple[str, float, str]]:
+        """
+        Ruta rápida para capturas de la cola del RIP
+
+        Si la captura coincide con un layout registrado se reconoce solo la región
+        de la lista de trabajos; si no (o si esa región no produce líneas válidas)
+        se reconoce la imagen completa con la configuración de códigos.
+
+        Returns:
+            Tuple (texto, confianza, modo), o None si falló la pasada
+        """
+        try:
+            gray = run.get('gray')
+
+            match = run.get('layout')
+            if match:
+                template, similarity = match
+                region = LayoutRegistry.crop(gray, template)
+                invert, _ = self._detect_polarity(region)
+                if invert:
+                    region = cv2.bitwise_not(region)
+                text, confidence = self._recognize_job_codes(region)
+                if self.parse_jobs_from_text(text):
+                    self.logger.info(f"Layout {template['name']} matched (similarity={similarity:.3f})")
+                    return text, confidence, f"layout:{template['name']}"
+                self.logger.info(f"Layout {template['name']} matched but its region has no job lines")
+
+            text, confidence = self._recognize_job_codes(run.get('oriented'))
+            return text, confidence, 'job_code'
+        except Exception as e:
+            self.logger.error(f"Job-code fast path failed: {e}")
+            return None
+
+    def score_ocr_text(self, text: str) -> float:
+        """
+        Puntúa la calidad de un texto OCR por los trabajos que se pueden parsear
+
+        Combina la proporción de líneas con aspecto de código que parsean, fechas
+        plausibles y cantidades numéricas razonables.
+
+        Args:
+            text: Texto extraído por OCR
+
+        Returns:
+            Score entre 0 (sin líneas de trabajo) y 1
+        """
+        jobs = self.parse_jobs_from_text(text)
+        if not jobs:
+            return 0.0
+
+        job_like_lines = [line for line in text.splitlines() if JOB_LIKE_LINE_RE.search(line)]
+        coverage = min(1.0, len(jobs) / max(len(job_like_lines), 1))
+
+        today = date.today()
+        oldest = today - timedelta(days=self.job_date_max_age_days)
+        newest = today + timedelta(days=31)
+        plausible_dates = 0
+        for job in jobs:
+            try:
+                job_date = date.fromisoformat(job.get('job_date', ''))
+            except ValueError:
+                continue
+            if oldest <= job_date <= newest:
+                plausible_dates += 1
+
+        numeric_quantities = sum(
+            1 for job in jobs
+            if isinstance(job.get('quantity_m'), (int, float)) and 0 < job['quantity_m'] <= 1000
+        )
+
+        return 0.4 * coverage + 0.3 * plausible_dates / len(jobs) + 0.3 * numeric_quantities / len(jobs)
+
+    def _build_job_details(self, text: str, confidence: float) -> JobDetails:
+        """Parsea el texto elegido y arma el JobDetails final"""
+        job_details = self._parse_job_info(text)
+        job_details.detected_text = text
+        job_details.confidence = confidence
+        return job_details
+
+    def extract_job_details(self, image_path: str,
+                            intermediates: Optional[Dict[str, np.ndarray]] = None,
+                            mode: Optional[str] = None, deadline_ms: Optional[float] = None) -> JobDetails:
         """
         Extrae detalles del trabajo desde una captura de pantalla
-        
+
         Args:
             image_path: Ruta a la imagen a procesar
-            
+            intermediates: Si se da, recibe los intermedios calculados ('gray' siempre;
+                'enhanced' y 'final' si se llegó a preprocesar) para reprocesar después
+            mode: Modo de calidad (QUALITY_MODES); por defecto self.quality_mode
+            deadline_ms: Tiempo máximo de la petición; las etapas que no caben según su
+                coste medido se saltan y el resultado se marca como partial
+
         Returns:
             JobDetails object con la información extraída
         """
+        mode = mode or self.quality_mode
+        if mode not in QUALITY_MODES:
+            raise ValueError(f"Unknown quality mode: {mode}")
+        deadline = Deadline(deadline_ms, self.ocr_request_timeout)
+        with self.thread_budget.slot(), self._limited(deadline), self.buffer_pool.borrow() as buffers:
+            run = self._stage_run(image_path, buffers=buffers)
+            job_details = self._apply_status(self._extract_job_details(image_path, mode, deadline, run=run),
+                                             deadline)
+            self.logger.info(f"Stage timings: {run.summary()}")
+            if intermediates is not None:
+                self._keep_intermediates(run, intermediates)
+            return job_details
+
+    def _keep_intermediates(self, run: StageRun, intermediates: Dict[str, np.ndarray]):
+        """Copia los intermedios de la ejecución ('gray' siempre; 'enhanced'/'final' si se calcularon)"""
+        try:
+            intermediates['gray'] = np.array(run.get('gray'))
+            for name, stage in (('enhanced', 'scale'), ('final', 'threshold')):
+                if run.has(stage):
+                    # Copia: las etapas viven en los buffers del worker
+                    intermediates[name] = run.get(stage).copy()
+        except Exception as e:
+            self.logger.warning(f"Could not keep intermediates: {e}")
+
+    def reprocess_intermediates(self, intermediates: Dict[str, np.ndarray], variant: str = 'final',
+                                psm: int = 6, lang: str = 'spa+eng') -> JobDetails:
+        """
+        Una sola pasada de reconocimiento sobre intermedios ya calculados
+
+        Args:
+            intermediates: Arrays guardados de una pasada anterior ('gray', 'enhanced', 'final')
+            variant: Intermedio a reconocer; 'enhanced'/'final' se recalculan desde 'gray' si faltan
+            psm: Page segmentation mode de Tesseract
+            lang: Idiomas de Tesseract
+
+        Returns:
+            JobDetails con el resultado de esa pasada (vacío con status 'timeout' si Tesseract
+            superó su límite)
+        """
+        if variant not in ('gray', 'enhanced', 'final'):
+            raise ValueError(f"Unknown variant: {variant}")
+        if not 0 <= int(psm) <= 13:
+            raise ValueError(f"Invalid PSM: {psm}")
+
+        deadline = Deadline(hard_limit_s=self.ocr_request_timeout)
+        with self.thread_budget.slot(), self._limited(deadline), self.buffer_pool.borrow() as buffers:
+            image = intermediates.get(variant) if variant != 'gray' else None
+            if image is None:
+                if 'gray' not in intermediates:
+                    raise ValueError("No cached intermediates to reprocess")
+                # Las etapas no escriben sobre su entrada: el gris cacheado (mmap) se usa tal cual
+                run = self._stage_run(buffers=buffers, gray=intermediates['gray'])
+                image = run.get({'gray': 'oriented', 'enhanced': 'scale', 'final': 'threshold'}[variant])
+
+            try:
+                text, confidence = self._recognize(image, lang=lang, config=f'--psm {int(psm)}')
+            except OCRTimeoutError:
+                return self._apply_status(JobDetails(), deadline)
+            self.logger.info(f"Reprocessed variant={variant} psm={psm}: len={len(text)} conf={confidence:.2f}")
+            return self._build_job_details(text, confidence)
+
+    def _extract_job_details(self, image_path: str, mode: str = 'balanced', deadline: Optional[Deadline] = None,
+                             prior_candidates: Optional[List[tuple]] = None,
+                             run: Optional[StageRun] = None) -> JobDetails:
+        """
+        Implementación de extract_job_details (se ejecuta dentro de un slot de hilos)
+
+        prior_candidates: candidatos (texto, confianza, modo, score) de la ruta rápida y
+        el OCR simple ya obtenidos por lotes (process_batch); si se dan, esas etapas
+        no se repiten.
+        run: ejecución del grafo de etapas con lo ya calculado de esta imagen
+        """
+        deadline = deadline or Deadline()
+        run = run or self._stage_run(image_path)
         try:
             self.logger.info(f"Processing image: {image_path}")
             
             # Verificar que el archivo existe
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"Image file not found: {image_path}")
-            
-            # 1) OCR SIMPLE PRIMERO (gris + invertido)
-            best_text = ""
-            best_conf = 0.0
-            best_mode = ""
-            try:
-                original = cv2.imread(image_path)
-                if original is not None:
-                    gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
-                    inv = cv2.bitwise_not(gray)
+
+            # Candidatos (texto, confianza, modo, score); se corta en cuanto uno alcanza early_exit_score
+            candidates: List[tuple] = list(prior_candidates or [])
+            run_simple_stages = prior_candidates is None
+
+            def _good_enough(text: str, conf: float, mode: str) -> bool:
+                score = self.score_ocr_text(text)
+                candidates.append((text, conf, mode, score))
+                self.logger.info(f"Candidate {mode}: score={score:.2f} len={len(text)} conf={conf:.2f}")
+                return score >= self.early_exit_score
+
+            def _fits(stage: str) -> bool:
+                return deadline.allows(self.stage_costs.estimate(stage))
+
+            # 0) Capturas repetidas: solo las líneas que no están en la caché pasan por Tesseract
+            if run_simple_stages and self.line_cache is not None and _fits('lines'):
+                with self.stage_costs.measure('lines'):
+                    line_result = self._line_cached_ocr(run)
+                if line_result is not None and _good_enough(*line_result):
+                    text, conf, line_mode = line_result
+                    self.logger.info(f"OCR completed ({line_mode}) with confidence: {conf:.2f}")
+                    return self._build_job_details(text, conf)
+
+            #    Ruta rápida de códigos de trabajo (región del layout si se reconoce la ventana);
+            #    el pipeline spa+eng solo si no basta
+            if run_simple_stages and self.job_code_fast_path and _fits('fast_path'):
+                with self.stage_costs.measure('fast_path'):
+                    fast_result = self._job_code_fast_path(run)
+                if fast_result is not None and _good_enough(*fast_result):
+                    text, conf, fast_mode = fast_result
+                    if fast_mode == 'job_code' and self.line_cache is not None:
+                        self._seed_line_cache(run, text, conf)
+                    self.logger.info(f"OCR completed ({fast_mode} fast path) with confidence: {conf:.2f}")
+                    return self._build_job_details(text, conf)
+
+            # 1) OCR SIMPLE PRIMERO (orientación elegida por el clasificador de polaridad;
+            #    la otra solo se prueba si el clasificador no está seguro)
+            if run_simple_stages:
+                try:
+                    invert, certainty = run.get('polarity')
+
+                    ts = datetime.now().strftime('%Y%m%d_%H%M%S')
+                    cv2.imwrite(os.path.join(self.debug_dir, f"simple_{ts}_gray.png"), run.get('gray'))
+                    cv2.imwrite(os.path.join(self.debug_dir, f"simple_{ts}_inverted.png"), run.get('inverted'))
 
                     # Importante: NO incluir --lang en config; pasar lang='spa+eng' por parámetro
                     cfg = '--psm 6'
 
-                    # Directo
-                    text_dir = pytesseract.image_to_string(gray, lang='spa+eng', config=cfg).strip()
-                    data_dir = pytesseract.image_to_data(gray, lang='spa+eng', config=cfg, output_type=pytesseract.Output.DICT)
-                    conf_dir_vals = []
-                    for c in data_dir.get('conf', []):
-                        try:
-                            ci = int(c)
-                            if ci >= 0:
-                                conf_dir_vals.append(ci)
-                        except Exception:
-                            pass
-                    conf_dir = sum(conf_dir_vals) / len(conf_dir_vals) if conf_dir_vals else 0.0
-
-                    # Invertido
-                    text_inv = pytesseract.image_to_string(inv, lang='spa+eng', config=cfg).strip()
-                    data_inv = pytesseract.image_to_data(inv, lang='spa+eng', config=cfg, output_type=pytesseract.Output.DICT)
-                    conf_inv_vals = []
-                    for c in data_inv.get('conf', []):
-                        try:
-                            ci = int(c)
-                            if ci >= 0:
-                                conf_inv_vals.append(ci)
-                        except Exception:
-                            pass
-                    conf_inv = sum(conf_inv_vals) / len(conf_inv_vals) if conf_inv_vals else 0.0
-
-                    cand = [
-                        (text_dir, conf_dir, 'simple_direct'),
-                        (text_inv, conf_inv, 'simple_inverted'),
-                    ]
-                    best_text, best_conf, best_mode = max(cand, key=lambda t: (len(t[0]), t[1]))
+                    orientations = [('gray', 'simple_direct'), ('inverted', 'simple_inverted')]
+                    if invert:
+                        orientations.reverse()
+                    if certainty >= self.polarity_min_certainty and mode != 'thorough':
+                        orientations = orientations[:1]
 
-                    ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    cv2.imwrite(os.path.join(self.debug_dir, f"simple_{ts}_gray.png"), gray)
-                    cv2.imwrite(os.path.join(self.debug_dir, f"simple_{ts}_inverted.png"), inv)
-                    self.logger.info(f"Simple OCR best={best_mode} len={len(best_text)} conf={best_conf:.2f}")
-            except Exception as fe:
-                self.logger.error(f"Simple OCR failed: {fe}")
-
-            # 2) OCR con preprocesamiento (pipeline)
-            processed_image = self._preprocess_image(image_path)
-            raw_text_pp, conf_pp = self._extract_text_with_confidence(processed_image)
-            self.logger.info(f"Preprocessed OCR len={len(raw_text_pp.strip())} conf={conf_pp:.2f}")
-
-            # 3) Elegir mejor resultado entre simple y preprocesado
-            if len(raw_text_pp.strip()) > len(best_text.strip()) or conf_pp > best_conf:
-                raw_text, confidence = raw_text_pp.strip(), conf_pp
-                self.logger.info("Using preprocessed OCR result")
-            else:
-                raw_text, confidence = best_text.strip(), best_conf
-                self.logger.info("Using simple OCR result")
-            
-            # Parsear información estructurada
-            job_details = self._parse_job_info(raw_text)
-            job_details.detected_text = raw_text
-            job_details.confidence = confidence
-            
+                    for stage, orientation in orientations:
+                        if not _fits('simple'):
+                            break
+                        with self.stage_costs.measure('simple'):
+                            text, conf = run.recognize(stage, 'spa+eng', cfg)
+                        if _good_enough(text, conf, orientation):
+                            self.logger.info(f"OCR completed ({orientation}) with confidence: {conf:.2f}")
+                            return self._build_job_details(text, conf)
+                except Exception as fe:
+                    self.logger.error(f"Simple OCR failed: {fe}")
+
+            # 2) OCR con preprocesamiento (pipeline); fuera del modo fast y solo si cabe
+            #    al menos el preprocesado y una pasada de reconocimiento
+            orientation = None
+            if mode != 'fast' and deadline.allows(
+                    self.stage_costs.estimate('preprocess') + self.stage_costs.estimate('pp_pass')):
+                with self.stage_costs.measure('preprocess'):
+                    run.get('threshold')
+                orientation = run.get('deskew')[1]
+                raw_text_pp, conf_pp = self._extract_text_with_confidence(run, deadline, mode)
+                _good_enough(raw_text_pp.strip(), conf_pp, 'preprocessed')
+
+            # 3) Elegir el mejor candidato: primero por score de parseo, luego longitud y confianza
+            if not candidates:
+                self.logger.warning(f"Deadline reached before any OCR pass ({mode} mode)")
+                job_details = JobDetails()
+                job_details.partial = deadline.cut
+                return job_details
+            raw_text, confidence, chosen, score = max(candidates, key=lambda c: (c[3], len(c[0]), c[1]))
+            self.logger.info(f"Using {chosen} OCR result (score={score:.2f})")
+
+            job_details = self._build_job_details(raw_text, confidence)
+            job_details.partial = deadline.cut
+            job_details.orientation = orientation
+            if deadline.cut:
+                self.logger.info(f"Deadline reached: returning partial result ({mode} mode)")
             self.logger.info(f"OCR completed with confidence: {confidence:.2f}")
             return job_details
-            
+
         except Exception as e:
             self.logger.error(f"Error extracting job details: {e}")
             # Retornar objeto vacío en caso de error
             error_job = JobDetails()
             error_job.detected_text = f"Error processing image: {str(e)}"
+            error_job.status = 'error'
             return error_job
     
-    def _preprocess_image(self, image_path: str) -> np.ndarray:
+    @contextmanager
+    def preloaded_gray(self, image_path: str, gray: np.ndarray):
         """
-        Preprocesa la imagen para mejorar la precisión del OCR
-        
+        Usa una imagen ya decodificada como contenido de image_path en este hilo
+
+        Para workers que reciben la imagen decodificada (p. ej. por memoria
+        compartida, ver shm_transport): el pipeline no vuelve a leer el archivo.
+
+        Args:
+            image_path: Ruta a la que corresponde la imagen
+            gray: Imagen en escala de grises (puede ser de solo lectura)
+        """
+        previous = getattr(self._worker_state, 'preloaded', None)
+        self._worker_state.preloaded = (image_path, gray)
+        try:
+            yield
+        finally:
+            self._worker_state.preloaded = previous
+
+    def load_gray(self, image_path: str) -> np.ndarray:
+        """
+        Decodifica la imagen directamente a escala de grises dentro del presupuesto
+
+        Lee primero las dimensiones de la cabecera (sin decodificar píxeles), rechaza
+        bombas de descompresión y, si la imagen supera max_pixels, usa los modos de
+        decodificación reducida de OpenCV (1/2, 1/4, 1/8) para no materializar nunca
+        la imagen completa a color.
+
         Args:
             image_path: Ruta a la imagen
-            
+
         Returns:
-            Imagen procesada como array numpy
+            Imagen en escala de grises (uint8)
+        """
+        preloaded = getattr(self._worker_state, 'preloaded', None)
+        if preloaded is not None and preloaded[0] == image_path:
+            # Copia propia: quien llama puede modificar la imagen in-place
+            return self._fit_pixel_budget(np.array(preloaded[1]))
+        return self._fit_pixel_budget(self._decode_gray(image_path))
+
+    def _decode_gray(self, image_path: str) -> np.ndarray:
         """
+        Decodificación en gris (reducida si supera max_pixels), sin aplicar el presupuesto
+
+        Si hay una imagen precargada para la ruta (preloaded_gray) se devuelve tal
+        cual, sin copiar: las etapas del grafo nunca escriben sobre su entrada.
+        """
+        preloaded = getattr(self._worker_state, 'preloaded', None)
+        if preloaded is not None and preloaded[0] == image_path:
+            return preloaded[1]
+
         try:
-            # Cargar imagen
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError("Could not load image")
-            
-            # Convertir a escala de grises
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # Detectar si es fondo oscuro con texto claro
-            mean_brightness = np.mean(gray)
-            self.logger.info(f"Image mean brightness: {mean_brightness}")
-            
-            # Para WhatsApp/chat screenshots, siempre invertir si es oscuro
-            if mean_brightness < 100:  # Umbral más bajo para capturas oscuras
-                self.logger.info("Dark background detected, inverting colors")
-                gray = cv2.bitwise_not(gray)
-                # Guardar imagen invertida para debug
-                debug_inverted = image_path.replace('.jpg', '_inverted.png').replace('.jpeg', '_inverted.png')
-                cv2.imwrite(debug_inverted, gray)
-                self.logger.info(f"DEBUG: Saved inverted image to {debug_inverted}")
-            
-            # Aplicar filtro de ruido
-            denoised = cv2.fastNlMeansDenoising(gray)
-            
-            # Mejorar contraste usando CLAHE
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-            enhanced = clahe.apply(denoised)
-            
-            # Redimensionar imagen para mejorar OCR en texto pequeño
-            height, width = enhanced.shape
-            min_dim = 800  # eleva el mínimo para hacer más legible texto delgado
-            if height < min_dim or width < min_dim:
-                scale_factor = max(min_dim/height, min_dim/width, 2.0)
+            with Image.open(image_path) as header:
+                width, height = header.size
+        except Image.DecompressionBombError as e:
+            raise ValueError(f"Image rejected (decompression bomb): {e}")
+        except Exception as e:
+            raise ValueError(f"Could not load image: {e}")
+
+        pixels = width * height
+        if pixels > self.max_input_pixels:
+            raise ValueError(f"Image too large: {width}x{height} exceeds {self.max_input_pixels} pixels")
+
+        factor = 1
+        for candidate in (1, 2, 4, 8):
+            factor = candidate
+            if pixels / (candidate * candidate) <= self.max_pixels:
+                break
+        flag = REDUCED_GRAYSCALE_FLAGS[factor]
+        gray = cv2.imread(image_path, flag)
+        if gray is None:
+            raise ValueError("Could not load image")
+        if factor > 1:
+            self.logger.info(f"Reduced decode 1/{factor}: {width}x{height} -> {gray.shape[1]}x{gray.shape[0]}")
+        return gray
+
+    def _fit_pixel_budget(self, gray: np.ndarray) -> np.ndarray:
+        """
+        Aplica el presupuesto de píxeles a la imagen de entrada
+
+        Rechaza imágenes por encima de max_input_pixels y reduce (INTER_AREA) las
+        que superan max_pixels para acotar la memoria de cada petición.
+        """
+        height, width = gray.shape[:2]
+        pixels = height * width
+        if pixels > self.max_input_pixels:
+            raise ValueError(f"Image too large: {width}x{height} exceeds {self.max_input_pixels} pixels")
+        if pixels <= self.max_pixels:
+            return gray
+        scale = (self.max_pixels / pixels) ** 0.5
+        new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        self.logger.info(f"Downscaling {width}x{height} to {new_size[0]}x{new_size[1]} (pixel budget)")
+        return cv2.resize(gray, new_size, interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def _profile_sharpness(ink: np.ndarray) -> float:
+        """Variación relativa del perfil de proyección por filas (alta con líneas de texto horizontales)"""
+        rows = ink.sum(axis=1, dtype=np.float64)
+        mean = rows.mean()
+        return float(rows.var() / (mean * mean)) if mean > 0 else 0.0
+
+    @staticmethod
+    def _is_vertical_text(ink: np.ndarray) -> bool:
+        """
+        True si las líneas de texto van en vertical (imagen girada 90°)
+
+        Con un cierre morfológico las letras se unen en palabras; en texto
+        horizontal casi toda la tinta queda en manchas más anchas que altas.
+        """
+        closed = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5)))
+        _, _, stats, _ = cv2.connectedComponentsWithStats(closed, connectivity=8)
+        wide = tall = 0
+        for _, _, w, h, area in stats[1:]:
+            if area < 20:
+                continue
+            if w > 1.5 * h:
+                wide += area
+            elif h > 1.5 * w:
+                tall += area
+        return tall > 2 * wide
+
+    @staticmethod
+    def _is_upside_down(ink: np.ndarray) -> bool:
+        """
+        True si el texto parece girado 180°
+
+        En texto (y tablas) alineado a la izquierda, el inicio de cada bloque de una
+        línea coincide con el de otras líneas más a menudo que su final. Girado 180°
+        pasa lo contrario.
+        """
+        height, width = ink.shape
+        rows = ink.any(axis=1)
+        gap = max(3, int(0.02 * width))
+        tolerance = max(2, int(0.005 * width))
+        starts, ends, lines = [], [], []
+        y = 0
+        while y < height:
+            if not rows[y]:
+                y += 1
+                continue
+            y0 = y
+            while y < height and rows[y]:
+                y += 1
+            columns = np.flatnonzero(ink[y0:y].any(axis=0))
+            splits = np.flatnonzero(np.diff(columns) > gap)
+            starts.extend([columns[0]] + [columns[i + 1] for i in splits])
+            ends.extend([columns[i] for i in splits] + [columns[-1]])
+            lines.extend([len(set(lines))] * (len(splits) + 1))
+        if len(set(lines)) < 3:
+            return False
+
+        lines = np.asarray(lines)
+
+        def _aligned(edges: List[int]) -> float:
+            edges = np.asarray(edges)
+            close = np.abs(edges[:, None] - edges[None, :]) <= tolerance
+            other_line = lines[:, None] != lines[None, :]
+            return float((close & other_line).any(axis=1).mean())
+
+        return _aligned(ends) - _aligned(starts) >= 0.1
+
+    def _detect_orientation(self, gray: np.ndarray) -> tuple[int, float]:
+        """
+        Rotación (múltiplo de 90°) e inclinación del texto, con perfiles de proyección
+
+        Trabaja sobre una copia reducida (lado mayor orientation_max_side) de la
+        máscara de tinta: el giro de 90° se detecta por la forma de las palabras,
+        la inclinación buscando el ángulo que hace más nítido el perfil por filas
+        (búsqueda gruesa de 1° y fina de 0.2°), y el giro de 180° por la alineación
+        de los bloques de cada línea.
+
+        Args:
+            gray: Imagen en gris con texto oscuro sobre fondo claro
+
+        Returns:
+            Tuple (rotación en grados horarios: 0/90/180/270, inclinación en grados
+            a corregir con getRotationMatrix2D)
+        """
+        height, width = gray.shape[:2]
+        scale = min(1.0, self.orientation_max_side / float(max(height, width)))
+        small = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+        _, ink = cv2.threshold(small, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        if cv2.countNonZero(ink) < 0.002 * ink.size:
+            return 0, 0.0
+
+        rotation = 0
+        if self._is_vertical_text(ink):
+            rotation = 90
+            ink = cv2.rotate(ink, cv2.ROTATE_90_CLOCKWISE)
+
+        h, w = ink.shape
+        center = (w / 2.0, h / 2.0)
+
+        def _score(angle: float) -> float:
+            matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+            return self._profile_sharpness(cv2.warpAffine(ink, matrix, (w, h), flags=cv2.INTER_NEAREST))
+
+        coarse = np.arange(-self.max_skew_angle, self.max_skew_angle + 0.01, 1.0)
+        best = max(coarse, key=_score)
+        fine = np.arange(best - 0.8, best + 0.81, 0.2)
+        skew = float(max(fine, key=_score))
+
+        if self._is_upside_down(cv2.warpAffine(ink, cv2.getRotationMatrix2D(center, skew, 1.0), (w, h),
+                                               flags=cv2.INTER_NEAREST)):
+            rotation = (rotation + 180) % 360
+        return rotation, round(skew, 1) + 0.0
+
+    def _normalize_orientation(self, gray: np.ndarray, buffers: PreprocessBuffers) -> tuple[np.ndarray, Dict]:
+        """
+        Endereza la imagen una sola vez antes del reconocimiento
+
+        Returns:
+            Tuple (imagen enderezada, posiblemente un buffer del worker; {'rotation', 'skew'})
+        """
+        rotation, skew = self._detect_orientation(gray)
+        if rotation:
+            code = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}[rotation]
+            shape = gray.shape[::-1] if rotation in (90, 270) else gray.shape
+            oriented = buffers.get('oriented', shape)
+            cv2.rotate(gray, code, dst=oriented)
+            gray = oriented
+        if abs(skew) >= 0.3:
+            height, width = gray.shape
+            matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), skew, 1.0)
+            deskewed = buffers.get('deskewed', gray.shape)
+            cv2.warpAffine(gray, matrix, (width, height), dst=deskewed, flags=cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+            gray = deskewed
+        return gray, {'rotation': rotation, 'skew': skew}
+
+    def _build_stage_graph(self) -> StageGraph:
+        """
+        Pipeline como grafo de etapas (ver stage_graph)
+
+        decode -> gray -> polarity/inverted -> oriented (texto oscuro) -> deskew ->
+        denoise -> enhance -> scale -> threshold; recognize(config) sobre cualquiera.
+        Aparte: layout (plantilla de ventana) sobre gray y line_keys (caché por líneas)
+        sobre oriented.
+        La entrada sembrada es 'path' (o directamente 'gray').
+        """
+        return StageGraph([
+            Stage('decode', ('path',), lambda run, path: self._decode_gray(path)),
+            Stage('gray', ('decode',), lambda run, decoded: self._fit_pixel_budget(decoded)),
+            Stage('polarity', ('gray',), lambda run, gray: self._detect_polarity(gray)),
+            Stage('inverted', ('gray',), self._stage_inverted),
+            Stage('oriented', ('gray', 'polarity'), self._stage_oriented),
+            Stage('layout', ('gray',), self._stage_layout),
+            Stage('line_keys', ('oriented',), self._stage_line_keys),
+            Stage('deskew', ('oriented',), self._stage_deskew),
+            Stage('denoise', ('deskew',), self._stage_denoise),
+            Stage('enhance', ('denoise',), self._stage_enhance),
+            Stage('scale', ('enhance',), self._stage_scale),
+            Stage('threshold', ('scale',), self._stage_threshold),
+        ], recognizer=lambda run, image, lang, config: self._recognize(image, lang=lang, config=config))
+
+    def _stage_run(self, image_path: Optional[str] = None, buffers: Optional[PreprocessBuffers] = None,
+                   **values) -> StageRun:
+        """
+        Ejecución del grafo para una petición
+
+        Args:
+            image_path: Imagen de entrada (se siembra como 'path')
+            buffers: Buffers de las etapas (prestados por buffer_pool mientras dure la
+                ejecución); por defecto unos nuevos
+            values: Etapas ya calculadas (p. ej. gray=...)
+        """
+        run = self.stage_graph.run(buffers=buffers or PreprocessBuffers(), on_timing=self.stage_costs.record,
+                                   path=image_path, **values)
+        run.debug_prefix = os.path.join(self.debug_dir, f"debug_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        return run
+
+    def _stage_inverted(self, run: StageRun, gray: np.ndarray) -> np.ndarray:
+        return cv2.bitwise_not(gray, dst=run.buffers.get('inverted', gray.shape))
+
+    def _stage_layout(self, run: StageRun, gray: np.ndarray) -> Optional[tuple]:
+        """Layout registrado con el que coincide la captura: (plantilla, similitud) o None"""
+        return self.layout_registry.match(gray) if len(self.layout_registry) else None
+
+    def _stage_line_keys(self, run: StageRun, oriented: np.ndarray) -> Optional[List[tuple]]:
+        """
+        Líneas de texto (y0, y1, clave del recorte) para la caché por líneas
+
+        None si la segmentación no es fiable: pocas líneas o alguna que parece
+        juntar varias filas.
+        """
+        _, ink = cv2.threshold(oriented, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        lines = segment_lines(ink)
+        if len(lines) < self.line_cache_min_lines:
+            return None
+        heights = sorted(y1 - y0 for y0, y1 in lines)
+        if heights[-1] > 3 * heights[len(heights) // 2]:
+            return None
+        keyed = [(y0, y1, crop_key(ink[y0:y1])) for y0, y1 in lines]
+        return [line for line in keyed if line[2] is not None] or None
+
+    def _stage_oriented(self, run: StageRun, gray: np.ndarray, polarity: tuple[bool, float]) -> np.ndarray:
+        """Gris con texto oscuro sobre fondo claro (comparte la imagen invertida con el OCR simple)"""
+        return run.get('inverted') if polarity[0] else gray
+
+    def _stage_deskew(self, run: StageRun, oriented: np.ndarray) -> tuple[np.ndarray, Optional[Dict]]:
+        """
+        Primera etapa exclusiva del preprocesado: enderezado (giros de 90° e inclinación)
+
+        Returns:
+            Tuple (imagen, {'rotation', 'skew'} o None si deskew_enabled es False)
+        """
+        # DEBUG: cada etapa se guarda en cuanto se calcula (los buffers se reutilizan)
+        cv2.imwrite(f"{run.debug_prefix}_01_original.png", run.get('gray'))
+        self.logger.info(f"Image mean brightness: {np.mean(run.get('gray'))}")
+        if run.get('polarity')[0]:
+            # Para WhatsApp/chat screenshots: texto claro sobre fondo oscuro, ya invertido
+            self.logger.info("Dark background detected, inverting colors")
+            # Solo dentro de debug_dir: nunca junto a la imagen de entrada (carpetas de los operadores)
+            cv2.imwrite(f"{run.debug_prefix}_02_inverted.png", oriented)
+            self.logger.info(f"DEBUG: Saved inverted image of {os.path.basename(run.peek('path') or '')} "
+                             f"to {run.debug_prefix}_02_inverted.png")
+
+        if not self.deskew_enabled:
+            return oriented, None
+        image, orientation = self._normalize_orientation(oriented, run.buffers)
+        if orientation['rotation'] or abs(orientation['skew']) >= 0.3:
+            self.logger.info(f"Orientation corrected: rotation={orientation['rotation']} "
+                             f"skew={orientation['skew']:.1f}")
+            cv2.imwrite(f"{run.debug_prefix}_02_deskewed.png", image)
+        return image, orientation
+
+    def _stage_denoise(self, run: StageRun, deskewed: tuple) -> np.ndarray:
+        image = deskewed[0]
+        denoised = run.buffers.get('denoised', image.shape)
+        cv2.fastNlMeansDenoising(image, dst=denoised)
+        cv2.imwrite(f"{run.debug_prefix}_03_denoised.png", denoised)
+        return denoised
+
+    def _stage_enhance(self, run: StageRun, denoised: np.ndarray) -> np.ndarray:
+        """Contraste con CLAHE (objeto creado una vez por worker)"""
+        enhanced = run.buffers.get('enhanced', denoised.shape)
+        run.buffers.clahe.apply(denoised, dst=enhanced)
+        return enhanced
+
+    def _stage_scale(self, run: StageRun, enhanced: np.ndarray) -> np.ndarray:
+        """Agranda las imágenes pequeñas para mejorar el OCR de texto pequeño, sin pasar del presupuesto"""
+        height, width = enhanced.shape
+        min_dim = 800  # eleva el mínimo para hacer más legible texto delgado
+        if height < min_dim or width < min_dim:
+            scale_factor = max(min_dim/height, min_dim/width, 2.0)
+            scale_factor = min(scale_factor, (self.max_pixels / (height * width)) ** 0.5)
+            if scale_factor > 1.0:
                 new_width = int(width * scale_factor)
                 new_height = int(height * scale_factor)
-                enhanced = cv2.resize(enhanced, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
+                scaled = run.buffers.get('scaled', (new_height, new_width))
+                cv2.resize(enhanced, (new_width, new_height), dst=scaled, interpolation=cv2.INTER_CUBIC)
+                enhanced = scaled
                 self.logger.info(f"Resized image from {width}x{height} to {new_width}x{new_height}")
-            
-            # Aplicar threshold: Otsu + Adaptive y combinarlos para conservar trazos finos
-            _, otsu = cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            adaptive = cv2.adaptiveThreshold(
-                enhanced,
-                255,
-                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv2.THRESH_BINARY,
-                15,
-                8,
-            )
-            combined = cv2.bitwise_or(otsu, adaptive)
-
-            # Morfología: dilatación suave + cierre para engrosar texto y unir cortes
-            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
-            dilated = cv2.dilate(combined, kernel, iterations=1)
-            processed = cv2.morphologyEx(dilated, cv2.MORPH_CLOSE, kernel, iterations=1)
-            
-            # DEBUG: Guardar TODAS las etapas de procesamiento
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            debug_prefix = os.path.join(self.debug_dir, f"debug_{timestamp}")
-            
-            # Guardar imagen original
-            cv2.imwrite(f"{debug_prefix}_01_original.png", cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
-            
-            # Guardar después de inversión (si aplica)
-            if mean_brightness < 100:
-                cv2.imwrite(f"{debug_prefix}_02_inverted.png", gray)
-            
-            # Guardar después de denoising
-            cv2.imwrite(f"{debug_prefix}_03_denoised.png", denoised)
-            
-            # Guardar después de CLAHE
-            cv2.imwrite(f"{debug_prefix}_04_enhanced.png", enhanced)
-            
-            # Guardar después de thresholds
-            cv2.imwrite(f"{debug_prefix}_05_threshold_otsu.png", otsu)
-            cv2.imwrite(f"{debug_prefix}_05_threshold_adaptive.png", adaptive)
-            cv2.imwrite(f"{debug_prefix}_05_threshold_combined.png", combined)
-            
-            # Guardar imagen final procesada
-            cv2.imwrite(f"{debug_prefix}_06_final.png", processed)
-            
-            self.logger.info(f"DEBUG: Saved all processing stages with prefix {debug_prefix}")
-            self.logger.info(f"Final processed image size: {processed.shape}")
-            self.logger.info(f"Final processed image type: {processed.dtype}")
-            self.logger.info(f"Final processed image min/max values: {processed.min()}/{processed.max()}")
-            
-            self.logger.debug("Image preprocessing completed")
-            return processed
-            
-        except Exception as e:
-            self.logger.error(f"Error preprocessing image: {e}")
-            raise
-    
-    def _extract_text_with_confidence(self, image: np.ndarray) -> tuple[str, float]:
+        cv2.imwrite(f"{run.debug_prefix}_04_enhanced.png", enhanced)
+        return enhanced
+
+    def _stage_threshold(self, run: StageRun, enhanced: np.ndarray) -> np.ndarray:
+        """Otsu + adaptativo combinados (conservan trazos finos) y morfología suave"""
+        debug_prefix = run.debug_prefix
+        shape = enhanced.shape
+        binary = run.buffers.get('binary', shape)
+        work = run.buffers.get('work', shape)
+        cv2.threshold(enhanced, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=binary)
+        cv2.imwrite(f"{debug_prefix}_05_threshold_otsu.png", binary)
+        cv2.adaptiveThreshold(
+            enhanced,
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY,
+            15,
+            8,
+            dst=work,
+        )
+        cv2.imwrite(f"{debug_prefix}_05_threshold_adaptive.png", work)
+        cv2.bitwise_or(binary, work, dst=binary)
+        cv2.imwrite(f"{debug_prefix}_05_threshold_combined.png", binary)
+
+        # Morfología: dilatación suave + cierre para engrosar texto y unir cortes
+        cv2.dilate(binary, self.morph_kernel, dst=work, iterations=1)
+        cv2.morphologyEx(work, cv2.MORPH_CLOSE, self.morph_kernel, dst=binary, iterations=1)
+        processed = binary
+
+        # Guardar imagen final procesada
+        cv2.imwrite(f"{debug_prefix}_06_final.png", processed)
+        self.logger.info(f"DEBUG: Saved all processing stages with prefix {debug_prefix}")
+        self.logger.info(f"Final processed image size: {processed.shape}")
+        self.logger.info(f"Final processed image min/max values: {processed.min()}/{processed.max()}")
+        return processed
+
+    def _extract_text_with_confidence(self, run: StageRun, deadline: Optional[Deadline] = None,
+                                      mode: str = 'balanced') -> tuple[str, float]:
         """
         Extrae texto de la imagen con información de confianza
         Intenta múltiples configuraciones si la primera falla
+
+        Todas las pasadas reconocen la misma etapa 'threshold' de la ejecución; una
+        config repetida reutiliza el resultado ya calculado.
         
         Args:
-            image: Imagen procesada
+            run: Ejecución del grafo de etapas de la petición
+            deadline: Límite de la petición; no se empieza una pasada que no quepa
+            mode: Modo de calidad; las pasadas de diagnóstico solo en 'thorough'
             
         Returns:
             Tuple con (texto_extraído, confianza_promedio)
         """
+        deadline = deadline or Deadline()
+
+        def _fits(stage: str) -> bool:
+            return deadline.allows(self.stage_costs.estimate(stage))
+
         try:
             # Primer intento con configuración estándar
-            text = pytesseract.image_to_string(image, lang='spa+eng', config=self.tesseract_config)
-            data = pytesseract.image_to_data(image, lang='spa+eng', config=self.tesseract_config, output_type=pytesseract.Output.DICT)
-            
-            # Calcular confianza promedio (solo palabras con conf > 0)
-            confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+            with self.stage_costs.measure('pp_pass'):
+                text, avg_confidence = run.recognize('threshold', 'spa+eng', self.tesseract_config)
             
             self.logger.info(f"First attempt: {len(text.split())} words with avg confidence: {avg_confidence:.2f}")
             
             # Si la confianza es muy baja o no hay texto, intentar configuración más agresiva
-            if avg_confidence < 30 or len(text.strip()) < 10:
+            good_parse = self.score_ocr_text(text) >= self.early_exit_score
+            if not good_parse and (avg_confidence < 30 or len(text.strip()) < 10) and _fits('pp_pass'):
                 self.logger.info("Low confidence or short text, trying aggressive config")
                 
-                text2 = pytesseract.image_to_string(image, lang='spa+eng', config=self.tesseract_config_aggressive)
-                data2 = pytesseract.image_to_data(image, lang='spa+eng', config=self.tesseract_config_aggressive, output_type=pytesseract.Output.DICT)
-                
-                confidences2 = [int(conf) for conf in data2['conf'] if int(conf) > 0]
-                avg_confidence2 = sum(confidences2) / len(confidences2) if confidences2 else 0.0
+                with self.stage_costs.measure('pp_pass'):
+                    text2, avg_confidence2 = run.recognize('threshold', 'spa+eng', self.tesseract_config_aggressive)
                 
                 self.logger.info(f"Second attempt: {len(text2.split())} words with avg confidence: {avg_confidence2:.2f}")
                 
@@ -354,7 +1686,7 @@ class OCRService:
                 ('psm_13', '--psm 13'),  # Raw line, no hay formato
                 (
                     'whitelist_codes',
-                    "--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_\.M"
+                    self._with_client_words("--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_\.M")
                 ),
             ]
             
@@ -364,14 +1696,19 @@ class OCRService:
             for config_name, config in configs_to_try:
                 if best_confidence > 30 and len(best_text.strip()) > 10:
                     break  # Ya tenemos un buen resultado
+                if self.score_ocr_text(best_text) >= self.early_exit_score:
+                    break  # El texto ya produce líneas de trabajo válidas
+                if not _fits('pp_pass'):
+                    break  # No cabe otra pasada en el deadline
+                if config_name == 'psm_12' and self.deskew_enabled:
+                    continue  # OSD innecesario: el preprocesado ya enderezó la imagen
+                if run.recognized('threshold', 'spa+eng', config):
+                    continue  # Misma config que una pasada anterior: su resultado ya se comparó
                 
                 try:
                     self.logger.info(f"Trying {config_name}: {config}")
-                    text_attempt = pytesseract.image_to_string(image, lang='spa+eng', config=config)
-                    data_attempt = pytesseract.image_to_data(image, lang='spa+eng', config=config, output_type=pytesseract.Output.DICT)
-                    
-                    conf_attempt = [int(conf) for conf in data_attempt['conf'] if int(conf) > 0]
-                    avg_conf_attempt = sum(conf_attempt) / len(conf_attempt) if conf_attempt else 0.0
+                    with self.stage_costs.measure('pp_pass'):
+                        text_attempt, avg_conf_attempt = run.recognize('threshold', 'spa+eng', config)
                     
                     self.logger.info(f"{config_name}: {len(text_attempt.split())} words, conf: {avg_conf_attempt:.2f}")
                     self.logger.info(f"{config_name} text preview: '{text_attempt[:100]}'")
@@ -397,22 +1734,26 @@ class OCRService:
             self.logger.info(f"Text has only whitespace: {text.isspace()}")
             self.logger.info(f"Text stripped length: {len(text.strip())}")
             
-            # Intentar detectar si hay ALGO en la imagen
-            try:
-                # Tesseract modo más básico posible
-                basic_text = pytesseract.image_to_string(image, lang='spa+eng', config='--psm 8')
-                self.logger.info(f"BASIC PSM 8 result: '{basic_text[:100]}'")
+            # Intentar detectar si hay ALGO en la imagen (pasadas solo de diagnóstico:
+            # modo thorough y si sobra tiempo; no cambian el resultado)
+            if mode == 'thorough' and deadline.remaining_ms() >= self.stage_costs.estimate('debug'):
+                image = run.get('threshold')
+                with self.stage_costs.measure('debug'):
+                    try:
+                        # Tesseract modo más básico posible
+                        basic_text = self._ocr_string(image, lang='spa+eng', config='--psm 8')
+                        self.logger.info(f"BASIC PSM 8 result: '{basic_text[:100]}'")
                 
-                # Tesseract sin configuración
-                no_config_text = pytesseract.image_to_string(image, lang='spa+eng')
-                self.logger.info(f"NO CONFIG result: '{no_config_text[:100]}'")
+                        # Tesseract sin configuración
+                        no_config_text = self._ocr_string(image, lang='spa+eng')
+                        self.logger.info(f"NO CONFIG result: '{no_config_text[:100]}'")
                 
-                # Solo números
-                numbers_only = pytesseract.image_to_string(image, lang='spa+eng', config='--psm 8 -c tessedit_char_whitelist=0123456789')
-                self.logger.info(f"NUMBERS ONLY result: '{numbers_only[:100]}'")
+                        # Solo números
+                        numbers_only = self._ocr_string(image, lang='spa+eng', config='--psm 8 -c tessedit_char_whitelist=0123456789')
+                        self.logger.info(f"NUMBERS ONLY result: '{numbers_only[:100]}'")
                 
-            except Exception as e:
-                self.logger.error(f"Error in extreme debug OCR: {e}")
+                    except Exception as e:
+                        self.logger.error(f"Error in extreme debug OCR: {e}")
             
             self.logger.info("=== FIN OCR DEBUG EXTREMO ===")
             
@@ -521,29 +1862,125 @@ class OCRService:
         
         return job
     
-    def process_batch(self, image_paths: List[str]) -> List[JobDetails]:
+    def process_batch(self, image_paths: List[str], batched: bool = True) -> List[JobDetails]:
         """
         Procesa múltiples imágenes en lote
-        
+
+        Con batched=True las pasadas baratas se agrupan en una sola invocación de
+        Tesseract por bloque de batch_size imágenes (_recognize_many): primero la
+        de códigos de trabajo y, para las que no alcanzan early_exit_score, la
+        simple spa+eng. Solo las que siguen sin resultado bueno pasan al pipeline
+        de preprocesado, una a una, con esos candidatos ya calculados.
+
         Args:
             image_paths: Lista de rutas a las imágenes
-            
+            batched: False para procesar cada imagen por separado (extract_job_details)
+
         Returns:
             Lista de JobDetails objects
         """
-        results = []
-        
-        for path in image_paths:
+        if not batched:
+            return [self._process_one(path) for path in image_paths]
+
+        results: List[Optional[JobDetails]] = [None] * len(image_paths)
+        for start in range(0, len(image_paths), max(1, self.batch_size)):
+            chunk = list(range(start, min(start + self.batch_size, len(image_paths))))
+            with self.thread_budget.slot(), ExitStack() as borrowed:
+                self._process_chunk(image_paths, chunk, results, borrowed)
+        return results
+
+    def _process_one(self, path: str) -> JobDetails:
+        try:
+            return self.extract_job_details(path)
+        except Exception as e:
+            self.logger.error(f"Error processing {path}: {e}")
+            error_job = JobDetails()
+            error_job.detected_text = f"Error: {str(e)}"
+            error_job.status = 'error'
+            return error_job
+
+    def _process_chunk(self, image_paths: List[str], chunk: List[int], results: List[Optional[JobDetails]],
+                       borrowed: ExitStack):
+        """
+        Un bloque de process_batch: pasadas baratas agrupadas y pipeline completo para el resto
+
+        borrowed: recibe los buffers prestados a cada imagen; se devuelven al cerrar el bloque
+        """
+        # índice -> candidatos (texto, confianza, modo, score) y ejecución del grafo de etapas
+        candidates: Dict[int, List[tuple]] = {}
+        runs: Dict[int, StageRun] = {}
+        fast_inputs, simple_inputs = [], []
+        for i in chunk:
+            path = image_paths[i]
             try:
-                job_details = self.extract_job_details(path)
-                results.append(job_details)
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"Image file not found: {path}")
+                # Buffers propios: las ejecuciones del bloque conviven en el mismo hilo
+                run = self._stage_run(path, buffers=borrowed.enter_context(self.buffer_pool.borrow()))
+                gray = run.get('gray')
             except Exception as e:
                 self.logger.error(f"Error processing {path}: {e}")
-                error_job = JobDetails()
-                error_job.detected_text = f"Error: {str(e)}"
-                results.append(error_job)
-        
-        return results
+                results[i] = JobDetails()
+                results[i].detected_text = f"Error: {str(e)}"
+                results[i].status = 'error'
+                continue
+            if self._split_tall_image(gray):
+                # Capturas muy altas: van por franjas, mejor con el pipeline normal
+                results[i] = self._process_one(path)
+                continue
+
+            candidates[i] = []
+            runs[i] = run
+            invert, certainty = run.get('polarity')
+            direct, inverted = (gray, 'simple_direct'), (run.get('inverted'), 'simple_inverted')
+            oriented = inverted if invert else direct
+
+            fast_image = run.get('oriented')
+            match = run.get('layout')
+            if match:
+                region = LayoutRegistry.crop(gray, match[0])
+                region_invert, _ = self._detect_polarity(region)
+                fast_image = cv2.bitwise_not(region) if region_invert else region
+            fast_inputs.append((i, fast_image, f"layout:{match[0]['name']}" if match else 'job_code'))
+
+            simple_inputs.append((i, ) + oriented)
+            if certainty < self.polarity_min_certainty:
+                simple_inputs.append((i, ) + (direct if invert else inverted))
+
+        def _run(inputs: List[tuple], lang: str, config: str):
+            pending = [item for item in inputs if results[item[0]] is None]
+            if not pending:
+                return
+            recognized = self._recognize_many([item[1] for item in pending], lang, config)
+            for (i, _, mode), (text, conf) in zip(pending, recognized):
+                if results[i] is not None:
+                    continue
+                score = self.score_ocr_text(text)
+                candidates[i].append((text, conf, mode, score))
+                if score >= self.early_exit_score:
+                    self.logger.info(f"Batch OCR ({mode}) for {image_paths[i]}: score={score:.2f} conf={conf:.2f}")
+                    results[i] = self._build_job_details(text, conf)
+
+        try:
+            if self.job_code_fast_path:
+                _run(fast_inputs, self.job_code_lang, self._with_client_words(self.tesseract_config_job_code))
+            _run(simple_inputs, 'spa+eng', '--psm 6')
+        except Exception as e:
+            # Sin la pasada agrupada cada imagen hace su pipeline completo
+            self.logger.error(f"Batched OCR failed: {e}")
+            for i in candidates:
+                if results[i] is None:
+                    candidates[i] = None
+        del fast_inputs, simple_inputs
+
+        for i, prior in candidates.items():
+            run = runs.pop(i)
+            if results[i] is None:
+                deadline = Deadline(hard_limit_s=self.ocr_request_timeout)
+                with self._limited(deadline):
+                    job_details = self._extract_job_details(image_paths[i], mode=self.quality_mode, deadline=deadline,
+                                                            prior_candidates=prior, run=run)
+                results[i] = self._apply_status(job_details, deadline)
 
     # ===================== NUEVO: Parser de múltiples líneas tipo Tddmmaa-NOMBRE-qtyM =====================
     def parse_jobs_from_text(self, text: str) -> List[Dict]:
@@ -551,7 +1988,8 @@ class OCRService:
         Tddmmaa-NOMBRE_APELLIDO-x.yM [ruido]
 
         Devuelve una lista de dicts con: job_type, job_code, job_date (ISO), client_name,
-        quantity_m (float), unit, raw_line.
+        quantity_m (float), unit, raw_line. El cliente se resuelve aparte, sobre la lista
+        final de trabajos (resolve_clients).
         """
         if not text:
             return []
@@ -669,4 +2107,28 @@ class OCRService:
                 'raw_line': line_stripped,
             })
 
-        return results
\ No newline at end of file
+        return results
+
+    def resolve_clients(self, jobs: List[Dict]) -> List[Dict]:
+        """
+        Resuelve el cliente de cada trabajo contra la lista de clientes (OCR_CLIENT_LIST)
+
+        Se llama una vez sobre la lista final de trabajos, no al puntuar candidatos.
+        Sin lista configurada devuelve los trabajos tal cual.
+
+        Returns:
+            Copias de los trabajos con client_id, matched_name y match_score
+            (None/0.0 si ningún cliente supera el umbral)
+        """
+        if self.client_index is None:
+            return jobs
+        resolved = []
+        for job in jobs:
+            match = self.client_index.resolve(job.get('client_name') or '')
+            resolved.append(dict(
+                job,
+                client_id=match[0] if match else None,
+                matched_name=match[1] if match else None,
+                match_score=match[2] if match else 0.0,
+            ))
+        return resolved
\ No newline at end of file
@@ -0,0 +1,348 @@
+"""
+Índice de hashes perceptuales (pHash) de las capturas ya procesadas.
+
+WhatsApp recomprime las imágenes reenviadas, así que la misma captura llega
+con otros bytes; el pHash sobrevive a la recompresión y al reescalado. Las
+búsquedas por distancia de Hamming se resuelven con un BK-tree.
+
+Un hash global (ni una miniatura) no distingue dos colas del RIP que solo
+difieren en un dígito de una cantidad ("20M" frente a "28M"), así que cada
+registro guarda además la captura en gris a resolución de texto y el candidato
+se compara con ella por bloques de 8x8 antes de reutilizarlo: la recompresión
+cambia poco cada bloque y un carácter distinto cambia mucho el suyo. Los
+registros también llevan el modo de calidad con el que se hizo el OCR.
+
+La imagen se decodifica una sola vez con el cargador que se le dé (el del
+servicio OCR aplica el presupuesto de píxeles). El índice guarda como mucho
+max_entries registros de menos de max_age_days días: al superarlo se
+reescribe el JSONL y se borran las referencias que ya nadie usa.
+"""
+import base64
+import json
+import logging
+import hashlib
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# 16x16 coeficientes DCT = 256 bits
+HASH_SIZE = 16
+THUMB_SIZE = 64
+# Lado mayor (px) de la captura de referencia guardada para verificar a resolución de texto
+REFERENCE_MAX_SIDE = 2048
+# Lado de los bloques que se comparan y escala mínima de la consulta respecto a la referencia
+BLOCK_SIZE = 8
+MIN_SCALE = 0.5
+
+
+def hamming(a: int, b: int) -> int:
+    """Distancia de Hamming entre dos hashes"""
+    return bin(a ^ b).count('1')
+
+
+def phash(gray: np.ndarray, hash_size: int = HASH_SIZE) -> int:
+    """pHash: coeficientes DCT de baja frecuencia comparados con su mediana"""
+    small = cv2.resize(gray, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA)
+    coefficients = cv2.dct(small.astype(np.float32))[:hash_size, :hash_size].flatten()
+    bits = coefficients > np.median(coefficients[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def thumbnail(gray: np.ndarray) -> np.ndarray:
+    """Miniatura suavizada para verificar candidatos (tolera recompresión JPEG)"""
+    small = cv2.resize(gray, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(small, (3, 3), 0)
+
+
+def read_gray(image_path: str) -> np.ndarray:
+    """Cargador por defecto: decodificación directa en gris"""
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"Could not load image: {image_path}")
+    return gray
+
+
+def block_difference(reference: np.ndarray, query: np.ndarray, block: int = BLOCK_SIZE) -> Optional[float]:
+    """
+    Mayor diferencia media de un bloque entre dos capturas, a la menor de sus dos resoluciones
+
+    Returns:
+        Diferencia (0-255), o None si la consulta es demasiado pequeña para comparar texto
+    """
+    height = min(reference.shape[0], query.shape[0])
+    width = min(reference.shape[1], query.shape[1])
+    if height < MIN_SCALE * reference.shape[0] or width < MIN_SCALE * reference.shape[1]:
+        return None
+    images = []
+    for image in (reference, query):
+        if image.shape[:2] != (height, width):
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        images.append(cv2.GaussianBlur(image, (3, 3), 0))
+    diff = cv2.absdiff(images[0], images[1])
+    blocks = cv2.resize(diff, (max(1, width // block), max(1, height // block)), interpolation=cv2.INTER_AREA)
+    return float(blocks.max())
+
+
+class ImageSignature:
+    """Hash perceptual, proporción ancho/alto y miniatura de verificación de una imagen"""
+
+    def __init__(self, image_hash: int, aspect: float, thumb: np.ndarray, gray: Optional[np.ndarray] = None):
+        self.hash = image_hash
+        self.aspect = aspect
+        self.thumb = thumb
+        # Imagen decodificada (para la referencia y para no volver a decodificarla en el OCR)
+        self.gray = gray
+        self._reference: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_gray(cls, gray: np.ndarray) -> 'ImageSignature':
+        height, width = gray.shape[:2]
+        return cls(phash(gray), width / height, thumbnail(gray), gray)
+
+    def reference(self) -> np.ndarray:
+        """
+        Captura en gris a resolución de texto (lado mayor de REFERENCE_MAX_SIDE como mucho)
+
+        Raises:
+            ValueError: Si la firma no tiene imagen
+        """
+        if self._reference is None:
+            if self.gray is None:
+                raise ValueError("Signature has no image")
+            gray = self.gray
+            scale = REFERENCE_MAX_SIDE / max(gray.shape[:2])
+            if scale < 1:
+                gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            self._reference = gray
+        return self._reference
+
+
+class BKTree:
+    """BK-tree sobre distancia de Hamming (valores: ids de registro)"""
+
+    def __init__(self):
+        self._root: Optional[list] = None  # [hash, [ids], {distancia: nodo}]
+        self.size = 0
+
+    def add(self, value: int, item_id: int):
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item_id], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item_id], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """Lista de (distancia, id) con distancia <= max_distance, de menor a mayor"""
+        if self._root is None:
+            return []
+        found = []
+        pending = [self._root]
+        while pending:
+            node = pending.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item_id) for item_id in node[1])
+            lo, hi = distance - max_distance, distance + max_distance
+            pending.extend(child for d, child in node[2].items() if lo <= d <= hi)
+        return sorted(found)
+
+
+class PerceptualHashIndex:
+    """Resultados OCR indexados por pHash, persistidos en un archivo JSONL"""
+
+    def __init__(self, path: str, threshold: int = 20, max_pixel_diff: int = 30, max_block_diff: float = 8.0,
+                 loader: Optional[Callable[[str], np.ndarray]] = None, max_entries: int = 5000,
+                 max_age_days: float = 30, logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            path: Archivo JSONL donde se guardan los registros
+            threshold: Distancia de Hamming máxima (de 256 bits) para considerar dos capturas iguales
+            max_pixel_diff: Diferencia máxima por píxel entre miniaturas para preseleccionar el candidato
+            max_block_diff: Diferencia media máxima de un bloque de 8x8 a resolución de texto
+                para confirmarlo (la recompresión de WhatsApp queda por debajo de ~5; un dígito
+                cambiado, por encima de ~10)
+            loader: Decodifica una ruta a gris (p. ej. OCRService.load_gray, con presupuesto
+                de píxeles); por defecto read_gray
+            max_entries: Máximo de registros; al superarlo se descartan los más antiguos
+            max_age_days: Antigüedad máxima de un registro para reutilizarlo (0 = sin límite)
+            logger: Logger, crea uno si no se da
+        """
+        self.path = path
+        self.reference_dir = os.path.join(os.path.dirname(path) or '.', 'phash_refs')
+        self.threshold = threshold
+        self.max_pixel_diff = max_pixel_diff
+        self.max_block_diff = max_block_diff
+        self.loader = loader or read_gray
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.logger = logger or logging.getLogger(__name__)
+        self._records: List[Dict] = []
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        # Líneas del archivo (incluye registros descartados o ilegibles)
+        self._file_records = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                self._file_records += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._insert(record)
+        self.logger.info(f"Perceptual hash index loaded: {len(self._records)} records")
+        with self._lock:
+            self._prune()
+
+    def _insert(self, record: Dict):
+        self._records.append(record)
+        self._tree.add(int(record['hash'], 16), len(self._records) - 1)
+
+    def _expired(self, record: Dict, cutoff: Optional[datetime]) -> bool:
+        if cutoff is None:
+            return False
+        try:
+            return datetime.fromisoformat(record.get('indexed_at', '')) < cutoff
+        except ValueError:
+            return True
+
+    def _cutoff(self) -> Optional[datetime]:
+        return datetime.now() - timedelta(days=self.max_age_days) if self.max_age_days > 0 else None
+
+    def _prune(self):
+        """
+        Aplica max_entries/max_age_days: reescribe el JSONL con los registros vigentes,
+        reconstruye el BK-tree y borra las referencias huérfanas (llamar con el lock tomado)
+        """
+        cutoff = self._cutoff()
+        kept = [record for record in self._records if not self._expired(record, cutoff)]
+        kept = kept[-self.max_entries:] if self.max_entries > 0 else kept
+        if len(kept) == len(self._records) == self._file_records:
+            return
+
+        dropped = len(self._records) - len(kept)
+        self._records, self._tree = [], BKTree()
+        for record in kept:
+            self._insert(record)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in self._records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(temp_path, self.path)
+        self._file_records = len(self._records)
+
+        referenced = {record.get('reference') for record in self._records}
+        removed = 0
+        if os.path.isdir(self.reference_dir):
+            for name in os.listdir(self.reference_dir):
+                if name not in referenced:
+                    try:
+                        os.remove(os.path.join(self.reference_dir, name))
+                        removed += 1
+                    except OSError:
+                        pass
+        self.logger.info(f"Perceptual hash index compacted: {dropped} records and {removed} references dropped, "
+                         f"{len(self._records)} kept")
+
+    def compute(self, image_path: str) -> ImageSignature:
+        """Firma perceptual (hash, proporción y miniatura) de una imagen, decodificada con loader"""
+        return ImageSignature.from_gray(self.loader(image_path))
+
+    def lookup(self, signature: ImageSignature, mode: Optional[str] = None) -> Optional[Tuple[Dict, int]]:
+        """
+        Busca una captura con el mismo texto procesada con el mismo modo de calidad
+
+        Los candidatos por pHash y miniatura se confirman contra la captura de
+        referencia del registro; los registros sin referencia no se reutilizan.
+
+        Args:
+            signature: Firma de la captura nueva
+            mode: Modo de calidad de la petición; solo se reutilizan registros del mismo modo
+
+        Returns:
+            Tuple (registro, distancia) del más cercano dentro del umbral, o None
+        """
+        if self.threshold < 0:
+            return None
+        cutoff = self._cutoff()
+        with self._lock:
+            candidates = []
+            for distance, item_id in self._tree.search(signature.hash, self.threshold):
+                record = self._records[item_id]
+                if record.get('mode') != mode or not record.get('reference') or self._expired(record, cutoff):
+                    continue
+                # Mismo contenido reescalado conserva la proporción
+                if abs(record['aspect'] - signature.aspect) > 0.02 * signature.aspect:
+                    continue
+                stored = np.frombuffer(base64.b64decode(record['thumb']), dtype=np.uint8)
+                diff = np.abs(stored.astype(np.int16) - signature.thumb.reshape(-1).astype(np.int16)).max()
+                if diff <= self.max_pixel_diff:
+                    candidates.append((distance, record))
+
+        # Verificación a resolución de texto (fuera del lock: decodifica imágenes)
+        for distance, record in candidates:
+            reference = cv2.imread(os.path.join(self.reference_dir, record['reference']), cv2.IMREAD_GRAYSCALE)
+            if reference is None:
+                continue
+            difference = block_difference(reference, signature.reference())
+            if difference is not None and difference <= self.max_block_diff:
+                return record, distance
+            self.logger.info(f"Perceptual hash candidate {record.get('filename')} rejected "
+                             f"at text resolution (block diff={difference})")
+        return None
+
+    def add(self, signature: ImageSignature, record: Dict, mode: Optional[str] = None) -> Dict:
+        """
+        Guarda el resultado OCR de una captura, con su captura de referencia
+
+        Args:
+            signature: Firma de la captura (con su imagen, para guardar la referencia)
+            record: Resultado a guardar (filename, ocr_results, jobs)
+            mode: Modo de calidad con el que se hizo el OCR
+        """
+        reference = signature.reference()
+        reference_name = f"{hashlib.sha256(reference.tobytes()).hexdigest()[:32]}.png"
+        reference_path = os.path.join(self.reference_dir, reference_name)
+
+        record = dict(record)
+        record['hash'] = format(signature.hash, 'x')
+        record['aspect'] = signature.aspect
+        record['thumb'] = base64.b64encode(signature.thumb.tobytes()).decode('ascii')
+        record['reference'] = reference_name
+        record['mode'] = mode
+        record.setdefault('indexed_at', datetime.now().isoformat())
+        with self._lock:
+            # Bajo el lock: la compactación no puede borrar una referencia aún sin registro
+            os.makedirs(self.reference_dir, exist_ok=True)
+            if not os.path.exists(reference_path):
+                cv2.imwrite(reference_path, reference)
+            self._insert(record)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file_records += 1
+            # Margen del 10% para no reescribir el archivo en cada alta
+            if self.max_entries > 0 and len(self._records) > self.max_entries + max(1, self.max_entries // 10):
+                self._prune()
+        return record
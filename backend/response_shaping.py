@@ -0,0 +1,140 @@
+"""
+Forma de las respuestas JSON de los endpoints OCR.
+
+Los clientes pueden pedir solo algunos campos (?fields=jobs,job_id) o quitar
+otros (?exclude=ocr_results.detected_text); esas respuestas se serializan con
+orjson si está instalado. El cuerpo se comprime (br si está el paquete brotli,
+si no gzip) cuando el cliente lo acepta y la respuesta es grande.
+
+Sin parámetros la respuesta tiene los mismos bytes que con jsonify: orjson no
+escapa lo que no es ASCII ni escribe igual algunos floats, y hacerlo idéntico
+cuesta más de lo que ahorra con respuestas de pocos KB.
+"""
+import gzip
+from typing import Any, Dict, Iterable, List, Optional
+
+from flask import Response, current_app, request
+
+try:
+    import orjson
+except ImportError:  # opcional
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # opcional
+    brotli = None
+
+# Por debajo de esto la compresión no compensa
+MIN_COMPRESS_BYTES = 1024
+
+
+def _parse_paths(value: Optional[str]) -> List[List[str]]:
+    """'jobs,ocr_results.detected_text' -> [['jobs'], ['ocr_results', 'detected_text']]"""
+    if not value:
+        return []
+    return [part.strip().split('.') for part in value.split(',') if part.strip()]
+
+
+def _select(data: Any, paths: List[List[str]]) -> Any:
+    if not isinstance(data, dict) or any(not path for path in paths):
+        return data
+    selected = {}
+    for key in dict.fromkeys(path[0] for path in paths):
+        if key not in data:
+            continue
+        sub_paths = [path[1:] for path in paths if path[0] == key]
+        # 'ocr_results' completo si se pidió sin subcampos
+        selected[key] = data[key] if any(not p for p in sub_paths) else _select(data[key], sub_paths)
+    return selected
+
+
+def _drop(data: Any, path: List[str]) -> Any:
+    if not isinstance(data, dict) or not path or path[0] not in data:
+        return data
+    result = dict(data)
+    if len(path) == 1:
+        del result[path[0]]
+    else:
+        result[path[0]] = _drop(result[path[0]], path[1:])
+    return result
+
+
+def shape_fields(data: Dict, fields: Optional[str] = None, exclude: Optional[str] = None) -> Dict:
+    """
+    Aplica selección/exclusión de campos (rutas con punto para campos anidados)
+
+    Args:
+        data: Respuesta completa
+        fields: Campos a conservar, separados por comas
+        exclude: Campos a quitar, separados por comas
+
+    Returns:
+        Respuesta reducida (el dict original no se modifica)
+    """
+    paths = _parse_paths(fields)
+    if paths:
+        data = _select(data, paths)
+    for path in _parse_paths(exclude):
+        data = _drop(data, path)
+    return data
+
+
+def dumps(data: Any, fast: bool = False) -> bytes:
+    """
+    Serializa a JSON
+
+    Por defecto con el proveedor JSON de Flask: los mismos bytes que jsonify. Con
+    fast=True y orjson instalado se usa orjson (claves ordenadas, UTF-8 sin
+    escapar y sin salto de línea final).
+    """
+    if fast and orjson is not None:
+        try:
+            return orjson.dumps(
+                data, default=current_app.json.default,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except orjson.JSONEncodeError:
+            pass  # enteros de más de 64 bits, etc.
+    return current_app.json.response(data).get_data()
+
+
+def _accepted_encodings(header: str) -> Iterable[str]:
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        yield name.strip().lower()
+
+
+def compressed_response(body: bytes, mimetype: str, status: int = 200) -> Response:
+    """
+    Response con el cuerpo comprimido si el cliente lo acepta y es grande
+
+    Args:
+        body: Cuerpo ya serializado
+        mimetype: Tipo MIME de la respuesta
+        status: Código HTTP
+    """
+    encoding = None
+    if len(body) >= MIN_COMPRESS_BYTES:
+        accepted = set(_accepted_encodings(request.headers.get('Accept-Encoding', '')))
+        if brotli is not None and 'br' in accepted:
+            body, encoding = brotli.compress(body, quality=5), 'br'
+        elif 'gzip' in accepted:
+            body, encoding = gzip.compress(body, compresslevel=6), 'gzip'
+
+    response = Response(body, status=status, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def api_response(data: Dict, status: int = 200) -> Response:
+    """Respuesta JSON con ?fields= / ?exclude= de la petición y compresión"""
+    fields, exclude = request.args.get('fields'), request.args.get('exclude')
+    shaped = bool(fields or exclude)
+    if shaped:
+        data = shape_fields(data, fields, exclude)
+    return compressed_response(dumps(data, fast=shaped), 'application/json', status)
@@ -0,0 +1,181 @@
+"""
+Evaluación en sombra de configuraciones alternativas del OCR.
+
+Una fracción de las subidas a /api/upload-preview se vuelve a procesar, después
+de enviar la respuesta, con otra configuración de OCRService en un worker de
+baja prioridad. Se guarda la latencia de ambas y si coinciden los trabajos
+parseados, para comparar antes de cambiar el pipeline de producción.
+
+La configuración alternativa se da como JSON de atributos de OCRService, p. ej.:
+    OCR_SHADOW_CONFIG='{"quality_mode": "thorough", "polarity_min_certainty": 0.5}'
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from common import percentile
+from ocr_service import OCRService
+
+
+def build_shadow_service(overrides: Dict, logger: logging.Logger, thread_budget=None,
+                         cache_dir: Optional[str] = None) -> OCRService:
+    """
+    OCRService con atributos sobrescritos
+
+    Args:
+        overrides: Atributos de OCRService a sobrescribir
+        logger: Logger del servicio
+        thread_budget: Presupuesto de hilos compartido con el servicio principal
+        cache_dir: Directorio propio de cachés: lo que reconozca la configuración
+            alternativa (caché por líneas, etc.) no debe servir peticiones reales
+
+    Raises:
+        ValueError: Si algún atributo no existe en OCRService
+    """
+    service = OCRService(logger, thread_budget=thread_budget, cache_dir=cache_dir)
+    # Sin nice: la latencia se compara con la del servicio principal, que no lo usa
+    service.background_nice = 0
+    for name, value in overrides.items():
+        if name.startswith('_') or not hasattr(service, name):
+            raise ValueError(f"Unknown OCRService setting: {name}")
+        setattr(service, name, value)
+    return service
+
+
+def _job_keys(jobs: List[Dict]) -> set:
+    """Identidad de cada trabajo parseado: código-cliente-cantidad"""
+    return {
+        f"{job.get('job_code', '')}-{(job.get('client_name') or '').upper()}-{job.get('quantity_m')}"
+        for job in jobs
+    }
+
+
+class ShadowRunner:
+    """Reprocesa una muestra de peticiones con otra configuración y guarda la comparación"""
+
+    def __init__(self, service: OCRService, store_path: str, sample_rate: float,
+                 config: Optional[Dict] = None, max_pending: int = 20,
+                 logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            service: OCRService con la configuración alternativa
+            store_path: Archivo JSONL donde se guardan las comparaciones
+            sample_rate: Fracción de peticiones a evaluar (0-1)
+            config: Atributos sobrescritos (solo informativo, va en el reporte)
+            max_pending: Máximo de evaluaciones pendientes; el resto se descarta
+            logger: Logger, crea uno si no se da
+        """
+        self.service = service
+        self.store_path = store_path
+        self.sample_rate = sample_rate
+        self.config = config or {}
+        self.max_pending = max_pending
+        self.logger = logger or logging.getLogger(__name__)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ocr-shadow')
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def submit(self, filepath: str, job_id: str, primary_latency_ms: float, primary_jobs: List[Dict]) -> bool:
+        """
+        Encola la evaluación en sombra de una captura ya respondida
+
+        Returns:
+            False si se descartó por tener demasiadas pendientes
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending += 1
+        self._pool.submit(self._run, filepath, job_id, primary_latency_ms, primary_jobs)
+        return True
+
+    def _run(self, filepath: str, job_id: str, primary_latency_ms: float, primary_jobs: List[Dict]):
+        try:
+            # Baja prioridad: no empezar mientras haya OCR interactivo en curso
+            self.service.thread_budget.wait_idle()
+
+            # Mismas condiciones que una petición sola (todos los hilos, sin nice) mientras no
+            # haya OCR interactivo; lo que espera cediéndole el paso no cuenta como latencia
+            yielded = self.service.yielded_s()
+            start = time.perf_counter()
+            with self.service.thread_budget.slot(background=True, full_share=True):
+                details = self.service.extract_job_details(filepath)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            shadow_wait_ms = (self.service.yielded_s() - yielded) * 1000
+            shadow_latency_ms = max(0.0, elapsed_ms - shadow_wait_ms)
+            shadow_jobs = self.service.parse_jobs_from_text(details.detected_text or '')
+
+            primary_keys, shadow_keys = _job_keys(primary_jobs), _job_keys(shadow_jobs)
+            union = primary_keys | shadow_keys
+            record = {
+                'job_id': job_id,
+                'filename': os.path.basename(filepath),
+                'evaluated_at': datetime.now().isoformat(),
+                'primary_latency_ms': round(primary_latency_ms, 1),
+                'shadow_latency_ms': round(shadow_latency_ms, 1),
+                'shadow_wait_ms': round(shadow_wait_ms, 1),
+                'primary_jobs': len(primary_jobs),
+                'shadow_jobs': len(shadow_jobs),
+                'exact_match': primary_keys == shadow_keys,
+                'jaccard': round(len(primary_keys & shadow_keys) / len(union), 3) if union else 1.0,
+                'only_primary': sorted(primary_keys - shadow_keys)[:10],
+                'only_shadow': sorted(shadow_keys - primary_keys)[:10],
+                'shadow_error': details.detected_text if (details.detected_text or '').startswith('Error') else None,
+            }
+            with self._lock:
+                os.makedirs(os.path.dirname(self.store_path) or '.', exist_ok=True)
+                with open(self.store_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as e:
+            self.logger.error(f"Shadow evaluation failed for {filepath}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def report(self) -> Dict:
+        """Resumen de las comparaciones guardadas"""
+        records = []
+        if os.path.exists(self.store_path):
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+
+        primary = [r['primary_latency_ms'] for r in records]
+        shadow = [r['shadow_latency_ms'] for r in records]
+        waits = [r.get('shadow_wait_ms', 0.0) for r in records]
+        count = len(records)
+        return {
+            'enabled': True,
+            'sample_rate': self.sample_rate,
+            'config': self.config,
+            'evaluated': count,
+            'pending': self._pending,
+            'dropped': self.dropped,
+            'exact_match_rate': round(sum(r['exact_match'] for r in records) / count, 3) if count else None,
+            'mean_jaccard': round(sum(r['jaccard'] for r in records) / count, 3) if count else None,
+            'shadow_errors': sum(1 for r in records if r.get('shadow_error')),
+            'latency_ms': {
+                'primary': {'p50': percentile(primary, 50), 'p95': percentile(primary, 95)},
+                'shadow': {'p50': percentile(shadow, 50), 'p95': percentile(shadow, 95)},
+            },
+            # Espera de la sombra cediendo el paso (no incluida en su latencia)
+            'shadow_wait_ms': {'p50': percentile(waits, 50), 'p95': percentile(waits, 95)},
+            'disagreements': [
+                {k: r[k] for k in ('job_id', 'filename', 'only_primary', 'only_shadow')}
+                for r in records[-20:] if not r['exact_match']
+            ],
+        }
@@ -0,0 +1,155 @@
+"""
+Paso de imágenes decodificadas entre procesos por memoria compartida.
+
+Con pickle, cada imagen (varios MB) se copia al serializar y otra vez al
+deserializar en el worker. Aquí el proceso que decodifica copia los píxeles
+una vez a un segmento de multiprocessing.shared_memory y solo envía el
+handle (nombre, forma y dtype); el worker lo abre sin copiar.
+
+El proceso que crea un segmento es su dueño y lo libera (release/close_all).
+Los nombres llevan el PID del dueño, así que los segmentos que quedan de un
+proceso muerto (crash de un worker o del proceso principal) se pueden
+detectar y borrar con cleanup_leaked().
+"""
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+
+SEGMENT_PREFIX = 'ocrimg_'
+# Linux expone los segmentos POSIX como archivos
+SHM_DIR = '/dev/shm'
+
+
+class SharedImage:
+    """Handle de una imagen en memoria compartida (lo único que viaja entre procesos)"""
+
+    def __init__(self, name: str, shape: tuple, dtype: str):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+    def to_dict(self) -> Dict:
+        return {'name': self.name, 'shape': list(self.shape), 'dtype': self.dtype}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SharedImage':
+        return cls(data['name'], tuple(data['shape']), data['dtype'])
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def attach(handle: SharedImage):
+    """
+    Abre una imagen compartida como array de solo lectura (sin copiar)
+
+    El array solo es válido dentro del bloque; si se necesita después, copiarlo.
+    """
+    segment = shared_memory.SharedMemory(name=handle.name)
+    try:
+        array = np.ndarray(handle.shape, dtype=handle.dtype, buffer=segment.buf)
+        array.flags.writeable = False
+        yield array
+        del array
+    finally:
+        segment.close()
+
+
+class ShmTransport:
+    """Crea y libera los segmentos de memoria compartida de este proceso"""
+
+    def __init__(self, prefix: str = SEGMENT_PREFIX, logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            prefix: Prefijo de los nombres de segmento (identifica los de este servicio)
+            logger: Logger, crea uno si no se da
+        """
+        self.prefix = prefix
+        self.logger = logger or logging.getLogger(__name__)
+        self._owned: Dict[str, shared_memory.SharedMemory] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def owned_bytes(self) -> int:
+        with self._lock:
+            return sum(segment.size for segment in self._owned.values())
+
+    def put(self, array: np.ndarray) -> SharedImage:
+        """Copia el array a un segmento nuevo y devuelve su handle"""
+        name = f"{self.prefix}{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        segment = shared_memory.SharedMemory(name=name, create=True, size=max(1, array.nbytes))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+        shared[...] = array
+        del shared
+        with self._lock:
+            self._owned[name] = segment
+        return SharedImage(name, array.shape, array.dtype.str)
+
+    def release(self, handle: SharedImage):
+        """Libera un segmento propio (los workers que lo tengan abierto conservan su vista)"""
+        with self._lock:
+            segment = self._owned.pop(handle.name, None)
+        if segment is None:
+            return
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close_all(self):
+        """Libera todos los segmentos creados por este proceso"""
+        with self._lock:
+            names = list(self._owned)
+        for name in names:
+            self.release(SharedImage(name, (0,), 'uint8'))
+
+    def cleanup_leaked(self) -> int:
+        """
+        Borra los segmentos de este prefijo cuyo proceso dueño ya no existe
+
+        Solo en plataformas que exponen los segmentos en /dev/shm (Linux); en el
+        resto devuelve 0.
+
+        Returns:
+            Número de segmentos borrados
+        """
+        if not os.path.isdir(SHM_DIR):
+            return 0
+        removed = 0
+        for filename in os.listdir(SHM_DIR):
+            if not filename.startswith(self.prefix):
+                continue
+            pid_part = filename[len(self.prefix):].split('_', 1)[0]
+            if not pid_part.isdigit() or _pid_alive(int(pid_part)):
+                continue
+            try:
+                segment = shared_memory.SharedMemory(name=filename)
+                segment.close()
+                segment.unlink()
+                removed += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                self.logger.warning(f"Could not remove leaked segment {filename}: {e}")
+        if removed:
+            self.logger.info(f"Removed {removed} leaked shared-memory segments")
+        return removed
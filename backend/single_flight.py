@@ -0,0 +1,107 @@
+"""
+Deduplicación de OCR en curso ("single flight") por contenido de la imagen.
+
+Cuando el frontend reintenta o dos operadores suben la misma captura a la vez,
+la segunda petición no lanza otra vez el pipeline: espera al cálculo que ya está
+en curso para ese contenido y recibe su resultado. La clave es el hash de los
+bytes (o de los píxeles, para intermedios en caché) más los parámetros que
+cambian el resultado; cada petición conserva su propio job_id y archivo.
+
+Solo se comparten cálculos simultáneos: al terminar, la clave se libera (la
+reutilización posterior es cosa del índice de resultados, phash_index).
+"""
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def array_digest(array: np.ndarray) -> str:
+    """SHA-256 de los píxeles (y la forma) de una imagen"""
+    digest = hashlib.sha256(f"{array.shape}{array.dtype}".encode('ascii'))
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+class _Call:
+    """Un cálculo en curso y su resultado (o excepción) para quienes esperan"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Ejecuta como mucho un cálculo a la vez por clave; el resto espera y comparte el resultado"""
+
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            logger: Logger, crea uno si no se da
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Resultado de fn() para la clave, compartido con las llamadas simultáneas
+
+        Si ya hay un cálculo en curso con la misma clave se espera a que termine y
+        se devuelve su resultado (el mismo objeto: quien lo vaya a modificar debe
+        copiarlo) o se relanza su excepción.
+
+        Returns:
+            Tuple (resultado, compartido): compartido=True si se esperó a otro cálculo
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            self.logger.info(f"Waiting for in-flight OCR of {key[:24]}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self.executed += 1
+            if call.waiters:
+                self.logger.info(f"In-flight OCR of {key[:24]} shared with {call.waiters} requests")
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'executed': self.executed, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
@@ -0,0 +1,151 @@
+"""
+Grafo declarativo de etapas del pipeline OCR con intermedios memoizados.
+
+Cada etapa declara de qué otras depende y una función que calcula su valor a
+partir de ellas. Una ejecución (StageRun) es por petición: calcula cada etapa
+como mucho una vez, bajo demanda, y la comparte con todos los candidatos que
+la piden (la ruta rápida, el OCR simple y el preprocesado leen el mismo gris,
+la misma polaridad y la misma imagen invertida). Los reconocimientos también
+se memoizan por (etapa de la imagen, idioma, config).
+
+Cada etapa se cronometra por separado y se puede sustituir en el grafo
+(replace) sin tocar el resto, p. ej. para probar otro filtro de ruido:
+
+    service.stage_graph.replace('denoise', lambda run, image: cv2.medianBlur(image, 3))
+"""
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class Stage:
+    """Una etapa: nombre, etapas de entrada y función fn(run, *entradas)"""
+
+    def __init__(self, name: str, inputs: Tuple[str, ...], fn: Callable):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.fn = fn
+
+
+class StageGraph:
+    """Etapas del pipeline por nombre, más la función de reconocimiento"""
+
+    def __init__(self, stages: Iterable[Stage] = (), recognizer: Optional[Callable] = None):
+        """
+        Args:
+            stages: Etapas del grafo
+            recognizer: fn(run, imagen, lang, config) -> (texto, confianza) para StageRun.recognize
+        """
+        self._stages: Dict[str, Stage] = {}
+        for stage in stages:
+            self.add(stage)
+        self.recognizer = recognizer
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._stages
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._stages)
+
+    def add(self, stage: Stage):
+        """Añade una etapa; las entradas que no son etapas deben sembrarse al crear la ejecución"""
+        self._stages[stage.name] = stage
+
+    def stage(self, name: str) -> Stage:
+        return self._stages[name]
+
+    def replace(self, name: str, fn: Callable, inputs: Optional[Tuple[str, ...]] = None):
+        """
+        Sustituye la función de una etapa (y opcionalmente sus entradas)
+
+        Raises:
+            KeyError: Si la etapa no existe
+        """
+        current = self._stages[name]
+        self._stages[name] = Stage(name, current.inputs if inputs is None else inputs, fn)
+
+    def run(self, buffers=None, on_timing: Optional[Callable[[str, float], None]] = None,
+            **values) -> 'StageRun':
+        """Ejecución nueva con valores sembrados (p. ej. path=..., o gray=... ya calculado)"""
+        return StageRun(self, values, buffers=buffers, on_timing=on_timing)
+
+
+class StageRun:
+    """Valores de las etapas para una petición (cada una se calcula como mucho una vez)"""
+
+    def __init__(self, graph: StageGraph, values: Optional[Dict[str, Any]] = None, buffers=None,
+                 on_timing: Optional[Callable[[str, float], None]] = None):
+        """
+        Args:
+            graph: Grafo de etapas
+            values: Valores sembrados (entradas o etapas ya calculadas en otro lado)
+            buffers: Buffers de trabajo de las etapas (PreprocessBuffers)
+            on_timing: Se llama con (etapa, ms) cada vez que se calcula una etapa
+        """
+        self.graph = graph
+        self.buffers = buffers
+        self.on_timing = on_timing
+        self._values: Dict[str, Any] = dict(values or {})
+        self._recognized: Dict[Tuple[str, str, str], Tuple[str, float]] = {}
+        self._computing: set = set()
+        # Orden de cálculo y ms propios de cada etapa (sin contar sus entradas)
+        self.timings: Dict[str, float] = {}
+        # Prefijo de las imágenes de debug de la petición (lo fija quien crea la ejecución)
+        self.debug_prefix: Optional[str] = None
+
+    def has(self, name: str) -> bool:
+        """True si la etapa ya está calculada (o sembrada)"""
+        return name in self._values
+
+    def peek(self, name: str, default: Any = None) -> Any:
+        """Valor de la etapa si ya está calculada, sin calcularla"""
+        return self._values.get(name, default)
+
+    def get(self, name: str) -> Any:
+        """
+        Valor de una etapa, calculándola (con sus entradas) si hace falta
+
+        Raises:
+            KeyError: Si no es una etapa del grafo ni un valor sembrado
+            ValueError: Si hay un ciclo entre etapas
+        """
+        if name in self._values:
+            return self._values[name]
+        if name not in self.graph:
+            raise KeyError(f"Unknown stage or missing input: {name}")
+        if name in self._computing:
+            raise ValueError(f"Cycle in stage graph at {name}")
+        stage = self.graph.stage(name)
+        self._computing.add(name)
+        try:
+            inputs = [self.get(dependency) for dependency in stage.inputs]
+            start = time.perf_counter()
+            value = stage.fn(self, *inputs)
+            self._record(name, (time.perf_counter() - start) * 1000)
+        finally:
+            self._computing.discard(name)
+        self._values[name] = value
+        return value
+
+    def recognized(self, image_stage: str, lang: str, config: str) -> bool:
+        """True si ese reconocimiento ya se hizo en esta ejecución"""
+        return (image_stage, lang, config) in self._recognized
+
+    def recognize(self, image_stage: str, lang: str, config: str) -> Tuple[str, float]:
+        """Reconocimiento (texto, confianza) de una etapa, memoizado por (etapa, idioma, config)"""
+        key = (image_stage, lang, config)
+        if key not in self._recognized:
+            image = self.get(image_stage)
+            start = time.perf_counter()
+            self._recognized[key] = self.graph.recognizer(self, image, lang, config)
+            self._record('recognize', (time.perf_counter() - start) * 1000)
+        return self._recognized[key]
+
+    def _record(self, name: str, elapsed_ms: float):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+        if self.on_timing is not None:
+            self.on_timing(name, elapsed_ms)
+
+    def summary(self) -> str:
+        """Tiempos por etapa para el log, p. ej. 'decode=12ms gray=1ms ...'"""
+        return ' '.join(f"{name}={ms:.0f}ms" for name, ms in self.timings.items())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del backend se importan por nombre (from ocr_service import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,29 @@
+"""Archivo de la caché de líneas compartido entre procesos (servidor y batch_ocr)"""
+import json
+
+from line_cache import LineCropCache
+
+
+def _record(key):
+    return {'key': key, 'text': f"texto {key}", 'conf': 90.0, 'job': None}
+
+
+def _keys(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['key'] for line in f]
+
+
+def test_compaction_keeps_lines_appended_by_other_instances(tmp_path):
+    path = str(tmp_path / 'line_cache.jsonl')
+    server = LineCropCache(path, 'v1', max_entries=5)
+    batch = LineCropCache(path, 'v1', max_entries=5)
+
+    server.put_many([_record(f"s{i}") for i in range(10)])
+    batch.put_many([_record('b0')])
+    # 12 registros > 2 * max_entries: el servidor compacta sin tener b0 en memoria
+    server.put_many([_record('s10')])
+
+    assert _keys(path) == ['s7', 's8', 's9', 'b0', 's10']
+    assert server.get('b0') is not None
+    assert not list(tmp_path.glob('*.tmp'))
+    assert LineCropCache(path, 'v1', max_entries=5).get('b0') is not None
@@ -0,0 +1,35 @@
+"""Lazo abierto de load_test: las llegadas que el cliente no puede enviar no desaparecen del reporte"""
+import time
+
+import load_test
+
+
+class SlowReplayer(load_test.Replayer):
+    """Replayer sin red: cada petición tarda `service_s`"""
+
+    def __init__(self, service_s, timeout):
+        super().__init__('http://127.0.0.1:1', [], ['ocr-text'], {}, timeout)
+        self.service_s = service_s
+
+    def next_request(self):
+        return 'ocr-text', ('cap.png', b'')
+
+    def send(self, endpoint, payload, scheduled_at=None):
+        time.sleep(self.service_s)
+        record = {'endpoint': endpoint, 'status': 200, 'error': None, 'reused': False, 'partial': False,
+                  'censored': False, 'latency_ms': (time.perf_counter() - scheduled_at) * 1000}
+        with self._lock:
+            self.records.append(record)
+
+
+def test_client_drops_count_as_errors_and_censored_latency():
+    replayer = SlowReplayer(service_s=0.3, timeout=5.0)
+    summary = load_test.run_open_loop(replayer, rate=200, duration=0.5, max_in_flight=2)
+
+    assert summary['dropped_by_client'] > 0
+    assert summary['errors']['dropped_by_client'] == summary['dropped_by_client']
+    assert summary['requests'] == summary['ok'] + summary['dropped_by_client']
+    assert summary['error_rate'] > 0.5
+    assert summary['censored'] == summary['dropped_by_client']
+    # La mayoría de las llegadas se descartó: la mediana es el timeout, no la latencia de las pocas enviadas
+    assert summary['latency_ms']['p50'] == 5000.0
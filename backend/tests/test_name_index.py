@@ -0,0 +1,69 @@
+"""Búsquedas en frío en el índice de clientes: mismo resultado que Dice por fuerza bruta y por debajo de 1 ms"""
+import random
+import statistics
+import time
+
+import pytest
+
+from name_index import ClientNameIndex, normalize_name, trigrams
+
+FIRST = ['CARLOS', 'MARIA', 'JOSE', 'JUAN', 'ANA', 'LUIS', 'PEDRO', 'JORGE', 'ROSA', 'CARMEN', 'MIGUEL',
+         'FERNANDO', 'LAURA', 'SOFIA', 'DIEGO', 'ANDRES', 'PATRICIA', 'RICARDO', 'ELENA', 'MANUEL']
+LAST = ['GARCIA', 'MARTINEZ', 'LOPEZ', 'GONZALEZ', 'RODRIGUEZ', 'FERNANDEZ', 'PEREZ', 'SANCHEZ', 'RAMIREZ',
+        'TORRES', 'FLORES', 'RIVERA', 'GOMEZ', 'DIAZ', 'REYES', 'MORALES', 'CRUZ', 'ORTIZ', 'GUTIERREZ',
+        'CHAVEZ', 'RAMOS', 'RUIZ', 'HERNANDEZ', 'JIMENEZ', 'MENDOZA', 'ALVAREZ', 'CASTILLO', 'ROMERO',
+        'VARGAS', 'LEON']
+CLIENTS = 5000
+
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    rng = random.Random(1)
+    names = set()
+    while len(names) < CLIENTS:
+        parts = [rng.choice(FIRST), rng.choice(LAST)] + ([rng.choice(LAST)] if rng.random() < 0.7 else [])
+        names.add(' '.join(parts))
+    path = tmp_path_factory.mktemp('clients') / 'clientes.csv'
+    path.write_text('id,nombre\n' + ''.join(f"{i},{name}\n" for i, name in enumerate(sorted(names))),
+                    encoding='utf-8')
+    return ClientNameIndex(str(path))
+
+
+def _cold_queries(index, count=300):
+    """Nombres de la lista con dos caracteres mal leídos, sin repetir (ni memo ni coincidencia exacta)"""
+    rng = random.Random(2)
+    names = sorted(name for _, name in index._entries)
+    queries = set()
+    while len(queries) < count:
+        chars = list(rng.choice(names))
+        for _ in range(2):
+            chars[rng.randrange(len(chars))] = rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ10')
+        query = ''.join(chars)
+        if normalize_name(query) not in index._exact:
+            queries.add(query)
+    return sorted(queries)
+
+
+def _brute_force_best(index, name):
+    query = trigrams(normalize_name(name))
+    best = 0.0
+    for _, grams in index._entries.values():
+        best = max(best, 2.0 * len(query & grams) / (len(query) + len(grams)))
+    return round(best, 3) if best >= index.min_score else None
+
+
+def test_cold_search_matches_brute_force(index):
+    for query in _cold_queries(index, 100):
+        matches = index.search(query, limit=1)
+        assert (matches[0][2] if matches else None) == _brute_force_best(index, query)
+
+
+def test_cold_search_is_sub_millisecond(index):
+    index.search('WARMUP')  # compila las listas una vez
+    timings = []
+    for query in _cold_queries(index):
+        start = time.perf_counter()
+        index.search(query, limit=1)
+        timings.append((time.perf_counter() - start) * 1000)
+    assert len(index) == CLIENTS
+    assert statistics.median(timings) < 1.0, f"median {statistics.median(timings):.3f} ms"
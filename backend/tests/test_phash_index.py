@@ -0,0 +1,76 @@
+"""Límites del índice de hashes perceptuales: decodificación con presupuesto, tamaño y antigüedad"""
+import json
+import os
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+import pytest
+
+from phash_index import PerceptualHashIndex
+
+
+def _capture(path, seed):
+    rng = np.random.default_rng(seed)
+    image = np.full((400, 600), 255, dtype=np.uint8)
+    for i in range(6):
+        cv2.putText(image, f"T10{i}026-CLIENTE_{rng.integers(1000)}-{rng.integers(50)}M", (10, 50 + 55 * i),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2)
+    cv2.imwrite(str(path), image)
+    return str(path)
+
+
+def _add(index, path, **extra):
+    signature = index.compute(path)
+    return index.add(signature, dict({'filename': os.path.basename(path), 'ocr_results': {}, 'jobs': []}, **extra),
+                     'balanced')
+
+
+def _lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_images_are_decoded_with_the_given_loader(tmp_path):
+    calls = []
+
+    def loader(path):
+        calls.append(path)
+        raise ValueError("Image too large")
+
+    index = PerceptualHashIndex(str(tmp_path / 'phash_index.jsonl'), loader=loader)
+    with pytest.raises(ValueError):
+        index.compute(_capture(tmp_path / 'a.png', 0))
+    assert calls == [str(tmp_path / 'a.png')]
+
+
+def test_max_entries_compacts_file_and_references(tmp_path):
+    path = str(tmp_path / 'phash_index.jsonl')
+    index = PerceptualHashIndex(path, max_entries=10)
+    for i in range(12):
+        _add(index, _capture(tmp_path / f"{i}.png", i))
+
+    # 12 > 10 + 10% -> se quedan los 10 más recientes
+    records = _lines(path)
+    assert [r['filename'] for r in records] == [f"{i}.png" for i in range(2, 12)]
+    assert sorted(os.listdir(index.reference_dir)) == sorted(r['reference'] for r in records)
+    assert index.lookup(index.compute(str(tmp_path / '0.png')), 'balanced') is None
+    assert index.lookup(index.compute(str(tmp_path / '11.png')), 'balanced') is not None
+
+    # Al recargar se mantiene lo mismo
+    assert len(PerceptualHashIndex(path, max_entries=10)._records) == 10
+
+
+def test_expired_records_are_not_reused_and_dropped_on_load(tmp_path):
+    path = str(tmp_path / 'phash_index.jsonl')
+    index = PerceptualHashIndex(path, max_age_days=30)
+    old = (datetime.now() - timedelta(days=31)).isoformat()
+    _add(index, _capture(tmp_path / 'old.png', 1), indexed_at=old)
+    _add(index, _capture(tmp_path / 'new.png', 2))
+
+    assert index.lookup(index.compute(str(tmp_path / 'old.png')), 'balanced') is None
+    assert index.lookup(index.compute(str(tmp_path / 'new.png')), 'balanced') is not None
+
+    reloaded = PerceptualHashIndex(path, max_age_days=30)
+    assert [r['filename'] for r in _lines(path)] == ['new.png']
+    assert len(os.listdir(reloaded.reference_dir)) == 1
@@ -0,0 +1,92 @@
+"""Las respuestas de api_response tienen los mismos bytes que jsonify salvo que se pida otra forma"""
+import gzip
+import json
+
+import pytest
+from flask import Flask, jsonify
+
+import response_shaping
+from response_shaping import api_response
+
+UPLOAD_PREVIEW = {
+    'success': True,
+    'job_id': 'JOB-20251010-1A2B3C4D',
+    'filename': '20251010_123058_captura.png',
+    'filepath': 'uploads/20251010_123058_captura.png',
+    'processed_at': '2025-10-10T12:30:58.123456',
+    'ocr_results': {
+        'client_name': 'Carlos León',
+        'detected_text': 'T101025-CARLOS_LEON-20M\nT101025-MARÍA_PEÑA-2.5M\nParámetros: ñ ü € 😀 "comillas" \\ \t\x7f',
+        'confidence': 85.24,
+        'partial': False,
+        'status': 'ok',
+        'orientation': None,
+    },
+    'jobs': [
+        {'job_code': 'T101025', 'client_name': 'Carlos Leon', 'quantity_m': 20.0, 'unit': 'm', 'match_score': 0.875},
+        {'job_code': 'T101025', 'client_name': 'María Peña', 'quantity_m': 2.5, 'unit': 'm', 'match_score': 1.0},
+    ] * 20,
+    'reused_ocr': False,
+    'coalesced_ocr': False,
+}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+
+    @app.route('/payload', methods=['POST'])
+    def payload():
+        return api_response(json.loads(app.config['PAYLOAD']))
+
+    return app
+
+
+def _bodies(app, data, **kwargs):
+    """(cuerpo de api_response, cuerpo de jsonify) para los mismos datos"""
+    app.config['PAYLOAD'] = json.dumps(data)
+    with app.app_context():
+        expected = jsonify(json.loads(app.config['PAYLOAD'])).get_data()
+    response = app.test_client().post('/payload', **kwargs)
+    return response, expected
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def serializer(request, monkeypatch):
+    if request.param == 'orjson':
+        if response_shaping.orjson is None:
+            pytest.skip('orjson no instalado')
+    else:
+        monkeypatch.setattr(response_shaping, 'orjson', None)
+    return request.param
+
+
+def test_default_output_matches_jsonify(app, serializer):
+    response, expected = _bodies(app, UPLOAD_PREVIEW)
+    assert response.get_data() == expected
+    assert response.mimetype == 'application/json'
+    assert 'Content-Encoding' not in response.headers
+
+
+@pytest.mark.parametrize('value', [1e-05, 1e16, 123456789012345678901234567890, 0.0001, -0.0])
+def test_default_numbers_match_jsonify(app, serializer, value):
+    response, expected = _bodies(app, {'value': value, 'nested': [{'v': value}]})
+    assert response.get_data() == expected
+
+
+def test_fields_and_exclude(app, serializer):
+    response, _ = _bodies(app, UPLOAD_PREVIEW, query_string={'fields': 'job_id,ocr_results.status'})
+    assert response.get_json() == {'job_id': UPLOAD_PREVIEW['job_id'], 'ocr_results': {'status': 'ok'}}
+
+    response, _ = _bodies(app, UPLOAD_PREVIEW, query_string={'exclude': 'ocr_results.detected_text,filepath'})
+    body = response.get_json()
+    assert 'filepath' not in body and 'detected_text' not in body['ocr_results']
+    assert body['jobs'] == UPLOAD_PREVIEW['jobs']
+    assert body['ocr_results']['client_name'] == 'Carlos León'
+
+
+def test_gzip_when_accepted(app):
+    response, expected = _bodies(app, UPLOAD_PREVIEW, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == expected
+    assert response.headers['Vary'] == 'Accept-Encoding'
@@ -0,0 +1,80 @@
+"""El OCR no escribe nada junto a las imágenes de entrada (carpetas vigiladas, archivos de lotes)"""
+import argparse
+import hashlib
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import batch_ocr
+import ocr_service
+
+
+def _tree_digest(root):
+    digests = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                digests[os.path.relpath(path, root)] = (hashlib.sha256(f.read()).hexdigest(), os.stat(path).st_mtime_ns)
+    return digests
+
+
+def _dark_capture(path):
+    """Captura de chat: texto claro sobre fondo oscuro (se invierte en el preprocesado)"""
+    image = np.full((300, 900), 25, dtype=np.uint8)
+    for i in range(4):
+        cv2.putText(image, f"T10{i}026-CLIENTE_{i}-20M", (20, 60 + 60 * i),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, 230, 2)
+    cv2.imwrite(path, image)
+
+
+@pytest.fixture
+def no_tesseract(tmp_path, monkeypatch):
+    """OCRService sin Tesseract: nada pasa los umbrales, así que se recorre el pipeline completo"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('OCR_LINE_CACHE', '0')
+    monkeypatch.setattr(ocr_service.OCRService, '_verify_tesseract', lambda self: None)
+    monkeypatch.setattr(ocr_service.OCRService, '_recognize', lambda self, image, **kwargs: ('', 0.0))
+    monkeypatch.setattr(ocr_service.OCRService, '_recognize_many',
+                        lambda self, images, **kwargs: [('', 0.0) for _ in images])
+    monkeypatch.setattr(ocr_service.OCRService, '_recognize_job_codes',
+                        lambda self, images, **kwargs: [('', 0.0) for _ in images])
+
+
+@pytest.fixture
+def service(no_tesseract, tmp_path):
+    return ocr_service.OCRService(cache_dir=str(tmp_path / 'ocr_cache'))
+
+
+@pytest.mark.parametrize('name', ['cap.png', 'CAP.PNG', 'cap.JPG', 'cap.jpeg'])
+def test_dark_capture_is_not_overwritten(service, tmp_path, name):
+    watched = tmp_path / 'watched'
+    watched.mkdir()
+    _dark_capture(str(watched / name))
+    before = _tree_digest(str(watched))
+
+    service.extract_job_details(str(watched / name))
+
+    assert _tree_digest(str(watched)) == before
+    assert any('_02_inverted' in f for f in os.listdir(service.debug_dir))
+
+
+def test_batch_run_leaves_source_tree_identical(no_tesseract, tmp_path):
+    archive = tmp_path / 'archivo'
+    (archive / '2025-10').mkdir(parents=True)
+    for name in ['a.png', 'B.PNG', 'c.jpg']:
+        _dark_capture(str(archive / '2025-10' / name))
+    before = _tree_digest(str(archive))
+    output = str(tmp_path / 'resultados.jsonl')
+    args = argparse.Namespace(source=str(archive / '*' / '*'), limit=0, checkpoint='', output=output,
+                              format='jsonl', processes=0, workers=2)
+
+    assert batch_ocr.run(args) == 0
+    assert _tree_digest(str(archive)) == before
+
+    # Al reanudar, las claves de checkpoint (tamaño/mtime) siguen coincidiendo: nada se repite
+    assert batch_ocr.run(args) == 0
+    with open(output, encoding='utf-8') as f:
+        assert len(f.readlines()) == 3
@@ -0,0 +1,166 @@
+"""
+Vigilancia de carpetas compartidas para adelantar el OCR de las capturas.
+
+Los operadores dejan las descargas de WhatsApp y las capturas en una carpeta y
+luego las suben a mano; el watcher las detecta, espera a que terminen de
+escribirse y las procesa en segundo plano, de modo que la subida posterior de
+la misma imagen se resuelve con el índice de resultados.
+
+El OCR en segundo plano cede el paso: no empieza una imagen mientras haya
+llamadas OCR interactivas en curso y la procesa en un slot de fondo de
+ThreadBudget (menos hilos, tesseract con nice y espera entre etapas si entra
+una petición interactiva).
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from ocr_service import ThreadBudget
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff')
+
+
+class FolderWatcher:
+    """Sondea carpetas y pasa las imágenes nuevas, ya estables, a un worker de baja prioridad"""
+
+    def __init__(self, directories: Iterable[str], process: Callable[[str], object],
+                 thread_budget: ThreadBudget, poll_interval: float = 2.0, settle_seconds: float = 3.0,
+                 max_queue: int = 100, logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            directories: Carpetas a vigilar (no recursivo)
+            process: Función que hace el OCR de una ruta y guarda el resultado
+            thread_budget: Presupuesto de hilos del servicio OCR (para ceder ante peticiones interactivas)
+            poll_interval: Segundos entre sondeos
+            settle_seconds: Segundos que tamaño y mtime deben quedar quietos antes de procesar
+            max_queue: Máximo de imágenes en cola; lo que no cabe se reintenta en el siguiente sondeo
+            logger: Logger, crea uno si no se da
+        """
+        self.directories = [d for d in directories if d]
+        self.process = process
+        self.thread_budget = thread_budget
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.logger = logger or logging.getLogger(__name__)
+        self._queue: 'queue.Queue[Tuple[str, Tuple[int, float]]]' = queue.Queue(maxsize=max_queue)
+        # ruta -> (tamaño, mtime, instante desde el que no cambia)
+        self._candidates: Dict[str, Tuple[int, float, float]] = {}
+        self._queued: Set[str] = set()
+        self._done: Dict[str, Tuple[int, float]] = {}
+        self._stop = threading.Event()
+        self._threads = []
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        """Arranca el sondeo y el worker (hilos daemon)"""
+        if self._threads:
+            return
+        for directory in self.directories:
+            os.makedirs(directory, exist_ok=True)
+        for target, name in ((self._poll_loop, 'ocr-watch-poll'), (self._work_loop, 'ocr-watch-worker')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"Watching {len(self.directories)} folders for new captures: {self.directories}")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def _scan(self) -> Dict[str, Tuple[int, float]]:
+        found = {}
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                self.logger.warning(f"Cannot scan {directory}: {e}")
+                continue
+            for entry in entries:
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or '_inverted' in entry.name:
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if entry.is_file() and st.st_size > 0:
+                    found[entry.path] = (st.st_size, st.st_mtime)
+        return found
+
+    def poll_once(self):
+        """Un sondeo: actualiza candidatos y encola los que ya no cambian"""
+        now = time.monotonic()
+        found = self._scan()
+
+        # Olvidar archivos borrados
+        for path in list(self._candidates):
+            if path not in found:
+                del self._candidates[path]
+        for path in list(self._done):
+            if path not in found:
+                del self._done[path]
+
+        for path, stat in found.items():
+            if self._done.get(path) == stat or path in self._queued:
+                continue
+            previous = self._candidates.get(path)
+            if previous is None or previous[:2] != stat:
+                # Nuevo o todavía escribiéndose: reiniciar la espera
+                self._candidates[path] = (stat[0], stat[1], now)
+                continue
+            if now - previous[2] < self.settle_seconds:
+                continue
+            try:
+                self._queue.put_nowait((path, stat))
+            except queue.Full:
+                # Se reintenta en el siguiente sondeo
+                break
+            self._queued.add(path)
+            del self._candidates[path]
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.logger.error(f"Folder watcher poll failed: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def _wait_for_idle(self) -> bool:
+        """Espera a que no haya OCR interactivo en curso; False si se pidió parar"""
+        while not self.thread_budget.wait_idle(timeout=self.poll_interval):
+            if self._stop.is_set():
+                return False
+        return not self._stop.is_set()
+
+    def _work_loop(self):
+        while not self._stop.is_set():
+            try:
+                path, stat = self._queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            try:
+                if not self._wait_for_idle():
+                    return
+                start = time.perf_counter()
+                with self.thread_budget.slot(background=True):
+                    self.process(path)
+                self.processed += 1
+                self.logger.info(f"Background OCR done for {os.path.basename(path)} "
+                                 f"in {time.perf_counter() - start:.2f}s ({self.queued} queued)")
+            except Exception as e:
+                self.failed += 1
+                self.logger.error(f"Background OCR failed for {path}: {e}")
+            finally:
+                self._done[path] = stat
+                self._queued.discard(path)
+                self._queue.task_done()